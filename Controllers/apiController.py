@@ -1,30 +1,157 @@
-from typing import Dict, List, Any
+from typing import Dict, List, Any, AsyncIterator, Tuple
+import asyncio
+import hashlib
+import html
+import json
+import logging
+import os
+import re
 
 from fastapi import HTTPException, status, FastAPI, Request
 from pydantic import BaseModel
+from pymongo import InsertOne, UpdateOne, DeleteMany
+from bson import ObjectId
 
 
-from Model.pluginModel import Model
+from Model.pluginModel import AsyncModel
+from Model.embeddingModel import embed
+from Model.retrieverModel import retriever
+from Model.lexicalIndexModel import lexical_index
+from Model.cacheModel import answer_cache
+from Model.metricsModel import timed
+from Model.vectorCodec import encode_vector
 
-collection = Model()
+logger = logging.getLogger(__name__)
 
-class WooCommerceProducts(BaseModel):
+# Number of write operations sent per bulk_write call
+BULK_WRITE_BATCH_SIZE = int(os.getenv("BULK_WRITE_BATCH_SIZE", "500"))
+# Products embedded and written together by streaming (NDJSON) syncs
+CATALOG_STREAM_BATCH_SIZE = int(os.getenv("CATALOG_STREAM_BATCH_SIZE", "1000"))
+# Longest NDJSON line accepted: one product or one page of products
+NDJSON_MAX_LINE_BYTES = int(os.getenv("NDJSON_MAX_LINE_BYTES", str(16 * 1024 * 1024)))
+
+class WooCommerceSite(BaseModel):
     site_url: str
     site_id: str
+
+class WooCommerceProducts(WooCommerceSite):
+    products: List[Dict[str, Any]]
+
+class WooCommerceProductPage(BaseModel):
     products: List[Dict[str, Any]]
 
-async def generate_embeddings(text:str):
-    model =SentenceTransformer('sentence-transformers/all-MiniLM-L6-v2')
-    embeddings = model.encode(text)
-    print("embedding generation complete")
-    print(embeddings)
-    return embeddings
 
-async def process_woocommerce_products(request: Request):
+HTML_DROP = re.compile(r"<(script|style)\b[^>]*>.*?</\1\s*>|<!--.*?-->", re.IGNORECASE | re.DOTALL)
+HTML_BREAK = re.compile(r"<\s*(br|/p|/div|/li|/h[1-6]|/tr)\b[^>]*>", re.IGNORECASE)
+HTML_TAG = re.compile(r"<[^>]+>")
+
+
+def clean_text(value) -> str:
+    """
+    Plain text of a WooCommerce field: HTML tags and comments removed,
+    entities decoded and whitespace collapsed (line breaks kept).
+    """
+    if value is None:
+        return ""
+    text = str(value)
+    if "<" in text:
+        text = HTML_DROP.sub(" ", text)
+        text = HTML_BREAK.sub("\n", text)
+        text = HTML_TAG.sub(" ", text)
+    text = html.unescape(text)
+    lines = (" ".join(line.split()) for line in text.splitlines())
+    return "\n".join(line for line in lines if line)
+
+
+def build_product_data(product: Dict[str, Any], site_id: str) -> Dict[str, Any]:
+    """
+    Maps a WooCommerce product from the plugin into the document we store.
+    Text fields are cleaned here once, so neither embedding nor prompts
+    see WooCommerce HTML.
+    """
+    product_data = {
+        "name": clean_text(product.get("title")),  # Assuming "title" is the product name
+        "permalink": str(product.get("link") or "").strip(),  # Assuming "link" is the permalink
+        "description": clean_text(product.get("description")),
+        "short_description": clean_text(product.get("short_description")),
+        "price": clean_text(product.get("price")),
+        "sku": clean_text(product.get("sku")),
+        "stock_status": clean_text(product.get("stock_status")),
+        "for":"WooCommerce",
+        "site_id": site_id
+    }
+
+    # Create combined description field
+    product_data["combined_description"] = f"{product_data['name']} {product_data['description']} {product_data['short_description']}. The price is {product_data['price']} {product_data['stock_status']}"
+
+    # Stable identity of the product across syncs, and a hash of what gets embedded
+    product_data["product_key"] = str(product.get("id") or product_data["permalink"] or product_data["name"])
+    hashed = product_data["combined_description"]
+    if product_data["sku"]:
+        # Not embedded, but searched by the lexical index
+        hashed += f"\nSKU: {product_data['sku']}"
+    product_data["content_hash"] = hashlib.sha256(hashed.encode("utf-8")).hexdigest()
+    return product_data
+
+
+async def bulk_write_in_batches(collection, operations: list, batch_size: int = BULK_WRITE_BATCH_SIZE):
+    """Sends write operations to MongoDB in unordered bulk_write batches."""
+    for start in range(0, len(operations), batch_size):
+        await collection.bulk_write(operations[start:start + batch_size], ordered=False)
+
+
+async def load_stored_products(collection, site_id: str):
+    """
+    Loads the id, product_key and content_hash of a site's stored products.
+
+    Returns:
+        tuple: ({product_key: doc}, ids of stale documents to delete:
+        products stored before they had a product_key and content_hash,
+        and any extra copy of a key).
+    """
+    existing = {}
+    stale_ids = []
+    for doc in await collection.find(
+        {"site_id": site_id, "for": "WooCommerce"},
+        {"_id": 1, "product_key": 1, "content_hash": 1}
+    ).to_list(None):
+        key = doc.get("product_key")
+        if key is None or doc.get("content_hash") is None or key in existing:
+            stale_ids.append(doc["_id"])
+        else:
+            existing[key] = doc
+    return existing, stale_ids
+
+
+async def commit_product_indexes(site_id: str):
+    """Saves the vector and lexical index changes of a product sync, once it is over."""
+    try:
+        await retriever.commit(site_id, "WooCommerce")
+        await lexical_index.commit(site_id, "WooCommerce")
+    except Exception:
+        logger.exception("Failed to save the product indexes of site_id %s", site_id)
+
+
+async def parse_woocommerce_products(request: Request) -> WooCommerceProducts:
+    """Reads and validates the product payload sent by the WordPress plugin."""
     try:
         data = await request.json()
-        payload = WooCommerceProducts(**data)  # Validate the incoming data
+        return WooCommerceProducts(**data)  # Validate the incoming data
+    except Exception as e:
+        logger.warning("Invalid WooCommerce payload: %s", e)
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid WooCommerce payload: {str(e)}"
+        )
+
 
+async def sync_woocommerce_products(payload: WooCommerceProducts, job=None):
+    """
+    Syncs a site's stored products with the payload: only new or changed
+    products are embedded, removed ones are deleted. Progress is reported on
+    job when the sync runs as a background job.
+    """
+    try:
         site_url = payload.site_url
         site_id = payload.site_id
         products = payload.products
@@ -33,60 +160,341 @@ async def process_woocommerce_products(request: Request):
         if not site_url.endswith('/'):
             site_url = site_url + '/'
 
+        # Process the products received in the request; a repeated key keeps the last copy
+        incoming = {}
+        for product in products:
+            product_data = build_product_data(product, site_id)
+            incoming[product_data["product_key"]] = product_data
+
+        if job:
+            job.set_phase("loading")
+            job.set_total(len(incoming))
+        collection = AsyncModel()
         try:
-            delete_result = collection.delete_many({"site_id": site_id, "for": "WooCommerce"})
-            print(f"Deleted {delete_result.deleted_count} existing chunks for site_id: {site_id}")
+            existing, stale_ids = await load_stored_products(collection, site_id)
         except Exception as e:
-            print(f"Failed to delete existing chunks: {e}")
+            logger.error("Failed to load existing products for site_id %s: %s", site_id, e)
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail=f"Failed to clear existing chunks: {str(e)}"
+                detail=f"Failed to load existing products: {str(e)}"
             )
 
-        total_products_processed = 0
+        to_insert = [p for key, p in incoming.items() if key not in existing]
+        to_update = [p for key, p in incoming.items()
+                     if key in existing and existing[key].get("content_hash") != p["content_hash"]]
+        unchanged = len(incoming) - len(to_insert) - len(to_update)
+        removed_ids = [doc["_id"] for key, doc in existing.items() if key not in incoming] + stale_ids
 
-        # Process the products received in the request
-        for product in products:
-            # Extract required fields
-            product_data = {
-                "name": product.get("title", ""),  # Assuming "title" is the product name
-                "permalink": product.get("link", ""),  # Assuming "link" is the permalink
-                "description": product.get("description", ""),
-                "short_description": product.get("short_description", ""),
-                "price": product.get("price", ""),
-                "stock_status": product.get("stock_status", ""),
-                "for":"WooCommerce",
-                "site_id": site_id
-            }
-
-            # Create combined description field
-            product_data["combined_description"] = f"{product_data['name']} {product_data['description']} {product_data['short_description']}. The price is {product_data['price']} {product_data['stock_status']}"
-
-            # Generate embeddings for the combined description
-            vectors = await generate_embeddings(product_data["combined_description"])
-            embeddings = vectors.tolist()
-
-            # Add embeddings to product data
-            product_data["embeddings"] = embeddings
-
-            # Store in database
-            collection.insert_one(product_data)
-
-            total_products_processed += 1
-            print(f"total processed:{total_products_processed}")
+        # Only new or changed products are embedded, in batched forward passes
+        changed = to_insert + to_update
+        if job:
+            job.set_phase("embedding")
+            job.advance(unchanged)
+        with timed("embed", site_id):
+            vectors = await embed([p["combined_description"] for p in changed]) if changed else []
+        for product_data, vector in zip(changed, vectors):
+            product_data["embeddings"] = encode_vector(vector)
+
+        for product_data in to_insert:
+            product_data["_id"] = ObjectId()
+        changed_ids = [p["_id"] for p in to_insert] + [existing[p["product_key"]]["_id"] for p in to_update]
+
+        operations = [InsertOne(p) for p in to_insert]
+        operations += [UpdateOne({"_id": existing[p["product_key"]]["_id"]}, {"$set": p}) for p in to_update]
+        for start in range(0, len(removed_ids), BULK_WRITE_BATCH_SIZE):
+            operations.append(DeleteMany({"_id": {"$in": removed_ids[start:start + BULK_WRITE_BATCH_SIZE]}}))
+
+        if job:
+            job.set_phase("writing")
+        lexical_indexed = lexical_index.has_partition(site_id, "WooCommerce")
+        try:
+            await bulk_write_in_batches(collection, operations)
+            # Keep in-process vector indexes in step with the collection
+            await retriever.delete(site_id, "WooCommerce", removed_ids)
+            await retriever.upsert(site_id, "WooCommerce", changed_ids, vectors)
+            await lexical_index.delete(site_id, "WooCommerce", removed_ids)
+            if lexical_indexed:
+                await lexical_index.upsert(site_id, "WooCommerce", changed_ids, changed)
+            else:
+                # First sync with the lexical index: index the unchanged products too
+                await lexical_index.upsert(
+                    site_id, "WooCommerce",
+                    [p["_id"] if key not in existing else existing[key]["_id"] for key, p in incoming.items()],
+                    list(incoming.values())
+                )
+            await commit_product_indexes(site_id)
+            if operations:
+                await answer_cache.invalidate_site(site_id)
+        except Exception as e:
+            logger.error("Failed to write products for site_id %s: %s", site_id, e)
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"Failed to write products into database: {str(e)}"
+            )
+
+        total_products_processed = len(incoming)
+        if job:
+            job.advance(len(changed))
+        logger.info("Synced %d products for site_id %s: %d inserted, %d updated, %d deleted, %d unchanged",
+                    total_products_processed, site_id, len(to_insert), len(to_update), len(removed_ids), unchanged)
+
+        return {
+            "status": "success",
+            "products_processed": total_products_processed,
+            "inserted": len(to_insert),
+            "updated": len(to_update),
+            "deleted": len(removed_ids),
+            "unchanged": unchanged,
+            "message": f"Successfully processed {total_products_processed} products from WooCommerce"
+        }
+
+    except HTTPException as e:
+        logger.warning("WooCommerce sync failed: %s", e.detail)
+        raise e
+    except Exception as e:
+        logger.exception("WooCommerce sync failed")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error processing WooCommerce products: {str(e)}"
+        )
+
+
+def invalid_stream(message: str) -> HTTPException:
+    logger.warning("Invalid WooCommerce stream: %s", message)
+    return HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Invalid WooCommerce stream: {message}")
+
+
+async def iter_ndjson(request: Request):
+    """Yields (line number, value) for every non-empty line of an NDJSON body, as the body arrives."""
+    buffer = bytearray()
+    number = 0
+    scanned = 0
+    async for chunk in request.stream():
+        buffer += chunk
+        while True:
+            end = buffer.find(b"\n", scanned)
+            if end < 0:
+                scanned = len(buffer)
+                if scanned > NDJSON_MAX_LINE_BYTES:
+                    raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                                        detail=f"Line {number + 1} is longer than {NDJSON_MAX_LINE_BYTES} bytes")
+                break
+            line = bytes(buffer[:end])
+            del buffer[:end + 1]
+            scanned = 0
+            number += 1
+            if line.strip():
+                yield number, parse_ndjson_line(line, number)
+    if buffer.strip():
+        yield number + 1, parse_ndjson_line(bytes(buffer), number + 1)
+
+
+def parse_ndjson_line(line: bytes, number: int):
+    try:
+        return json.loads(line)
+    except ValueError as e:
+        raise invalid_stream(f"line {number} is not JSON: {e}")
+
+
+def line_products(value, number: int):
+    """The products of an NDJSON line: a page ({"products": [...]}) or a single product."""
+    if not isinstance(value, dict):
+        raise invalid_stream(f"line {number} is not a JSON object")
+    if "products" not in value:
+        return [value]
+    try:
+        return WooCommerceProductPage(products=value["products"]).products
+    except Exception as e:
+        raise invalid_stream(f"line {number}: {e}")
+
+
+async def parse_woocommerce_stream(request: Request) -> Tuple[WooCommerceSite, AsyncIterator[Dict[str, Any]]]:
+    """
+    Reads the first line of an NDJSON product stream: {"site_url",
+    "site_id"}, optionally with a first page of "products". Every later
+    line is a product or a page {"products": [...]}.
+
+    Returns:
+        tuple: (the site, async iterator over the products of the rest of
+        the body, parsed and validated one line at a time).
+    """
+    lines = iter_ndjson(request)
+    try:
+        number, header = await anext(lines)
+    except StopAsyncIteration:
+        raise invalid_stream("the body is empty")
+    if not isinstance(header, dict):
+        raise invalid_stream("line 1 is not a JSON object")
+    try:
+        site = WooCommerceSite(**header)
+    except Exception as e:
+        raise invalid_stream(f"line {number}: {e}")
+
+    async def products():
+        if "products" in header:
+            for product in line_products({"products": header["products"]}, number):
+                yield product
+        async for line_number, value in lines:
+            for product in line_products(value, line_number):
+                yield product
+
+    return site, products()
+
+
+async def stream_woocommerce_products(site: WooCommerceSite, products: AsyncIterator[Dict[str, Any]], job=None):
+    """
+    sync_woocommerce_products for a catalog streamed as NDJSON. Products
+    are compared with the stored ones as they arrive, and new or changed
+    ones are embedded and written every CATALOG_STREAM_BATCH_SIZE
+    products while the next batch is still being received. Only the id
+    and content hash of each product are kept for the whole sync.
+
+    Removed products are deleted once the stream is complete, so an
+    interrupted upload deletes nothing; the batches written before the
+    interruption stay written.
+    """
+    site_id = site.site_id
+    collection = AsyncModel()
+    wrote = False
+    try:
+        if job:
+            job.set_phase("loading")
+        try:
+            stored_docs, stale_ids = await load_stored_products(collection, site_id)
+            existing = {key: (doc["_id"], doc["content_hash"]) for key, doc in stored_docs.items()}
+            del stored_docs
+        except Exception as e:
+            logger.error("Failed to load existing products for site_id %s: %s", site_id, e)
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"Failed to load existing products: {str(e)}"
+            )
+
+        # (id, content hash) of every product as stored after the batches so far
+        stored = dict(existing)
+        seen = set()
+        inserted = set()
+        updated = set()
+        lexical_indexed = lexical_index.has_partition(site_id, "WooCommerce")
+
+        def seal(batch):
+            """Assigns the ids of a batch before it is written, so later batches see its products."""
+            entries = []
+            for key, product_data in batch.items():
+                is_new = key not in stored
+                doc_id = ObjectId() if is_new else stored[key][0]
+                (inserted if key not in existing else updated).add(key)
+                stored[key] = (doc_id, product_data["content_hash"])
+                entries.append((doc_id, is_new, product_data))
+            return entries
+
+        async def write(entries, lexical_only):
+            nonlocal wrote
+            changed = [product_data for _, _, product_data in entries]
+            with timed("embed", site_id):
+                vectors = await embed([p["combined_description"] for p in changed]) if changed else []
+            operations = []
+            for (doc_id, is_new, product_data), vector in zip(entries, vectors):
+                product_data["embeddings"] = encode_vector(vector)
+                if is_new:
+                    product_data["_id"] = doc_id
+                    operations.append(InsertOne(product_data))
+                else:
+                    operations.append(UpdateOne({"_id": doc_id}, {"$set": product_data}))
+
+            ids = [doc_id for doc_id, _, _ in entries]
+            wrote = wrote or bool(operations)
+            await bulk_write_in_batches(collection, operations)
+            await retriever.upsert(site_id, "WooCommerce", ids, vectors)
+            await lexical_index.upsert(site_id, "WooCommerce", ids + [doc_id for doc_id, _ in lexical_only],
+                                       changed + [product_data for _, product_data in lexical_only])
+            if job:
+                job.advance(len(entries))
+
+        batch = {}
+        # Unchanged products to add to the lexical index on its first sync
+        lexical_only = []
+        pending = None
+        if job:
+            job.set_phase("streaming")
+        try:
+            async for product in products:
+                product_data = build_product_data(product, site_id)
+                key = product_data["product_key"]
+                first = key not in seen
+                seen.add(key)
+                if key in batch or key not in stored or stored[key][1] != product_data["content_hash"]:
+                    # A repeated key keeps the last copy
+                    batch[key] = product_data
+                elif first:
+                    if job:
+                        job.advance(1)
+                    if not lexical_indexed:
+                        lexical_only.append((stored[key][0], product_data))
+
+                if len(batch) + len(lexical_only) >= CATALOG_STREAM_BATCH_SIZE:
+                    entries = seal(batch)
+                    # One batch is written while the next one is received
+                    if pending is not None:
+                        await pending
+                    pending = asyncio.create_task(write(entries, lexical_only))
+                    batch, lexical_only = {}, []
+
+            if pending is not None:
+                await pending
+            pending = None
+            if batch or lexical_only:
+                await write(seal(batch), lexical_only)
+        except BaseException:
+            if pending is not None:
+                # Let a batch already sent to Mongo reach the vector/lexical indexes too
+                await asyncio.gather(pending, return_exceptions=True)
+            raise
+
+        if job:
+            job.set_phase("deleting")
+            job.set_total(len(seen))
+        removed_ids = [doc_id for key, (doc_id, _) in existing.items() if key not in seen] + stale_ids
+        operations = [DeleteMany({"_id": {"$in": removed_ids[start:start + BULK_WRITE_BATCH_SIZE]}})
+                      for start in range(0, len(removed_ids), BULK_WRITE_BATCH_SIZE)]
+        wrote = wrote or bool(operations)
+        try:
+            await bulk_write_in_batches(collection, operations)
+            await retriever.delete(site_id, "WooCommerce", removed_ids)
+            await lexical_index.delete(site_id, "WooCommerce", removed_ids)
+        except Exception as e:
+            logger.error("Failed to delete products for site_id %s: %s", site_id, e)
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"Failed to delete removed products: {str(e)}"
+            )
+
+        total_products_processed = len(seen)
+        unchanged = total_products_processed - len(inserted) - len(updated)
+        logger.info("Streamed %d products for site_id %s: %d inserted, %d updated, %d deleted, %d unchanged",
+                    total_products_processed, site_id, len(inserted), len(updated), len(removed_ids), unchanged)
 
         return {
             "status": "success",
             "products_processed": total_products_processed,
+            "inserted": len(inserted),
+            "updated": len(updated),
+            "deleted": len(removed_ids),
+            "unchanged": unchanged,
             "message": f"Successfully processed {total_products_processed} products from WooCommerce"
         }
 
     except HTTPException as e:
-        print(f"HTTPException occurred: {e}")
+        logger.warning("WooCommerce stream sync failed: %s", e.detail)
         raise e
     except Exception as e:
-        print(f"Exception occurred: {e}")
+        logger.exception("WooCommerce stream sync failed")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error processing WooCommerce products: {str(e)}"
-        )
\ No newline at end of file
+        )
+    finally:
+        # Also reached by an interrupted stream, whose written batches stay written
+        await commit_product_indexes(site_id)
+        if wrote:
+            await answer_cache.invalidate_site(site_id)
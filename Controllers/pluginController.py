@@ -1,33 +1,95 @@
 from typing import Optional
-from io import BytesIO
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+from itertools import islice
+import asyncio
+import hashlib
+import logging
 import os
-from docx import Document
-from Model.pluginModel import Model
-import fitz  
+import shutil
+import tempfile
+import time
+import zipfile
+import numpy as np
+from bson import ObjectId
+from Model.pluginModel import AsyncModel
 import re
-from fastapi import HTTPException, status
-from sentence_transformers import SentenceTransformer
-from Model.WoocommerceBotModel import get_Woo_model_response
-from Model.FAQBotModel import get_FAQ_model_response
+from fastapi import HTTPException, status, UploadFile
+from Model.embeddingModel import embed, embed_query, embedding_service, EMBEDDING_BATCH_SIZE
+from Model.WoocommerceBotModel import get_Woo_model_response, build_Woo_request
+from Model.FAQBotModel import get_FAQ_model_response, build_FAQ_request
+from Model.openRouterClient import openrouter_client
+from Model.retrieverModel import retriever
+from Model.lexicalIndexModel import lexical_index
+from Model.generationModel import index_generations
+from Model.cacheModel import answer_cache, query_embedding_cache, normalize_query
+from Model.admissionModel import AdmissionRejected, chat_admission, chat_single_flight
+from Model.sessionModel import chat_sessions
+from Model.metricsModel import timed, timed_stream, observe_prompt_tokens
+from Model.contextPacker import PROMPT_FIELD_TOKENS, count_tokens, fit_tokens, pack, pack_history
+from Model.vectorCodec import encode_vector
+from Model.extractionModel import TEXT_EXTRACTORS, EXTRACT_PROCESSES, BULK_UPLOAD_MAX_BYTES, UploadTooLarge, discard_extraction_pool, extract_text, extraction_pool, unpack_zip
 import re
 
-async def generate_embeddings(text:str):
-    model =SentenceTransformer('sentence-transformers/all-MiniLM-L6-v2')
-    embeddings = model.encode(text)
-    print("embedding generation complete")
-    print(embeddings)
-    return embeddings
+logger = logging.getLogger(__name__)
 
-def extract_text_from_pdf(file_bytes: bytes) -> str:
-    text = ""
-    with fitz.open(stream=file_bytes, filetype="pdf") as doc:
-        for page in doc:
-            text += page.get_text()
-    return text
+# Number of chunks before and after the best match added to the FAQ context
+CONTEXT_WINDOW = int(os.getenv("CONTEXT_WINDOW", "1"))
+# Store the neighbor text on every chunk at ingestion so chat needs no extra query
+PRECOMPUTE_CHUNK_CONTEXT = os.getenv("PRECOMPUTE_CHUNK_CONTEXT", "false").lower() == "true"
+# Chunk size and overlap, in tokens of the embedding model's tokenizer
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "200"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "32"))
+# "vector" ranks by embedding similarity only. "hybrid" answers exact product
+# name/SKU matches lexically and fuses BM25 and vector rankings otherwise
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "vector").lower()
+RETRIEVAL_MODES = ("vector", "hybrid")
+# Documents retrieved per chat message
+RETRIEVAL_LIMIT = 5
+# Candidates taken from each ranking before reciprocal rank fusion
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "10"))
+RRF_K = int(os.getenv("RRF_K", "60"))
+
+# Size of the reads used to spool an upload to disk
+UPLOAD_READ_SIZE = 1024 * 1024
+
+# Batch chat: vector searches and LLM calls in flight at once, shared by all
+# batch requests of the worker, and the most items one request may carry
+BATCH_RETRIEVAL_CONCURRENCY = int(os.getenv("BATCH_RETRIEVAL_CONCURRENCY", "16"))
+BATCH_LLM_CONCURRENCY = int(os.getenv("BATCH_LLM_CONCURRENCY", "4"))
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "1000"))
+# "answer" runs the whole pipeline, "retrieval" stops before the LLM
+BATCH_MODES = ("answer", "retrieval")
+batch_retrieval_slots = asyncio.Semaphore(BATCH_RETRIEVAL_CONCURRENCY)
+batch_llm_slots = asyncio.Semaphore(BATCH_LLM_CONCURRENCY)
+
+
+async def spool_upload(file: UploadFile, max_bytes: int = BULK_UPLOAD_MAX_BYTES) -> str:
+    """
+    Copies an upload to a temp file in fixed-size reads and returns its path.
+    Raises a 413 HTTPException, leaving no file behind, once the upload
+    goes over max_bytes.
+    """
+    suffix = os.path.splitext(file.filename or "")[1].lower()
+    size = 0
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
+        while True:
+            data = await file.read(UPLOAD_READ_SIZE)
+            if not data:
+                break
+            size += len(data)
+            if size > max_bytes:
+                break
+            tmp.write(data)
+    if size > max_bytes:
+        os.remove(tmp.name)
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Uploads are limited to {BULK_UPLOAD_MAX_BYTES} bytes"
+        )
+    return tmp.name
 
-def extract_text_from_docx(file_bytes: bytes) -> str:
-    doc = Document(BytesIO(file_bytes))
-    return "\n".join([para.text for para in doc.paragraphs])
 
 def convert_response_to_html(text_response: str) -> str:
     """
@@ -41,7 +103,11 @@ def convert_response_to_html(text_response: str) -> str:
     """
     if not text_response:
         return ""
-    
+
+    with timed("html_conversion"):
+        return _convert_response_to_html(text_response)
+
+def _convert_response_to_html(text_response: str) -> str:
     # Split text into lines
     lines = text_response.split('\n')
     html_lines = []
@@ -88,91 +154,431 @@ def convert_response_to_html(text_response: str) -> str:
     
     return '\n'.join(html_lines)
 
-def split_text(text, max_chunk_size=500, overlap=50):
-    sentences = re.split(r'(?<=[.!?]) +', text)  # split on sentences
-    chunks = []
-    current_chunk = ""
+def iter_sentences(pieces, max_carry: int = 20000):
+    """Splits a stream of text pieces into sentences, carrying partial sentences over."""
+    carry = ""
+    for piece in pieces:
+        sentences = re.split(r'(?<=[.!?]) +', carry + piece)
+        carry = sentences.pop()
+        yield from sentences
+        # Text without sentence punctuation must not accumulate without bound
+        if len(carry) > max_carry:
+            yield carry
+            carry = ""
+    if carry:
+        yield carry
+
 
-    for sentence in sentences:
-        if len(current_chunk) + len(sentence) <= max_chunk_size:
-            current_chunk += " " + sentence
+def chunk_tokenizer():
+    """Per-thread copy of the embedding model's tokenizer, used to size chunks."""
+    return embedding_service.thread_tokenizer()
+
+
+def iter_token_sentences(sentences, max_tokens: int, tokenizer=None, batch_size: int = 256):
+    """
+    Tokenizes sentences in batches and yields (text, token_starts) pairs,
+    where token_starts are the character offsets of the sentence's tokens.
+    Sentences longer than max_tokens are cut into max_tokens windows.
+    """
+    tokenizer = tokenizer or chunk_tokenizer()
+    for batch in iter(lambda: take(sentences, batch_size), []):
+        for text, encoding in zip(batch, tokenizer.encode_batch(batch, add_special_tokens=False)):
+            starts = [start for start, _ in encoding.offsets]
+            for i in range(0, len(starts), max_tokens):
+                window = starts[i:i + max_tokens]
+                cut = window[0]
+                end = starts[i + max_tokens] if i + max_tokens < len(starts) else len(text)
+                yield text[cut:end], [start - cut for start in window]
+
+
+def overlap_tail(parts, overlap_tokens: int):
+    """Last overlap_tokens tokens of a chunk, as (text, token_starts) parts."""
+    tail = []
+    need = overlap_tokens
+    for text, starts in reversed(parts):
+        if need <= 0:
+            break
+        if len(starts) <= need:
+            tail.append((text, starts))
+            need -= len(starts)
         else:
-            chunks.append(current_chunk.strip())
-            current_chunk = " ".join(current_chunk.split()[-overlap:]) + " " + sentence
+            cut = starts[-need]
+            tail.append((text[cut:], [start - cut for start in starts[-need:]]))
+            need = 0
+    tail.reverse()
+    return tail
+
+
+def iter_chunks(pieces, max_tokens: int = CHUNK_MAX_TOKENS, overlap_tokens: int = CHUNK_OVERLAP_TOKENS,
+                tokenizer=None):
+    """
+    Streams text pieces (pages, paragraphs) into chunks sized in tokens of
+    the embedding model's tokenizer.
+
+    Every chunk has at most max_tokens tokens (capped to what the model can
+    embed) and starts with at most overlap_tokens tokens of the previous
+    chunk. Each sentence is tokenized once, so the cost is linear in the
+    text length. Exact duplicate chunks, such as repeated PDF headers and
+    footers, are dropped.
+    """
+    max_tokens = min(max_tokens, embedding_service.max_seq_length - 2)
+    overlap_tokens = min(overlap_tokens, max_tokens // 2)
+    seen = set()
+    parts = []
+    count = 0
+
+    def emit():
+        chunk = " ".join(text.strip() for text, _ in parts).strip()
+        key = hashlib.sha1(" ".join(chunk.split()).encode("utf-8")).digest()
+        if chunk and key not in seen:
+            seen.add(key)
+            return chunk
+        return None
 
-    if current_chunk.strip():
-        chunks.append(current_chunk.strip())
+    for text, starts in iter_token_sentences(iter_sentences(pieces), max_tokens, tokenizer):
+        if not starts:
+            continue
+        if parts and count + len(starts) > max_tokens:
+            chunk = emit()
+            if chunk:
+                yield chunk
+            parts = overlap_tail(parts, overlap_tokens)
+            count = sum(len(part_starts) for _, part_starts in parts)
+            if count + len(starts) > max_tokens:
+                parts, count = [], 0
+        parts.append((text, starts))
+        count += len(starts)
+
+    if parts:
+        chunk = emit()
+        if chunk:
+            yield chunk
+
+
+def split_text(text, max_tokens: int = CHUNK_MAX_TOKENS, overlap_tokens: int = CHUNK_OVERLAP_TOKENS):
+    return list(iter_chunks([text], max_tokens, overlap_tokens))
+
+
+def with_neighbor_context(chunks, window: int = CONTEXT_WINDOW):
+    """
+    Yields (chunk, context_text) pairs where context_text joins the chunk with
+    its window neighbors on each side. Only 2 * window + 1 chunks are held.
+    """
+    history = deque(maxlen=window)
+    pending = deque()
+    for chunk in chunks:
+        pending.append(chunk)
+        if len(pending) > window:
+            current = pending.popleft()
+            yield current, "\n\n".join([*history, current, *pending])
+            history.append(current)
+    while pending:
+        current = pending.popleft()
+        yield current, "\n\n".join([*history, current, *pending])
+        history.append(current)
+
+
+def take(iterator, n: int) -> list:
+    """Pulls up to n items from an iterator."""
+    return list(islice(iterator, n))
+
+
+def chunk_records(chunks, source: str = None):
+    """(source, chunk_number, chunk, context_text) records of one document's chunk stream."""
+    if PRECOMPUTE_CHUNK_CONTEXT:
+        stream = with_neighbor_context(chunks)
+    else:
+        stream = ((chunk, None) for chunk in chunks)
+    for number, (chunk, context_text) in enumerate(stream):
+        yield source, number, chunk, context_text
+
+
+async def ingest_chunks(chunks, site_id: str, batch_size: int = EMBEDDING_BATCH_SIZE, job=None):
+    """Replaces the blogSites chunks of a site with the chunk stream of a single document."""
+    total = await ingest_records(chunk_records(chunks), site_id, batch_size, job)
+    return {"message": f"Inserted {total} chunks into database."}
 
-    return chunks
 
+async def ingest_records(records, site_id: str, batch_size: int = EMBEDDING_BATCH_SIZE, job=None) -> int:
+    """
+    Replaces the blogSites chunks of a site with the given stream of
+    (source, chunk_number, chunk, context_text) records; returns the
+    number of chunks stored.
 
+    The stream is consumed batch by batch (off the event loop, since
+    extraction is blocking), each batch is embedded and inserted before the
+    next one is read, so memory stays bounded by the batch size. Progress
+    is reported on job when the ingestion runs as a background job.
 
-async def getchunks(text: str, site_id: str):
-    chunks = split_text(text)
-    document = []
-    collection = Model()
+    The chunks are written under a new index generation and published once
+    all of them are stored and indexed; until then chat keeps answering
+    from the previous one. A failed ingestion discards its generation.
+    """
+    collection = AsyncModel()
 
     if collection is None:
-        print("Connection not established")
+        logger.error("Connection not established")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Database connection not established."
         )
 
     try:
-        delete_result = collection.delete_many({"site_id": site_id, "for": "blogSites"})
-        print(f"Deleted {delete_result.deleted_count} existing chunks for site_id: {site_id}")
+        generation = await index_generations.begin(site_id, "blogSites")
     except Exception as e:
-        print(f"Failed to delete existing chunks: {e}")
+        logger.error("Failed to start a new index generation for site_id %s: %s", site_id, e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Failed to clear existing chunks: {str(e)}"
+            detail=f"Failed to start a new index generation: {str(e)}"
         )
 
-    for i, chunk in enumerate(chunks):
-        print("Chunking...")
-        vector = await generate_embeddings(chunk)
-        embedding = vector.tolist()
-        doc = {
-            "site_id": site_id,
-            "for":"blogSites",
-            "chunk_number": i,
-            "text": chunk,
-            "embeddings": embedding
-        }
-        document.append(doc)
-
-    if not document:
-        print("No chunks were generated")
+    try:
+        total = await write_generation(collection, records, site_id, generation, batch_size, job)
+    except Exception:
+        await index_generations.discard(site_id, "blogSites", generation)
+        raise
+
+    logger.info("Inserted %d chunks for site_id %s", total, site_id)
+    return total
+
+
+async def write_generation(collection, records, site_id: str, generation: int, batch_size: int, job=None) -> int:
+    """Stores, indexes and publishes the chunks of an ingest_records generation; returns their count."""
+    total = 0
+    probe = None
+    index_ids, index_vectors = [], []
+    # Built next to the stored chunks and swapped in once the ingestion is complete
+    lexical = lexical_index.new_partition(site_id, "blogSites")
+    while True:
+        if job:
+            job.set_phase("extracting")
+        try:
+            batch = await asyncio.to_thread(take, records, batch_size)
+        except Exception as e:
+            logger.exception("Failed to extract text for site_id %s", site_id)
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"Error processing file: {str(e)}"
+            )
+        if not batch:
+            break
+
+        # Embed every chunk of the batch in batched forward passes
+        if job:
+            job.set_phase("embedding")
+        with timed("embed", site_id):
+            vectors = await embed([chunk for _, _, chunk, _ in batch], batch_size)
+
+        document = []
+        for (source, number, chunk, context_text), vector in zip(batch, vectors):
+            doc = {
+                "site_id": site_id,
+                "for":"blogSites",
+                "generation": generation,
+                "chunk_number": number,
+                "text": chunk,
+                "embeddings": encode_vector(vector)
+            }
+            if source is not None:
+                doc["source"] = source
+            if context_text is not None:
+                doc["context_text"] = context_text
+            document.append(doc)
+
+        if job:
+            job.set_phase("writing")
+        try:
+            insert_result = await collection.insert_many(document)
+        except Exception as e:
+            logger.error("Failed to insert chunks for site_id %s: %s", site_id, e)
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"Failed to insert documents into database: {str(e)}"
+            )
+        if probe is None:
+            probe = vectors[0]
+        if retriever.stores_vectors:
+            index_ids.extend(insert_result.inserted_ids)
+            index_vectors.append(vectors)
+        await asyncio.to_thread(lexical.upsert, [str(i) for i in insert_result.inserted_ids], document)
+        total += len(document)
+        if job:
+            job.advance(len(document))
+        logger.debug("Embedded and inserted %d chunks for site_id %s", total, site_id)
+
+    if not total:
+        logger.warning("No chunks were generated for site_id %s", site_id)
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="No chunks were generated from the text."
         )
 
-    # Insert new chunks
-    try:
-        collection.insert_many(document)
-        print(f"Inserted {len(document)} chunks into MongoDB.")
-        return {"message": f"Inserted {len(document)} chunks into database."}
-    except Exception as e:
-        print(f"Failed to insert documents: {e}")
+    if job:
+        job.set_phase("indexing")
+    await retriever.wait_until_searchable(site_id, "blogSites", generation, probe, total)
+    if job:
+        job.set_phase("publishing")
+    if not await index_generations.publish(site_id, "blogSites", generation):
         raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Failed to insert documents into database: {str(e)}"
+            status_code=status.HTTP_409_CONFLICT,
+            detail="A newer ingestion of the site was published first; these chunks were discarded."
         )
+    # The local indexes are swapped in only once the generation is live.
+    # Until then they keep pointing at the previous generation, whose
+    # documents stay in Mongo for GENERATION_GC_DELAY after the flip
+    if retriever.stores_vectors:
+        await retriever.replace(site_id, "blogSites", index_ids, np.vstack(index_vectors))
+    await lexical_index.commit(site_id, "blogSites", lexical)
+    await answer_cache.invalidate_site(site_id)
+    return total
 
 
+async def getchunks(text: str, site_id: str, job=None):
+    return await ingest_chunks(iter_chunks([text]), site_id, job=job)
 
-# CHAT PROCESSING OF THE PLUGIN
 
+async def getdocument(path: str, ext: str, site_id: str, job=None):
+    """Streams a spooled upload through extraction, chunking, embedding and storage."""
+    return await ingest_chunks(iter_chunks(TEXT_EXTRACTORS[ext](path)), site_id, job=job)
 
-async def chunking_function(documents, userquery ,chat_history):
-    """Processes a document and retrieves surrounding chunks for enhanced context."""
-    print("Processing document with chunking function:", documents)
 
-    combined_context = ""
+
+def iter_file_records(files, reports, window: int = EXTRACT_PROCESSES * 2):
+    """
+    Extracts files on the extraction process pool, at most window at a
+    time, and yields the chunk records of each one as soon as it is
+    extracted, numbered per file. Outcomes are written to the matching
+    entry of reports.
+    """
+    queue = deque(zip(files, reports))
+    # Files that were in the pool when an extractor crashed
+    retries = deque()
+    # future -> (file, report, pool it was submitted to, whether it is a retry)
+    pending = {}
+
+    def start(file, report, retry):
+        name, path, ext = file
+        pool = extraction_pool()
+        try:
+            future = pool.submit(extract_text, path, ext)
+        except BrokenProcessPool:
+            # The pool died before this file's turn came
+            discard_extraction_pool(pool)
+            pool = extraction_pool()
+            future = pool.submit(extract_text, path, ext)
+        pending[future] = (file, report, pool, retry)
+
+    def submit():
+        if retries or any(retry for _, _, _, retry in pending.values()):
+            # Retries run one at a time, alone in the pool, so a crash
+            # during a retry can only be caused by that file
+            if not pending:
+                start(*retries.popleft(), True)
+            return
+        while queue and len(pending) < window:
+            start(*queue.popleft(), False)
+
+    submit()
+    while pending:
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            file, report, pool, retry = pending.pop(future)
+            try:
+                pieces, seconds = future.result()
+            except BrokenProcessPool as e:
+                # A crashed extractor (e.g. on a malformed PDF) takes the whole
+                # pool and every file in it down; those get one more try
+                discard_extraction_pool(pool)
+                if retry:
+                    report.update(status="failed", error=f"Extraction process died: {e}")
+                else:
+                    retries.append((file, report))
+                continue
+            except Exception as e:
+                report.update(status="failed", error=str(e))
+                continue
+            # Keep the pool busy while this file is chunked and embedded
+            submit()
+            report["extract_seconds"] = round(seconds, 3)
+            for record in chunk_records(iter_chunks(pieces), report["name"]):
+                report["chunks"] += 1
+                yield record
+            report["status"] = "ok" if report["chunks"] else "empty"
+        submit()
+
+
+def unique_name(name: str, seen: set) -> str:
+    candidate, n = name, 1
+    while candidate in seen:
+        n += 1
+        candidate = f"{name} ({n})"
+    seen.add(candidate)
+    return candidate
+
+
+async def ingest_files(uploads, site_id: str, job=None):
+    """
+    Replaces the blogSites chunks of a site with the documents of a bulk
+    upload, given as (filename, path, ext) of spooled files; zip archives
+    are unpacked first.
+
+    Files are extracted in parallel on the extraction process pool and
+    their chunks embedded and stored as one batched stream, under one
+    index generation. chunk_number restarts at 0 for every file and the
+    chunks carry the file name as "source", so neighbor lookups stay
+    within a document. A file that cannot be extracted is reported as
+    failed without failing the others.
+    """
+    start = time.perf_counter()
+    workdir = tempfile.mkdtemp(prefix="synapse-bulk-")
+    try:
+        files, reports, seen = [], [], set()
+
+        def add(name, path, ext, status="pending", error=None):
+            name = unique_name(name, seen)
+            reports.append({"name": name, "status": status, "chunks": 0, "extract_seconds": None, "error": error})
+            if status == "pending":
+                files.append((name, path, ext))
+
+        if job:
+            job.set_phase("unpacking")
+        for number, (filename, path, ext) in enumerate(uploads):
+            if ext != ".zip":
+                add(filename, path, ext)
+                continue
+            directory = os.path.join(workdir, str(number))
+            os.makedirs(directory)
+            try:
+                members = await asyncio.to_thread(unpack_zip, path, directory)
+            except UploadTooLarge as e:
+                raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
+            except zipfile.BadZipFile as e:
+                add(filename, path, ext, "failed", f"Invalid zip archive: {e}")
+                continue
+            for member, member_path, member_ext in members:
+                add(f"{filename}/{member}", member_path, member_ext)
+
+        if not files:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No supported documents in the upload.")
+
+        total = await ingest_records(iter_file_records(files, reports), site_id, job=job)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "message": f"Inserted {total} chunks from {sum(r['status'] == 'ok' for r in reports)} of {len(reports)} files into database.",
+        "seconds": round(time.perf_counter() - start, 3),
+        "files": reports,
+    }
+
+
+# CHAT PROCESSING OF THE PLUGIN
+
+
+async def build_chunk_prompt(documents, userquery, chat_history):
+    """Builds the FAQ prompt from the best matching chunk and its surrounding chunks."""
     if not documents:
-        return f"User query: {userquery}\n\nNo relevant context found."
+        return None
 
     relevant_chunk = documents[0]  
     site_id = relevant_chunk['site_id']
@@ -184,108 +590,282 @@ async def chunking_function(documents, userquery ,chat_history):
     elif isinstance(current_chunk_number_raw, (int, str)) and str(current_chunk_number_raw).isdigit():
         current_chunk_number = int(current_chunk_number_raw)
 
-    if current_chunk_number is None:
-        combined_context = relevant_chunk['text']
+    if relevant_chunk.get('context_text'):
+        # Neighbor text was precomputed at ingestion, no extra round trip needed
+        candidates = [(0, relevant_chunk['context_text'])]
+    elif current_chunk_number is None:
+        candidates = [(0, relevant_chunk['text'])]
     else:
-        combined_context += f"{relevant_chunk['text']}\n\n"
-        previous_chunk_number = current_chunk_number - 1
-        if previous_chunk_number >= 1:
-            previous_chunk = await fetch_chunk_from_db(site_id, str(previous_chunk_number))
-            if previous_chunk:
-                combined_context = f"{previous_chunk['text']}\n\n" + combined_context
-
-        next_chunk_number = current_chunk_number + 1
-        next_chunk = await fetch_chunk_from_db(site_id, str(next_chunk_number))
-        if next_chunk:
-            combined_context += f"{next_chunk['text']}"
-
-    final_prompt = f"User query: {userquery} with the chat history: {chat_history}\n\nContext from relevant and surrounding chunks:\n{combined_context}"
-
-    print("Combined prompt for LLM:", final_prompt)
-    results = get_FAQ_model_response(userquery, final_prompt)
-    print("THE FINAL RESULTS       " , results)
+        with timed("neighbor_fetch", site_id):
+            neighbors = await fetch_neighbor_chunks(site_id, current_chunk_number,
+                                                    generation=relevant_chunk.get('generation'),
+                                                    source=relevant_chunk.get('source'))
+        neighbors[current_chunk_number] = relevant_chunk['text']
+        # The best match first, then its closest neighbors
+        order = sorted(neighbors, key=lambda number: (abs(number - current_chunk_number), number))
+        candidates = [(number, neighbors[number]) for number in order]
+
+    def build():
+        positions, texts, context_tokens = pack([text for _, text in candidates])
+        # Kept chunks go back in document order
+        combined_context = "\n\n".join(text for _, text in sorted(zip((candidates[i][0] for i in positions), texts)))
+        history, history_tokens = pack_history(chat_history)
+        observe_prompt_tokens("faq", site_id, context=context_tokens, history=history_tokens, query=count_tokens(userquery))
+        return f"User query: {userquery} with the chat history: {history}\n\nContext from relevant and surrounding chunks:\n{combined_context}"
+
+    with timed("prompt_build", site_id):
+        # Token counting may have to load the tokenizer, so it runs off the event loop
+        final_prompt = await asyncio.to_thread(build)
+
+    logger.debug("Combined prompt for LLM: %s", final_prompt)
+    return final_prompt
+
+
+async def chunking_function(documents, userquery ,chat_history):
+    """Processes a document and retrieves surrounding chunks for enhanced context."""
+    logger.debug("Processing document with chunking function: %s", documents)
+
+    final_prompt = await build_chunk_prompt(documents, userquery, chat_history)
+    if final_prompt is None:
+        return f"User query: {userquery}\n\nNo relevant context found."
+
+    with timed("llm_call", documents[0].get("site_id")):
+        results = await get_FAQ_model_response(userquery, final_prompt)
+    logger.debug("FAQ model response: %s", results)
     return results
 
-# for fetching a chunk from the database
-async def fetch_chunk_from_db(site_id, chunk_number):
+# for fetching the chunks around a chunk from the database
+async def fetch_neighbor_chunks(site_id, chunk_number, window: int = CONTEXT_WINDOW, generation: int = None,
+                                source: str = None):
+    """
+    Fetches chunks chunk_number-window..chunk_number+window (except the chunk
+    itself) of the given index generation and source document in a single
+    $in query on the (site_id, for, generation, source, chunk_number) index.
+
+    Returns:
+        dict: chunk_number -> text for the neighbors that exist.
+    """
+    numbers = [n for n in range(chunk_number - window, chunk_number + window + 1) if n >= 0 and n != chunk_number]
+    if not numbers:
+        return {}
+
+    logger.debug("Fetching chunks %s for site_id %s", numbers, site_id)
+    collection = AsyncModel()
+    # Unversioned chunks predate index generations
+    # Chunks without a source come from single-document ingestions, which
+    # null matches
+    query = {"site_id": site_id, "for": "blogSites", "chunk_number": {"$in": numbers},
+             "generation": generation if generation is not None else {"$exists": False},
+             "source": source}
+    docs = await collection.find(
+        query,
+        {"_id": 0, "chunk_number": 1, "text": 1}
+    ).to_list(None)
+    return {doc["chunk_number"]: doc["text"] for doc in docs}
+
+
+def format_product(doc) -> str:
+    """One product block of the WooCommerce context, with the free-text fields capped."""
+    description, _ = fit_tokens(doc.get('description') or 'No description available', PROMPT_FIELD_TOKENS)
+    short_description, _ = fit_tokens(doc.get('short_description') or 'No Short description available', PROMPT_FIELD_TOKENS)
+    sku = f"SKU: {doc['sku']}\n" if doc.get('sku') else ""
+    return (
+        f"ID: {doc.get('id', 'N/A')}\n"
+        f"Name: {doc.get('name')}\n"
+        f"{sku}"
+        f"Description: {description}\n"
+        f"Short Description: {short_description}\n"
+        f"Price: {doc.get('price')}\n"
+        f"Stock Status: {doc.get('stock_status') or 'Unknown'}\n"
+        f"Permalink: {doc.get('permalink') or 'No permalink available'}\n"
+        "\n--------------------\n"
+    )
+
+
+def build_product_context(documents):
+    """Packs the matched WooCommerce products, best score first, into the prompt context budget."""
+    ranked = sorted(documents, key=lambda doc: doc.get("score", 0), reverse=True)
+    _, blocks, tokens = pack([format_product(doc) for doc in ranked])
+    combined_str = "".join(blocks)
+
+    logger.debug("Combined product data (%d tokens):\n%s", tokens, combined_str)
+    return combined_str, tokens
 
-    print(f"Fetching chunk with site_id: {site_id} and chunk_number: {chunk_number} from DB...")
-    return None
+
+def build_woo_prompt_parts(documents, userquery, chat_history):
+    """Packed product context and chat history for the WooCommerce bot (blocking: counts tokens)."""
+    site_id = documents[0].get("site_id") if documents else None
+    combined_str, context_tokens = build_product_context(documents)
+    history, history_tokens = pack_history(chat_history)
+    observe_prompt_tokens("woocommerce", site_id, context=context_tokens, history=history_tokens, query=count_tokens(userquery))
+    return combined_str, history
 
 
 async def woocommerce_function(documents,userquery, chat_history):
     """Processes a list of documents from the WooCommerce product data."""
-    print("Processing WooCommerce products with woocommerce function:", documents)
-    results = []
-    combined_str = "" 
-
-    for doc in documents:
-        print("Processing ID:", doc.get('id'))
-        combined_str += (
-            f"ID: {doc.get('id', 'N/A')}\n"
-            f"Name: {doc.get('name')}\n"
-            f"Description: {doc.get('description', 'No description available')}\n"
-            f"Short Description: {doc.get('short_description', 'No Short description available')}"
-            f"Price: {doc.get('price')}\n"
-            f"Stock Status: {doc.get('stock_status', 'Unknown')}\n"
-            f"Permalink: {doc.get('permalink', 'No permalink available')}\n"
-            "\n--------------------\n"
-        )
-    
-    print("Combined product data:\n", combined_str)
-    results = get_Woo_model_response(userquery, combined_str, chat_history)
+    logger.debug("Processing WooCommerce products with woocommerce function: %s", documents)
+    site_id = documents[0].get("site_id") if documents else None
+    with timed("prompt_build", site_id):
+        combined_str, history = await asyncio.to_thread(build_woo_prompt_parts, documents, userquery, chat_history)
+    with timed("llm_call", site_id):
+        results = await get_Woo_model_response(userquery, combined_str, history)
     
     return results  # Return a list of results
 
 
 
-async def generate_embeddings(text:str):
-    model =SentenceTransformer('sentence-transformers/all-MiniLM-L6-v2')
-    embeddings = model.encode(text)
-    print("embedding generation complete")
-    print(embeddings)
-    return embeddings
+async def get_query_embedding(chat_text: str, site_id: str = None):
+    """Embeds a chat message, reusing the cached embedding of the same normalized text."""
+    chat_embedding = query_embedding_cache.get(chat_text)
+    if chat_embedding is None:
+        with timed("embed", site_id):
+            chat_embedding = await embed_query(chat_text)
+        query_embedding_cache.put(chat_text, chat_embedding)
+    return chat_embedding
+
+
+async def embed_queries(texts):
+    """
+    Embeds many chat messages at once: cached embeddings are reused and the
+    rest are embedded together, in EMBEDDING_BATCH_SIZE forward passes
+    instead of one per message.
+    """
+    vectors = [query_embedding_cache.get(text) for text in texts]
+    missing = {}
+    for i, vector in enumerate(vectors):
+        if vector is None:
+            missing.setdefault(normalize_query(texts[i]), []).append(i)
+    if missing:
+        with timed("embed"):
+            embedded = await embed([texts[indexes[0]] for indexes in missing.values()])
+        for indexes, vector in zip(missing.values(), embedded):
+            query_embedding_cache.put(texts[indexes[0]], vector)
+            for i in indexes:
+                vectors[i] = vector
+    return vectors
+
+
+async def vector_search(chat_text: str, site_id: str, chat_embedding=None, limit: int = RETRIEVAL_LIMIT):
+    """Embeds the chat message and returns the closest chunks/products of the site."""
+    if chat_embedding is None:
+        chat_embedding = await get_query_embedding(chat_text, site_id)
+
+    with timed("vector_search", site_id):
+        results = await retriever.search(site_id, chat_embedding, limit=limit)
+    logger.debug("Vector search for site_id %s returned %d results", site_id, len(results))
+
+    for result in results:
+        result["id"] = str(result["_id"])
+    return results
+
+
+async def fetch_documents(ids):
+    """Loads chunk/product documents by id (str), in the order of ids."""
+    if not ids:
+        return []
+    object_ids = [ObjectId(doc_id) if ObjectId.is_valid(doc_id) else doc_id for doc_id in ids]
+    docs = await AsyncModel().find({"_id": {"$in": object_ids}}, {"embeddings": 0}).to_list(None)
+    by_id = {str(doc["_id"]): doc for doc in docs}
+    results = []
+    for doc_id in ids:
+        if doc_id in by_id:
+            by_id[doc_id]["id"] = doc_id
+            results.append(by_id[doc_id])
+    return results
+
+
+def reciprocal_rank_fusion(rankings, limit: int = RETRIEVAL_LIMIT, k: int = RRF_K):
+    """Fuses ranked id lists; returns the best ids and the fused score of every id."""
+    scores = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores, key=scores.get, reverse=True)[:limit], scores
+
+
+async def retrieve(chat_text: str, site_id: str, use_answer_cache: bool, mode: str = RETRIEVAL_MODE,
+                   chat_embedding=None):
+    """
+    Finds the documents to answer chat_text with, checking the answer cache
+    on the way. chat_embedding, when given, is used instead of embedding
+    chat_text.
+
+    Returns:
+        tuple: (cached answer or None, results, query embedding or None).
+        The embedding is None when an exact lexical match answered the
+        query without the embedding model.
+    """
+    lexical = None
+    if mode == "hybrid":
+        with timed("lexical_search", site_id):
+            lexical = await lexical_index.search(site_id, chat_text, HYBRID_CANDIDATES)
+        if lexical.exact:
+            # The query names products (name or SKU) exactly: no embedding needed
+            if use_answer_cache:
+                cached = answer_cache.get(site_id, chat_text)
+                if cached is not None:
+                    return cached, [], None
+            ids = lexical.exact + [doc_id for doc_id, _ in lexical.hits if doc_id not in lexical.exact]
+            logger.debug("Exact lexical match for site_id %s: %s", site_id, lexical.exact)
+            return None, await fetch_documents(ids[:RETRIEVAL_LIMIT]), None
 
-async def response_generator(chat_text: str, site_id: str, chat_history: list = None):
-    client = Model()
+    if chat_embedding is None:
+        chat_embedding = await get_query_embedding(chat_text, site_id)
+    if use_answer_cache:
+        cached = answer_cache.get(site_id, chat_text, chat_embedding)
+        if cached is not None:
+            return cached, [], chat_embedding
 
-    chat_embedding = await generate_embeddings(chat_text)
+    if lexical is None or not lexical.hits:
+        return None, await vector_search(chat_text, site_id, chat_embedding), chat_embedding
 
+    vector_results = await vector_search(chat_text, site_id, chat_embedding, HYBRID_CANDIDATES)
+    ranking, scores = reciprocal_rank_fusion([[result["id"] for result in vector_results],
+                                              [doc_id for doc_id, _ in lexical.hits]])
+    docs = {result["id"]: result for result in vector_results}
+    docs.update({doc["id"]: doc for doc in await fetch_documents([doc_id for doc_id in ranking if doc_id not in docs])})
+    results = []
+    for doc_id in ranking:
+        if doc_id in docs:
+            docs[doc_id]["score"] = scores[doc_id]
+            results.append(docs[doc_id])
+    return None, results, chat_embedding
 
-    vector = [float(x) for x in chat_embedding]
 
-    print("Performing vector search...")
-    print("site_id:", site_id)
-    print("Query Vector (first 5 elements):", vector[:5]) 
-    print("About to execute client.aggregate()...")
+async def response_generator(chat_text: str, site_id: str, chat_history: list = None, retrieval_mode: str = None):
+    # Answers depend on the conversation, so only first messages use the answer cache
+    use_answer_cache = not chat_history
+    generation = await answer_cache.sync_site(site_id)
     try:
-        results = list(client.aggregate([
-            {
-                "$vectorSearch": {
-                    "index": "vector_index",
-                    "path": "embeddings",
-                    "queryVector": vector,
-                    "numCandidates": 100,
-                    "limit": 5,
-                    "filter": { 
-                        "site_id": {"$eq": site_id}  
-                    }
-                }
-            }
-        ]))
-        print("Vector search call finished.")
-        print("Vector search complete. Results:")
-    except Exception as e:
-        print(f"Error during vector search: {e}")
+        cached, results, chat_embedding = await retrieve(chat_text, site_id, use_answer_cache,
+                                                         retrieval_mode or RETRIEVAL_MODE)
+        if cached is not None:
+            logger.debug("Answer cache hit for site_id %s", site_id)
+            return list(cached)
+    except Exception:
+        logger.exception("Error during vector search for site_id %s", site_id)
         return ["Error during vector search."] 
 
-    print("Results:")
+    responses, cacheable = await generate_answer(results, chat_text, chat_history)
+    if use_answer_cache and cacheable:
+        answer_cache.put(site_id, chat_text, chat_embedding, list(responses), generation)
+
+    logger.debug("Final response: %s", responses[0])
+    return responses
+
+
+async def generate_answer(results, chat_text: str, chat_history: list = None):
+    """
+    Answers chat_text from the retrieved results (the LLM part of
+    response_generator).
+
+    Returns:
+        tuple: (responses, whether they may be stored in the answer cache).
+    """
     responses = []
+    cacheable = True
     if results:  
         best_match = results[0]
-        best_match_id = str(best_match["_id"])
-        best_match["id"] = best_match_id
-        print("Best match ID")
 
         if "for" in best_match and best_match["for"] == "blogSites":
             chunked_data_response = await chunking_function([best_match], chat_text,chat_history) # Corrected call
@@ -295,10 +875,217 @@ async def response_generator(chat_text: str, site_id: str, chat_history: list =
             woocommerce_data_response = await woocommerce_function(woocommerce_products, chat_text,chat_history)
             responses.append(woocommerce_data_response)
         else:
+            cacheable = False
             responses.append(f"Error: Unknown 'for' value in best match: {best_match.get('for', 'N/A')}. Best Match: {best_match}")
     else:
         responses.append("No matching results found.") 
 
-    print("Final responses:", responses[0])
-    return responses
+    return responses, cacheable and responses[0] is not None
+
 
+def admit_chat(site_id: str):
+    """
+    Takes a chat slot of site_id, to be given back with
+    chat_admission.release(site_id), or raises a 429 when the site is over
+    its concurrency or rate limit.
+    """
+    try:
+        chat_admission.acquire(site_id)
+    except AdmissionRejected as e:
+        logger.warning("Rejected chat request of site_id %s: %s", site_id, e.reason)
+        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail=str(e),
+                            headers={"Retry-After": str(e.retry_after)})
+
+
+async def answer_chat(chat_text: str, site_id: str, chat_history: list = None, retrieval_mode: str = None):
+    """
+    response_generator behind the per-site admission control. First messages
+    asking the same (normalized) question of a site as one still being
+    answered wait for that answer instead of running the pipeline again.
+    """
+    async def run():
+        admit_chat(site_id)
+        try:
+            return await response_generator(chat_text, site_id, chat_history, retrieval_mode)
+        finally:
+            chat_admission.release(site_id)
+
+    if chat_history:
+        return await run()
+    key = (site_id, normalize_query(chat_text), retrieval_mode or RETRIEVAL_MODE)
+    return list(await chat_single_flight.do(key, run, site_id))
+
+
+async def session_chat(chat_text: str, site_id: str, session_id: str = None, retrieval_mode: str = None):
+    """
+    answer_chat with the history of a server-side session, which records
+    the new turn.
+
+    Returns:
+        tuple: (response, session id). The id differs from session_id when
+        that session did not exist, so a new one was started.
+    """
+    session = await chat_sessions.get(site_id, session_id)
+    response = await answer_chat(chat_text, site_id, session.history(), retrieval_mode)
+    await chat_sessions.record(session, chat_text, response[0])
+    return response, session.id
+
+
+def retrieval_metadata(results, site_id: str):
+    """
+    Summary of the retrieved documents, sent to streaming clients before any
+    token and returned by retrieval-only batches.
+    """
+    return {
+        "site_id": site_id,
+        "for": results[0].get("for") if results else None,
+        "matches": [
+            {
+                "id": result["id"],
+                "for": result.get("for"),
+                "name": result.get("name"),
+                "chunk_number": result.get("chunk_number"),
+                "permalink": result.get("permalink"),
+                "score": result.get("score"),
+            }
+            for result in results
+        ],
+    }
+
+
+async def stream_response_generator(chat_text: str, site_id: str, chat_history: list = None,
+                                    retrieval_mode: str = None):
+    """
+    Streaming variant of response_generator.
+
+    Yields (event, data) pairs: one "metadata" event with the retrieval
+    results, a "token" event per piece of generated text, and a final "done"
+    event whose data has the same shape as the non-streaming response.
+    """
+    use_answer_cache = not chat_history
+    generation = await answer_cache.sync_site(site_id)
+    try:
+        cached, results, chat_embedding = await retrieve(chat_text, site_id, use_answer_cache,
+                                                         retrieval_mode or RETRIEVAL_MODE)
+        if cached is not None:
+            yield "metadata", {"site_id": site_id, "for": None, "matches": [], "cached": True}
+            yield "done", {"response": list(cached)}
+            return
+    except Exception:
+        logger.exception("Error during vector search for site_id %s", site_id)
+        yield "done", {"response": ["Error during vector search."]}
+        return
+
+    yield "metadata", retrieval_metadata(results, site_id)
+
+    data = None
+    fallback = None
+    if not results:
+        fallback = "No matching results found."
+    elif results[0].get("for") == "blogSites":
+        final_prompt = await build_chunk_prompt(results[:1], chat_text, chat_history)
+        if final_prompt is None:
+            fallback = f"User query: {chat_text}\n\nNo relevant context found."
+        else:
+            data = build_FAQ_request(chat_text, final_prompt)
+    elif results[0].get("for") == "WooCommerce":
+        woocommerce_products = [result for result in results if result.get("for") == "WooCommerce"]
+        with timed("prompt_build", site_id):
+            combined_str, history = await asyncio.to_thread(build_woo_prompt_parts, woocommerce_products,
+                                                            chat_text, chat_history)
+            data = build_Woo_request(chat_text, combined_str, history)
+    else:
+        fallback = f"Error: Unknown 'for' value in best match: {results[0].get('for', 'N/A')}. Best Match: {results[0]}"
+
+    if data is None:
+        if not results and use_answer_cache:
+            answer_cache.put(site_id, chat_text, chat_embedding, [fallback], generation)
+        yield "done", {"response": [fallback]}
+        return
+
+    parts = []
+    # Only the waits on the upstream count as llm_call, as in the non-streaming path
+    async for token in timed_stream(openrouter_client.stream_chat_completion(data), "llm_call", site_id):
+        parts.append(token)
+        yield "token", {"content": token}
+
+    response = ["".join(parts).strip()]
+    if use_answer_cache:
+        answer_cache.put(site_id, chat_text, chat_embedding, list(response), generation)
+    yield "done", {"response": response}
+
+
+async def stream_session_chat(chat_text: str, site_id: str, session_id: str = None, retrieval_mode: str = None):
+    """stream_response_generator with a server-side session, see session_chat."""
+    session = await chat_sessions.get(site_id, session_id)
+    async for event, payload in stream_response_generator(chat_text, site_id, session.history(), retrieval_mode):
+        if event in ("metadata", "done"):
+            payload = {**payload, "session_id": session.id}
+        if event == "done":
+            await chat_sessions.record(session, chat_text, payload["response"][0])
+        yield event, payload
+
+
+async def answer_batch_item(index: int, item: dict, chat_embedding, mode: str, retrieval_mode: str):
+    """
+    response_generator for one item of a batch, with its query embedding
+    already computed. Retrieval and LLM calls each wait for a slot of the
+    batch concurrency limits. Items without history asking a question
+    already being answered wait for that answer; batch calls are kept under
+    their own keys so interactive chat never waits on the batch limits.
+    """
+    site_id = item["site_id"]
+    chat_text = item["message"]
+    chat_history = item.get("chat_history")
+    use_answer_cache = mode == "answer" and not chat_history
+    generation = await answer_cache.sync_site(site_id)
+
+    async def run():
+        async with batch_retrieval_slots:
+            cached, results, _ = await retrieve(chat_text, site_id, use_answer_cache, retrieval_mode, chat_embedding)
+        if mode == "retrieval":
+            return retrieval_metadata(results, site_id)
+        if cached is not None:
+            return list(cached)
+
+        async with batch_llm_slots:
+            responses, cacheable = await generate_answer(results, chat_text, chat_history)
+        if use_answer_cache and cacheable:
+            answer_cache.put(site_id, chat_text, chat_embedding, list(responses), generation)
+        return responses
+
+    try:
+        if mode == "retrieval":
+            return {"index": index, **await run()}
+        if chat_history:
+            return {"index": index, "response": await run()}
+        key = (site_id, normalize_query(chat_text), retrieval_mode)
+        response = await chat_single_flight.do(("batch",) + key, run, site_id, join=key)
+        return {"index": index, "response": list(response)}
+    except Exception as e:
+        logger.exception("Error answering batch item %d of site_id %s", index, site_id)
+        return {"index": index, "error": f"An error occurred: {str(e)}"}
+
+
+async def batch_chat(items, mode: str = "answer", retrieval_mode: str = None):
+    """
+    Answers many (site_id, message) items: all messages are embedded
+    together, then the items run concurrently within the batch limits.
+
+    Yields:
+        dict: the result of each item as it finishes, carrying its "index"
+        in items and either "response" (the /chat response), the retrieval
+        metadata (mode "retrieval") or "error".
+    """
+    vectors = await embed_queries([item["message"] for item in items])
+    tasks = [
+        asyncio.create_task(answer_batch_item(i, item, vector, mode, retrieval_mode or RETRIEVAL_MODE))
+        for i, (item, vector) in enumerate(zip(items, vectors))
+    ]
+    try:
+        for task in asyncio.as_completed(tasks):
+            yield await task
+    finally:
+        # The client went away: stop the items still waiting or running
+        for task in tasks:
+            task.cancel()
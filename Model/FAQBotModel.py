@@ -1,21 +1,13 @@
-import os
-import requests
-from dotenv import load_dotenv
+import logging
 
-load_dotenv()
+from Model.openRouterClient import openrouter_client
 
-OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
-API_URL = "https://openrouter.ai/api/v1/chat/completions"
+logger = logging.getLogger(__name__)
 
-headers = {
-    "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-    "Content-Type": "application/json"
-}
-
-def get_FAQ_model_response(user_query: str, combined_str: str):
+def build_FAQ_request(user_query: str, combined_str: str):
     """
-    Gets a response from a language model (OpenRouter) for a user query,
-    given relevant document context. This version does NOT use conversation history.
+    Builds the OpenRouter chat completion body for an FAQ query, given
+    relevant document context.
 
     Args:
         user_query (str): The user's search query.
@@ -23,7 +15,7 @@ def get_FAQ_model_response(user_query: str, combined_str: str):
                               most relevant document chunk and its neighbors (if found).
 
     Returns:
-        str: The model's response, or None on error.
+        dict: The JSON body for the chat completions endpoint.
     """
 
     prompt = f"""You are a helpful and informative assistant. Your task is to answer the user's query based on the provided document context.
@@ -54,16 +46,32 @@ Instructions:
         "max_tokens": 1500
     }
 
-    print("Sending request to OpenRouter with data:", data)
-    response = requests.post(API_URL, json=data, headers=headers)
-    print("OpenRouter response status code:", response.status_code)
+    return data
+
+
+async def get_FAQ_model_response(user_query: str, combined_str: str):
+    """
+    Gets a response from a language model (OpenRouter) for a user query,
+    given relevant document context. This version does NOT use conversation history.
+
+    Args:
+        user_query (str): The user's search query.
+        combined_str (str): A string containing the combined text from the
+                              most relevant document chunk and its neighbors (if found).
+
+    Returns:
+        str: The model's response, or None on error.
+    """
+
+    data = build_FAQ_request(user_query, combined_str)
+
+    logger.debug("Sending request to OpenRouter with data: %s", data)
+    response = await openrouter_client.chat_completion(data)
     response_json = response.json()
 
     if response.status_code == 200:
         response_text = response_json['choices'][0]['message']['content'].strip()
-        print(response_text)
         return response_text
     else:
-        print(f"Error: {response.status_code}")
-        print("Failed Response")
+        logger.error("OpenRouter returned %d", response.status_code)
         return None
\ No newline at end of file
@@ -0,0 +1,66 @@
+import logging
+
+from Model.openRouterClient import openrouter_client
+
+logger = logging.getLogger(__name__)
+
+def build_summary_request(summary: str, conversation: str, max_tokens: int = 300):
+    """
+    Builds the OpenRouter chat completion body that folds older turns of a
+    conversation into its running summary.
+
+    Args:
+        summary (str): The summary of the conversation so far, may be empty.
+        conversation (str): The turns to fold in, one "role: content" line each.
+        max_tokens (int): Length limit of the new summary.
+
+    Returns:
+        dict: The JSON body for the chat completions endpoint.
+    """
+
+    prompt = f"""You maintain a short running summary of a conversation between a user and a website's shopping / support assistant.
+
+Summary so far:
+{summary or '(empty)'}
+
+New messages:
+{conversation}
+
+Instructions:
+- Rewrite the summary so it also covers the new messages.
+- Keep what later answers may depend on: products, SKUs, prices, quantities, the user's preferences, constraints and open questions.
+- Drop greetings and small talk.
+- Write plain sentences, no headings or lists, and stay under {max_tokens} tokens.
+- Reply with the summary only.
+"""
+
+    data = {
+        "model": "qwen/qwen3-235b-a22b:free",
+        "messages": [
+            {"role": "system", "content": "You summarize conversations accurately and concisely."},
+            {"role": "user", "content": prompt}
+        ],
+        "max_tokens": max_tokens
+    }
+
+    return data
+
+
+async def get_summary_model_response(summary: str, conversation: str, max_tokens: int = 300):
+    """
+    Gets the updated conversation summary from the language model.
+
+    Returns:
+        str: The new summary, or None on error.
+    """
+
+    data = build_summary_request(summary, conversation, max_tokens)
+
+    logger.debug("Sending summary request to OpenRouter with data: %s", data)
+    response = await openrouter_client.chat_completion(data)
+
+    if response.status_code == 200:
+        return response.json()['choices'][0]['message']['content'].strip()
+    else:
+        logger.error("OpenRouter returned %d", response.status_code)
+        return None
@@ -1,29 +1,23 @@
-import os
-import requests
-from dotenv import load_dotenv
+import logging
 
-load_dotenv()
+from Model.openRouterClient import openrouter_client
 
-OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
-API_URL = "https://openrouter.ai/api/v1/chat/completions"
+logger = logging.getLogger(__name__)
 
-headers = {
-    "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-    "Content-Type": "application/json"
-}
-
-def get_Woo_model_response(user_query: str, combined_str: str, chat_history: list = None):
+def build_Woo_request(user_query: str, combined_str: str, chat_history: str = ""):
     """
-    Gets a response from a language model (OpenRouter) for a user query,
-    given relevant product information.  This version does NOT use conversation history.
+    Builds the OpenRouter chat completion body for a WooCommerce query, given
+    relevant product information and the previous chat.
 
     Args:
         user_query (str): The user's search query.
         combined_str (str):  A string containing the combined product information
                             (e.g., from vector search results), separated by '---'.
+        chat_history (str): The previous messages of the conversation, already
+                            packed into the history token budget.
 
     Returns:
-        str: The model's response, or None on error.
+        dict: The JSON body for the chat completions endpoint.
     """
 
     prompt = f"""
@@ -35,7 +29,7 @@ def get_Woo_model_response(user_query: str, combined_str: str, chat_history: lis
     
     The previous chat is 
 
-    {chat_history}
+    {chat_history or '(no previous messages)'}
 
     Based on this query, I have retrieved the following relevant product information:
 
@@ -73,7 +67,7 @@ def get_Woo_model_response(user_query: str, combined_str: str, chat_history: lis
    - Provide only the most relevant information to the user's query.
 
 7. **Give Product Link as Well:**
-   - Fetch the "Product link" from the feild *Permalink* of {combined_str} and make it clickable us adding html tags.
+   - Fetch the "Product link" from the field *Permalink* of the product information above and make it clickable by adding html tags.
 
     Do NOT include any extraneous text or greetings.  Provide only the requested information in the specified format.
     """
@@ -87,17 +81,33 @@ def get_Woo_model_response(user_query: str, combined_str: str, chat_history: lis
         "max_tokens": 1500
     }
 
-    print("Sending request to OpenRouter with data:", data)
-    response = requests.post(API_URL, json=data, headers=headers)
-    print("OpenRouter response status code:", response.status_code)
+    return data
+
+
+async def get_Woo_model_response(user_query: str, combined_str: str, chat_history: str = ""):
+    """
+    Gets a response from a language model (OpenRouter) for a user query,
+    given relevant product information.  This version does NOT use conversation history.
+
+    Args:
+        user_query (str): The user's search query.
+        combined_str (str):  A string containing the combined product information
+                            (e.g., from vector search results), separated by '---'.
+
+    Returns:
+        str: The model's response, or None on error.
+    """
+
+    data = build_Woo_request(user_query, combined_str, chat_history)
+
+    logger.debug("Sending request to OpenRouter with data: %s", data)
+    response = await openrouter_client.chat_completion(data)
     response_json = response.json()
-    print("OpenRouter response JSON:", response_json)
+    logger.debug("OpenRouter response JSON: %s", response_json)
 
     if response.status_code == 200:
         response_text = response_json['choices'][0]['message']['content'].strip()
-        print(response_text)
         return response_text
     else:
-        print(f"Error: {response.status_code}")
-        print(response_json)
+        logger.error("OpenRouter returned %d: %s", response.status_code, response_json)
         return None
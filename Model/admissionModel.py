@@ -0,0 +1,158 @@
+"""
+Admission control of the chat path.
+
+Each site may run at most SITE_MAX_CONCURRENCY chat pipelines at once and
+start at most SITE_RATE_LIMIT per second (with bursts of SITE_RATE_BURST).
+Requests over either limit are rejected straight away rather than queued,
+so one busy site cannot take the embedding model, Mongo and the LLM
+provider away from the others.
+
+Identical first messages of a site that arrive while the same question is
+being answered join that pipeline instead of starting their own.
+"""
+import asyncio
+import math
+import os
+import time
+from typing import Dict, Hashable
+
+from cachetools import TTLCache
+from dotenv import load_dotenv
+
+from Model.metricsModel import Counter, registry, site_label, current_route
+
+load_dotenv()
+
+# Chat pipelines a site may run at once, 0 for no limit
+SITE_MAX_CONCURRENCY = int(os.getenv("SITE_MAX_CONCURRENCY", "8"))
+# Sustained chat requests per second a site may make, 0 for no limit
+SITE_RATE_LIMIT = float(os.getenv("SITE_RATE_LIMIT", "5"))
+# Requests a site may make in a burst above SITE_RATE_LIMIT
+SITE_RATE_BURST = float(os.getenv("SITE_RATE_BURST", "20"))
+
+ADMISSION_REJECTED = Counter(
+    "synapse_chat_rejected_total",
+    "Chat requests shed with a 429, by reason (concurrency, rate).",
+    ("reason", "route", "site_id"),
+)
+COALESCED = Counter(
+    "synapse_chat_coalesced_total",
+    "Chat requests answered by joining an identical in-flight request.",
+    ("route", "site_id"),
+)
+registry.extend([ADMISSION_REJECTED, COALESCED])
+
+
+class AdmissionRejected(Exception):
+    """A site is over its concurrency or rate limit; retry after retry_after seconds."""
+
+    def __init__(self, message: str, reason: str, retry_after: int):
+        super().__init__(message)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        """Takes a token; returns 0, or the seconds until a token is available if there is none."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class AdmissionController:
+    """
+    Per-site concurrency limit and token-bucket rate limit. acquire() never
+    waits: a site over its limits is rejected at once, so load is shed
+    before any embedding, search or LLM work starts.
+    """
+
+    def __init__(self, max_concurrency: int = SITE_MAX_CONCURRENCY, rate: float = SITE_RATE_LIMIT,
+                 burst: float = SITE_RATE_BURST, max_sites: int = 100000):
+        self.max_concurrency = max_concurrency
+        self.rate = rate
+        self.burst = max(burst, 1)
+        # An idle bucket refills completely within burst / rate seconds, so
+        # dropping it after that is the same as keeping it
+        ttl = max(60.0, self.burst / rate) if rate else 60.0
+        self._buckets = TTLCache(maxsize=max_sites, ttl=ttl)
+        self._in_flight: Dict[str, int] = {}
+
+    def acquire(self, site_id: str):
+        """Takes a slot of site_id (release it with release()) or raises AdmissionRejected."""
+        in_flight = self._in_flight.get(site_id, 0)
+        if self.max_concurrency and in_flight >= self.max_concurrency:
+            self._reject(site_id, "concurrency")
+            raise AdmissionRejected("Too many concurrent chat requests for this site.", "concurrency", 1)
+
+        if self.rate:
+            bucket = self._buckets.get(site_id)
+            if bucket is None:
+                bucket = self._buckets[site_id] = TokenBucket(self.rate, self.burst)
+            wait = bucket.take()
+            if wait:
+                self._reject(site_id, "rate")
+                raise AdmissionRejected("Chat rate limit exceeded for this site.", "rate", math.ceil(wait))
+
+        self._in_flight[site_id] = in_flight + 1
+
+    def release(self, site_id: str):
+        in_flight = self._in_flight.get(site_id, 0) - 1
+        if in_flight > 0:
+            self._in_flight[site_id] = in_flight
+        else:
+            self._in_flight.pop(site_id, None)
+
+    def _reject(self, site_id: str, reason: str):
+        ADMISSION_REJECTED.inc(reason=reason, route=current_route.get(), site_id=site_label(site_id))
+
+
+class SingleFlight:
+    """
+    Runs one call per key at a time: callers arriving while a call with the
+    same key is in flight wait for it and share its result (or exception).
+    A waiter that is cancelled does not cancel the shared call.
+
+    A caller may also name a key it is willing to share without publishing
+    its own call under it (join), so lower-priority work can ride on an
+    interactive call while interactive callers never queue behind it.
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+
+    async def do(self, key: Hashable, run, site_id: str = None, join: Hashable = None):
+        task = self._calls.get(join) if join is not None else None
+        if task is None:
+            task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(run())
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        else:
+            COALESCED.inc(route=current_route.get(), site_id=site_label(site_id))
+        return await asyncio.shield(task)
+
+    def _forget(self, key: Hashable, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            # Mark the exception as retrieved even if every waiter went away
+            task.exception()
+
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+
+chat_admission = AdmissionController()
+chat_single_flight = SingleFlight()
@@ -1,16 +1,19 @@
-from pymongo import MongoClient
+import logging
 import os
 from dotenv import load_dotenv
 
+from Model.pluginModel import get_client
+
 load_dotenv()
+
+logger = logging.getLogger(__name__)
+
 def Model():
-    print("connecting to model")
     try:
-        client = MongoClient(os.getenv('USERS_MONGO_URL'))
+        client = get_client(os.getenv('USERS_MONGO_URL'))
         db = client.api_embeddings
         collection = db.products
-        print("connection complete")
         return collection
     except Exception as e:
-        print(f"an exception occurred while connecting to supplement database:{e}")
-        return None
\ No newline at end of file
+        logger.error("an exception occurred while connecting to supplement database: %s", e)
+        return None
@@ -0,0 +1,209 @@
+import logging
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+import numpy as np
+from cachetools import TTLCache
+from dotenv import load_dotenv
+from pymongo import ReturnDocument
+
+from Model.pluginModel import SiteVersionModel
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "10000"))
+QUERY_EMBEDDING_CACHE_TTL = float(os.getenv("QUERY_EMBEDDING_CACHE_TTL", "3600"))
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "256"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "900"))
+# Cosine similarity above which a cached answer is reused for a different wording
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.95"))
+# How long a worker reuses a site's content version before reading it again
+SITE_VERSION_CACHE_TTL = float(os.getenv("SITE_VERSION_CACHE_TTL", "5"))
+
+
+def normalize_query(text: str) -> str:
+    """Lowercases, collapses whitespace and drops trailing punctuation."""
+    text = re.sub(r"\s+", " ", text.strip().lower())
+    return text.rstrip("?!. ")
+
+
+class QueryEmbeddingCache:
+    """
+    LRU/TTL cache of query embeddings keyed by normalized text.
+
+    An embedding only depends on the text and the model, so entries are
+    shared by every site and stay valid when a site re-ingests.
+    """
+
+    def __init__(self, maxsize: int = QUERY_EMBEDDING_CACHE_SIZE, ttl: float = QUERY_EMBEDDING_CACHE_TTL):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, text: str):
+        vector = self._cache.get(normalize_query(text))
+        if vector is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return vector
+
+    def put(self, text: str, vector):
+        self._cache[normalize_query(text)] = vector
+
+    def clear(self):
+        self._cache.clear()
+
+    def stats(self) -> dict:
+        return {"size": len(self._cache), "hits": self.hits, "misses": self.misses}
+
+
+class AnswerCache:
+    """
+    Per-site LRU/TTL cache of chat answers.
+
+    A lookup first tries the normalized text, then falls back to the most
+    similar cached query of the site whose cosine similarity reaches the
+    threshold. Dropping a site's answers bumps its generation, so an answer
+    computed from the old data is not stored.
+
+    Each worker process has its own cache: invalidate_site() also bumps the
+    site's content version in docEmbeddings.site_versions, and the other
+    workers drop their answers once sync_site() sees the new version (within
+    SITE_VERSION_CACHE_TTL).
+    """
+
+    def __init__(self, maxsize: int = ANSWER_CACHE_SIZE, ttl: float = ANSWER_CACHE_TTL,
+                 threshold: float = ANSWER_CACHE_SIMILARITY, version_ttl: float = SITE_VERSION_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.threshold = threshold
+        self._sites: Dict[str, OrderedDict] = {}
+        self._generations: Dict[str, int] = {}
+        # Content version of each site as last read from Mongo, and as last acted on
+        self._versions = TTLCache(maxsize=100000, ttl=version_ttl)
+        self._seen: Dict[str, int] = {}
+        self.hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def generation(self, site_id: str) -> int:
+        return self._generations.get(site_id, 0)
+
+    def _entries(self, site_id: str) -> OrderedDict:
+        entries = self._sites.get(site_id)
+        if entries is None:
+            return OrderedDict()
+        now = time.monotonic()
+        for key in [key for key, (_, _, expires_at) in entries.items() if expires_at <= now]:
+            del entries[key]
+        return entries
+
+    def get(self, site_id: str, text: str, vector=None):
+        entries = self._entries(site_id)
+        key = normalize_query(text)
+        if key in entries:
+            entries.move_to_end(key)
+            self.hits += 1
+            return entries[key][1]
+
+        # Answers stored without a query vector (lexical fast path) only match by text
+        keys = [k for k, entry in entries.items() if entry[0] is not None] if vector is not None else []
+        if keys:
+            matrix = np.stack([entries[k][0] for k in keys])
+            scores = matrix @ unit(vector)
+            best = int(np.argmax(scores))
+            if scores[best] >= self.threshold:
+                entries.move_to_end(keys[best])
+                self.similar_hits += 1
+                return entries[keys[best]][1]
+
+        self.misses += 1
+        return None
+
+    def put(self, site_id: str, text: str, vector, answer, generation: int = None):
+        if generation is not None and generation != self.generation(site_id):
+            # The site was re-ingested while this answer was being generated
+            return
+        entries = self._sites.setdefault(site_id, OrderedDict())
+        vector = unit(vector) if vector is not None else None
+        entries[normalize_query(text)] = (vector, answer, time.monotonic() + self.ttl)
+        entries.move_to_end(normalize_query(text))
+        while len(entries) > self.maxsize:
+            entries.popitem(last=False)
+
+    def _drop_site(self, site_id: str):
+        self._sites.pop(site_id, None)
+        self._generations[site_id] = self.generation(site_id) + 1
+        self.invalidations += 1
+
+    async def _shared_version(self, site_id: str) -> Optional[int]:
+        if site_id in self._versions:
+            return self._versions[site_id]
+        collection = SiteVersionModel()
+        if collection is None:
+            return None
+        try:
+            doc = await collection.find_one({"_id": site_id}, {"version": 1})
+        except Exception as e:
+            logger.error("error reading the content version of site_id %s: %s", site_id, e)
+            return None
+        version = doc["version"] if doc else 0
+        self._versions[site_id] = version
+        return version
+
+    async def sync_site(self, site_id: str) -> int:
+        """
+        Drops the site's answers if another worker changed its content since
+        the last call, and returns the generation to pass to put().
+        """
+        version = await self._shared_version(site_id)
+        if version is not None:
+            if self._seen.get(site_id, version) != version:
+                self._drop_site(site_id)
+            self._seen[site_id] = version
+        return self.generation(site_id)
+
+    async def invalidate_site(self, site_id: str):
+        """Drops the site's answers in this worker and, through its content version, in the others."""
+        self._drop_site(site_id)
+        collection = SiteVersionModel()
+        if collection is None:
+            return
+        try:
+            doc = await collection.find_one_and_update(
+                {"_id": site_id}, {"$inc": {"version": 1}}, upsert=True, return_document=ReturnDocument.AFTER
+            )
+            self._versions[site_id] = self._seen[site_id] = doc["version"]
+        except Exception as e:
+            logger.error("error bumping the content version of site_id %s: %s", site_id, e)
+
+    def stats(self) -> dict:
+        return {
+            "sites": len(self._sites),
+            "size": sum(len(entries) for entries in self._sites.values()),
+            "hits": self.hits,
+            "similar_hits": self.similar_hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+        }
+
+
+def unit(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+query_embedding_cache = QueryEmbeddingCache()
+answer_cache = AnswerCache()
+
+
+def cache_stats() -> dict:
+    return {"query_embeddings": query_embedding_cache.stats(), "answers": answer_cache.stats()}
@@ -0,0 +1,100 @@
+"""
+Fits retrieved context and chat history into token budgets before they
+are put into an LLM prompt, so prompt size (and with it LLM latency and
+cost) stays bounded whatever the retrieval returns.
+
+Tokens are counted with the embedding model's tokenizer, which is a close
+enough proxy for the LLM's own tokenizer. Getting it loads the model if
+warmup has not yet, so these functions block: call them off the event
+loop (asyncio.to_thread).
+"""
+import os
+from typing import List, Tuple
+
+from dotenv import load_dotenv
+
+from Model.embeddingModel import embedding_service
+
+load_dotenv()
+
+# Budget for the retrieved products/chunks of one prompt
+PROMPT_CONTEXT_TOKENS = int(os.getenv("PROMPT_CONTEXT_TOKENS", "1500"))
+# Budget for the chat history of one prompt, most recent messages kept first
+PROMPT_HISTORY_TOKENS = int(os.getenv("PROMPT_HISTORY_TOKENS", "400"))
+# Cap for each free-text product field (description, short description)
+PROMPT_FIELD_TOKENS = int(os.getenv("PROMPT_FIELD_TOKENS", "150"))
+
+
+def fit_tokens(text: str, max_tokens: int) -> Tuple[str, int]:
+    """Returns text cut to at most max_tokens tokens (at a token boundary) and its token count."""
+    if max_tokens <= 0 or not text:
+        return "", 0
+    encoding = embedding_service.thread_tokenizer().encode(text, add_special_tokens=False)
+    if len(encoding.ids) <= max_tokens:
+        return text, len(encoding.ids)
+    cut = encoding.offsets[max_tokens][0]
+    return text[:cut].rstrip() + "…", max_tokens
+
+
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    return len(embedding_service.thread_tokenizer().encode(text, add_special_tokens=False).ids)
+
+
+def pack(texts: List[str], budget: int = PROMPT_CONTEXT_TOKENS) -> Tuple[List[int], List[str], int]:
+    """
+    Keeps texts, given best first, while they fit in budget. A text that
+    does not fit is skipped (a smaller one after it may still fit), except
+    the first one, which is truncated so the prompt always has the best
+    match.
+
+    Returns:
+        The positions of the kept texts, the kept (possibly truncated)
+        texts and the number of tokens used.
+    """
+    positions, kept, used = [], [], 0
+    for position, text in enumerate(texts):
+        tokens = count_tokens(text)
+        if used + tokens > budget:
+            if kept:
+                continue
+            text, tokens = fit_tokens(text, budget)
+        positions.append(position)
+        kept.append(text)
+        used += tokens
+    return positions, kept, used
+
+
+def format_message(message) -> str:
+    if isinstance(message, dict):
+        role = message.get("role") or message.get("sender") or "user"
+        content = message.get("content") or message.get("message") or message.get("text") or ""
+        return f"{role}: {content}"
+    return str(message)
+
+
+def pack_history(chat_history, budget: int = PROMPT_HISTORY_TOKENS) -> Tuple[str, int]:
+    """
+    Renders the most recent messages of chat_history that fit in budget,
+    oldest first. Older messages are dropped as a block so the kept history
+    has no gaps.
+    """
+    if not chat_history:
+        return "", 0
+    if not isinstance(chat_history, list):
+        chat_history = [chat_history]
+
+    lines, used = [], 0
+    for message in reversed(chat_history):
+        line = format_message(message)
+        tokens = count_tokens(line)
+        if used + tokens > budget:
+            if not lines:
+                line, tokens = fit_tokens(line, budget)
+                lines.append(line)
+                used += tokens
+            break
+        lines.append(line)
+        used += tokens
+    return "\n".join(reversed(lines)), used
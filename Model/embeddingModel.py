@@ -0,0 +1,243 @@
+import asyncio
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_MODEL_NAME = os.getenv("EMBEDDING_MODEL_NAME", "sentence-transformers/all-MiniLM-L6-v2")
+# "torch" runs SentenceTransformer, "onnx" runs an ONNX Runtime export (see Model/onnxEmbeddingModel.py)
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch").lower()
+EMBEDDING_WORKERS = int(os.getenv("EMBEDDING_WORKERS", "1"))
+# Number of texts per forward pass during ingestion
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+# Chat queries arriving within this window are merged into one forward pass
+EMBEDDING_MICROBATCH_WAIT_MS = float(os.getenv("EMBEDDING_MICROBATCH_WAIT_MS", "5"))
+EMBEDDING_MICROBATCH_MAX_SIZE = int(os.getenv("EMBEDDING_MICROBATCH_MAX_SIZE", "32"))
+# Threads of a torch forward pass in each worker, 0 keeps torch's default
+EMBEDDING_TORCH_THREADS = int(os.getenv("EMBEDDING_TORCH_THREADS", "0"))
+
+# Inputs of the warmup forward passes: a short query and a chunk-sized text
+WARMUP_TEXTS = ["warmup", " ".join(["warmup"] * 200)]
+
+
+class EmbeddingService:
+    """
+    Process-wide holder for the sentence embedding model.
+
+    The model is loaded once (at app startup) and inference runs on a small
+    thread pool so the event loop is never blocked by a forward pass.
+    """
+
+    def __init__(self, model_name: str = EMBEDDING_MODEL_NAME, max_workers: int = EMBEDDING_WORKERS,
+                 batch_size: int = EMBEDDING_BATCH_SIZE, backend: str = EMBEDDING_BACKEND):
+        if backend not in ("torch", "onnx"):
+            raise ValueError(f"Unknown EMBEDDING_BACKEND: {backend}")
+        self.model_name = model_name
+        self.backend = backend
+        self.batch_size = batch_size
+        self._model = None
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="embedding")
+        self._batcher = None
+        self._local = threading.local()
+        self.ready = False
+
+    def load(self):
+        """Loads the model if it is not loaded yet and returns it."""
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    logger.info("Loading embedding model: %s (%s backend)", self.model_name, self.backend)
+                    if self.backend == "onnx":
+                        from Model.onnxEmbeddingModel import OnnxEncoder, ensure_onnx_model, EMBEDDING_ONNX_QUANTIZE
+                        self._model = OnnxEncoder(ensure_onnx_model(self.model_name), EMBEDDING_ONNX_QUANTIZE)
+                    else:
+                        from sentence_transformers import SentenceTransformer
+                        self._model = SentenceTransformer(self.model_name)
+        return self._model
+
+    def warmup(self):
+        """
+        Loads the model and runs a few forward passes, so the first requests
+        do not pay for lazy initialisation (kernels, allocator, tokenizer).
+        Sets ready when done.
+        """
+        if self.ready:
+            return
+        if self.backend == "torch" and EMBEDDING_TORCH_THREADS:
+            import torch
+            torch.set_num_threads(EMBEDDING_TORCH_THREADS)
+        self.load()
+        for text in WARMUP_TEXTS:
+            self.encode([text])
+        self.encode(WARMUP_TEXTS * 4)
+        self.thread_tokenizer()
+        self.ready = True
+        logger.info("Embedding model warmed up")
+
+    def preload(self):
+        """
+        Prepares the model in a server's master process, before workers
+        are forked. The torch weights are loaded and warmed up with a
+        single thread, so no intra-op thread pool exists at fork time (it
+        would not survive into the workers) and each worker shares the
+        weights copy-on-write. ONNX Runtime sessions own threads from the
+        start, so for the onnx backend only the export is prepared and each
+        worker opens its own session.
+        """
+        if self.backend == "onnx":
+            from Model.onnxEmbeddingModel import ensure_onnx_model
+            ensure_onnx_model(self.model_name)
+            return
+        import torch
+        threads = torch.get_num_threads()
+        torch.set_num_threads(1)
+        self.load()
+        for text in WARMUP_TEXTS:
+            self.encode([text])
+        torch.set_num_threads(EMBEDDING_TORCH_THREADS or threads)
+
+    @property
+    def max_seq_length(self) -> int:
+        """Longest input in tokens (special tokens included) the model embeds without truncation."""
+        return self.load().max_seq_length
+
+    def new_tokenizer(self):
+        """
+        Returns an independent copy of the model's fast tokenizer (a
+        tokenizers.Tokenizer) without truncation or padding, for counting
+        tokens outside the inference thread.
+        """
+        from tokenizers import Tokenizer
+        source = self.load().tokenizer
+        # SentenceTransformer wraps the fast tokenizer, the ONNX encoder uses it directly
+        source = getattr(source, "backend_tokenizer", source)
+        tokenizer = Tokenizer.from_str(source.to_str())
+        tokenizer.no_truncation()
+        tokenizer.no_padding()
+        return tokenizer
+
+    def thread_tokenizer(self):
+        """Per-thread tokenizer from new_tokenizer(), for sizing chunks and prompts."""
+        if not hasattr(self._local, "tokenizer"):
+            self._local.tokenizer = self.new_tokenizer()
+        return self._local.tokenizer
+
+    def encode(self, texts: List[str], batch_size: int = None):
+        """Synchronous encode; returns a (len(texts), dim) numpy array."""
+        return self.load().encode(texts, batch_size=batch_size or self.batch_size)
+
+    async def embed(self, texts: List[str], batch_size: int = None):
+        """
+        Embeds a list of texts without blocking the event loop.
+
+        Large inputs are fed to the model in slices of ``batch_size`` so a big
+        ingestion job does not hold the inference thread for its whole
+        duration and chat queries can run in between.
+
+        Args:
+            texts (List[str]): The texts to embed.
+            batch_size (int): Texts per forward pass, defaults to EMBEDDING_BATCH_SIZE.
+
+        Returns:
+            numpy.ndarray: One embedding row per input text.
+        """
+        texts = list(texts)
+        batch_size = batch_size or self.batch_size
+        loop = asyncio.get_running_loop()
+        if len(texts) <= batch_size:
+            return await loop.run_in_executor(self._executor, self.encode, texts, batch_size)
+
+        parts = []
+        for start in range(0, len(texts), batch_size):
+            batch = texts[start:start + batch_size]
+            parts.append(await loop.run_in_executor(self._executor, self.encode, batch, batch_size))
+        return np.vstack(parts)
+
+    async def embed_query(self, text: str):
+        """
+        Embeds a single chat query through the micro-batching queue, so
+        concurrent queries share one forward pass.
+        """
+        if self._batcher is None:
+            self._batcher = MicroBatcher(self)
+        return await self._batcher.submit(text)
+
+    def shutdown(self):
+        if self._batcher is not None:
+            self._batcher.stop()
+            self._batcher = None
+        self._executor.shutdown(wait=False)
+
+
+class MicroBatcher:
+    """
+    Collects single-text embedding requests for a few milliseconds and runs
+    them as one batch.
+    """
+
+    def __init__(self, service: EmbeddingService, max_wait_ms: float = EMBEDDING_MICROBATCH_WAIT_MS,
+                 max_batch_size: int = EMBEDDING_MICROBATCH_MAX_SIZE):
+        self.service = service
+        self.max_wait = max_wait_ms / 1000
+        self.max_batch_size = max_batch_size
+        self._queue = asyncio.Queue()
+        self._task = None
+
+    async def submit(self, text: str):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((text, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            pending = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(pending) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    pending.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                vectors = await self.service.embed([text for text, _ in pending])
+            except Exception as e:
+                for _, future in pending:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            for (_, future), vector in zip(pending, vectors):
+                if not future.done():
+                    future.set_result(vector)
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+
+
+embedding_service = EmbeddingService()
+
+
+async def embed(texts: List[str], batch_size: int = None):
+    """Shortcut for embedding_service.embed, used by the controllers."""
+    return await embedding_service.embed(texts, batch_size)
+
+
+async def embed_query(text: str):
+    """Shortcut for embedding_service.embed_query, used on the chat path."""
+    return await embedding_service.embed_query(text)
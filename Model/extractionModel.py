@@ -0,0 +1,129 @@
+"""
+Text extraction of uploaded documents.
+
+PyMuPDF and python-docx hold the GIL while parsing, so bulk uploads
+extract their files on a pool of EXTRACT_PROCESSES processes. The pool
+uses the spawn start method: its processes import this module only, not
+the app, torch or the embedding model.
+"""
+import multiprocessing
+import os
+import shutil
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+EXTRACT_PROCESSES = int(os.getenv("EXTRACT_PROCESSES", str(min(4, os.cpu_count() or 1))))
+# Limits of an upload (/doc, or all files of a /docs request), zip archives
+# also checked uncompressed
+BULK_UPLOAD_MAX_FILES = int(os.getenv("BULK_UPLOAD_MAX_FILES", "500"))
+BULK_UPLOAD_MAX_BYTES = int(os.getenv("BULK_UPLOAD_MAX_BYTES", str(500 * 1024 * 1024)))
+
+
+def iter_text_from_pdf(path: str):
+    """Yields the text of a PDF page by page."""
+    # Imported here so only processes that extract PDFs pay for PyMuPDF
+    import fitz
+    with fitz.open(path) as doc:
+        for page in doc:
+            yield page.get_text()
+
+def iter_text_from_docx(path: str):
+    """Yields the text of a DOCX paragraph by paragraph."""
+    from docx import Document
+    doc = Document(path)
+    for para in doc.paragraphs:
+        yield para.text + "\n"
+
+def iter_text_from_txt(path: str):
+    """Yields a UTF-8 text file paragraph by paragraph (blank-line separated)."""
+    paragraph = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            paragraph.append(line)
+            if not line.strip():
+                yield "".join(paragraph)
+                paragraph = []
+    if paragraph:
+        yield "".join(paragraph)
+
+TEXT_EXTRACTORS = {
+    ".txt": iter_text_from_txt,
+    ".pdf": iter_text_from_pdf,
+    ".docx": iter_text_from_docx,
+}
+
+
+def extract_text(path: str, ext: str) -> Tuple[List[str], float]:
+    """Extracts a whole file (in a pool process); returns its text pieces and the seconds it took."""
+    start = time.perf_counter()
+    pieces = list(TEXT_EXTRACTORS[ext](path))
+    return pieces, time.perf_counter() - start
+
+
+_pool = None
+
+
+def extraction_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=EXTRACT_PROCESSES, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+def shutdown_extraction_pool():
+    """Stops the pool processes; called when the app shuts down."""
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def discard_extraction_pool(pool: ProcessPoolExecutor):
+    """
+    Shuts down pool after one of its processes died, unless it was already
+    replaced, so the next extraction_pool() call starts a new one.
+    """
+    global _pool
+    if pool is _pool:
+        _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+def unpack_zip(path: str, directory: str, max_files: int = BULK_UPLOAD_MAX_FILES,
+               max_bytes: int = BULK_UPLOAD_MAX_BYTES) -> List[Tuple[str, str, str]]:
+    """
+    Copies the supported files of a zip archive into directory, under
+    generated names so member paths cannot escape it.
+
+    Returns:
+        list: (member name, path, extension) of every supported member.
+    Raises:
+        UploadTooLarge: when the archive has more than max_files supported
+        members or they add up to more than max_bytes uncompressed.
+    """
+    files = []
+    total = 0
+    with zipfile.ZipFile(path) as archive:
+        for info in archive.infolist():
+            ext = os.path.splitext(info.filename)[1].lower()
+            if info.is_dir() or ext not in TEXT_EXTRACTORS or os.path.basename(info.filename).startswith("."):
+                continue
+            total += info.file_size
+            if len(files) >= max_files or total > max_bytes:
+                raise UploadTooLarge(f"{os.path.basename(path)} has more than {max_files} files "
+                                     f"or {max_bytes} bytes of documents")
+            target = os.path.join(directory, f"{len(files)}{ext}")
+            with archive.open(info) as source, open(target, "wb") as out:
+                shutil.copyfileobj(source, out, 1024 * 1024)
+            files.append((info.filename, target, ext))
+    return files
@@ -0,0 +1,139 @@
+"""
+Versioned index generations of the blogSites chunks.
+
+A full re-ingestion writes the new chunks of a site under a new generation
+number, next to the live ones, and publishes them by moving the site's
+pointer in docEmbeddings.index_generations, a single-document update.
+Chat reads are pinned to the published generation, so they never see a
+half-built index. Superseded generations are deleted in the background
+GENERATION_GC_DELAY seconds after the flip, long enough for requests
+(and other workers' cached pointers) still on the old one to finish.
+
+Chunks ingested before generations existed are adopted as generation 0
+(LEGACY_GENERATION) at startup, since Atlas $vectorSearch filters cannot
+match a missing field; they are served until the site's first generation
+is published.
+"""
+import asyncio
+import datetime
+import logging
+import os
+from typing import Optional
+
+from cachetools import TTLCache
+from dotenv import load_dotenv
+from pymongo import ReturnDocument
+
+from Model.pluginModel import AsyncModel, GenerationModel
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# How long a worker reuses a site's published generation before reading the pointer again
+GENERATION_CACHE_TTL = float(os.getenv("GENERATION_CACHE_TTL", "5"))
+# Delay between publishing a generation and deleting the ones it replaced
+GENERATION_GC_DELAY = float(os.getenv("GENERATION_GC_DELAY", "60"))
+# Generation of the chunks ingested before generations existed; begin() numbers from 1
+LEGACY_GENERATION = 0
+
+
+class IndexGenerations:
+    def __init__(self, cache_ttl: float = GENERATION_CACHE_TTL, gc_delay: float = GENERATION_GC_DELAY):
+        self.gc_delay = max(gc_delay, cache_ttl)
+        self._current = TTLCache(maxsize=100000, ttl=cache_ttl)
+        self._tasks = set()
+
+    @staticmethod
+    def _id(site_id: str, kind: str) -> str:
+        return f"{site_id}:{kind}"
+
+    async def current(self, site_id: str, kind: str) -> Optional[int]:
+        """Published generation of a site's kind, None if it has never published one."""
+        key = (site_id, kind)
+        if key in self._current:
+            return self._current[key]
+        doc = await GenerationModel().find_one({"_id": self._id(site_id, kind)}, {"current": 1})
+        generation = doc.get("current") if doc else None
+        self._current[key] = generation
+        return generation
+
+    async def adopt_legacy(self):
+        """Tags unversioned blogSites chunks with LEGACY_GENERATION; called at startup."""
+        try:
+            result = await AsyncModel().update_many(
+                {"for": "blogSites", "generation": {"$exists": False}},
+                {"$set": {"generation": LEGACY_GENERATION}},
+            )
+            if result.modified_count:
+                logger.info("Adopted %d unversioned chunks as generation %d", result.modified_count, LEGACY_GENERATION)
+        except Exception as e:
+            logger.error("Failed to adopt unversioned chunks: %s", e)
+
+    async def begin(self, site_id: str, kind: str) -> int:
+        """Reserves the number of a new, unpublished generation."""
+        doc = await GenerationModel().find_one_and_update(
+            {"_id": self._id(site_id, kind)},
+            {"$inc": {"next": 1}, "$setOnInsert": {"site_id": site_id, "kind": kind}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        return doc["next"]
+
+    async def publish(self, site_id: str, kind: str, generation: int) -> bool:
+        """
+        Makes generation the one chat reads use and schedules the collection
+        of the older ones. Returns False, and discards generation, when a
+        newer generation was published in the meantime.
+        """
+        result = await GenerationModel().update_one(
+            {"_id": self._id(site_id, kind),
+             "$or": [{"current": {"$exists": False}}, {"current": {"$lt": generation}}]},
+            {"$set": {"current": generation, "published_at": datetime.datetime.utcnow()}},
+        )
+        if not result.modified_count:
+            logger.warning("Generation %d of %s for site_id %s superseded before publishing", generation, kind, site_id)
+            await self.discard(site_id, kind, generation)
+            return False
+
+        self._current[(site_id, kind)] = generation
+        task = asyncio.create_task(self.collect(site_id, kind, generation, self.gc_delay))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        logger.info("Published generation %d of %s for site_id %s", generation, kind, site_id)
+        return True
+
+    async def discard(self, site_id: str, kind: str, generation: int):
+        """Deletes the documents of a generation that will not be published."""
+        try:
+            result = await AsyncModel().delete_many({"site_id": site_id, "for": kind, "generation": generation})
+            logger.info("Discarded %d documents of generation %d of %s for site_id %s",
+                        result.deleted_count, generation, kind, site_id)
+        except Exception as e:
+            logger.error("Failed to discard generation %d for site_id %s: %s", generation, site_id, e)
+
+    async def collect(self, site_id: str, kind: str, generation: int, delay: float = 0):
+        """Deletes the documents of every generation older than generation (and unversioned ones)."""
+        await asyncio.sleep(delay)
+        try:
+            result = await AsyncModel().delete_many({
+                "site_id": site_id,
+                "for": kind,
+                "$or": [{"generation": {"$lt": generation}}, {"generation": {"$exists": False}}],
+            })
+            logger.info("Collected %d documents older than generation %d of %s for site_id %s",
+                        result.deleted_count, generation, kind, site_id)
+        except Exception as e:
+            logger.error("Failed to collect old generations for site_id %s: %s", site_id, e)
+
+    async def close(self):
+        """
+        Cancels the pending collections; called when the app shuts down.
+        The next publish of the site collects what they would have deleted.
+        """
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+index_generations = IndexGenerations()
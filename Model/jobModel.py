@@ -0,0 +1,333 @@
+"""
+Background ingestion jobs.
+
+Each worker process runs the jobs it accepted (their payloads, such as
+spooled uploads or a streamed request body, live in that process), but
+their statuses are saved to docEmbeddings.ingest_jobs so GET /jobs/{id}
+answers on any worker, and a worker only starts a job once it holds the
+site's lease in docEmbeddings.ingest_locks, so two workers never ingest
+the same site at once.
+"""
+import asyncio
+import datetime
+import logging
+import os
+import time
+import uuid
+from collections import deque
+from typing import Awaitable, Callable, Dict, Optional
+
+from dotenv import load_dotenv
+from pymongo.errors import DuplicateKeyError
+
+from Model.metricsModel import current_route
+from Model.pluginModel import JobLockModel, JobModel
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Number of ingestion jobs processed concurrently (never two for the same site)
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+# How long finished jobs stay queryable
+JOB_RETENTION_SECONDS = float(os.getenv("JOB_RETENTION_SECONDS", "3600"))
+# How long a site's lease outlives the last renewal by the worker holding it
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "60"))
+# How often unfinished jobs are saved and the leases of running ones renewed
+JOB_PROGRESS_INTERVAL = float(os.getenv("JOB_PROGRESS_INTERVAL", "2"))
+
+
+class Job:
+    """State and progress of one background ingestion job."""
+
+    def __init__(self, site_id: str, kind: str, run: Callable[["Job"], Awaitable[dict]],
+                 cleanup: Optional[Callable[[], None]] = None):
+        self.id = uuid.uuid4().hex
+        self.site_id = site_id
+        self.kind = kind
+        self.run = run
+        self.cleanup = cleanup
+        self.status = "queued"
+        self.phase = "queued"
+        self.items_done = 0
+        self.items_total = None
+        self.result = None
+        self.error = None
+        # HTTP status of the exception a failed job raised
+        self.status_code = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._done = asyncio.Event()
+
+    async def wait(self):
+        """Waits until the job has finished, failed or been superseded."""
+        await self._done.wait()
+
+    def set_phase(self, phase: str):
+        self.phase = phase
+
+    def set_total(self, total: int):
+        self.items_total = total
+
+    def advance(self, count: int):
+        self.items_done += count
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("succeeded", "failed", "superseded")
+
+    def to_dict(self) -> dict:
+        elapsed = None
+        throughput = None
+        if self.started_at is not None:
+            elapsed = (self.finished_at or time.time()) - self.started_at
+            throughput = self.items_done / elapsed if elapsed > 0 else None
+        return {
+            "job_id": self.id,
+            "site_id": self.site_id,
+            "kind": self.kind,
+            "status": self.status,
+            "phase": self.phase,
+            "items_done": self.items_done,
+            "items_total": self.items_total,
+            "elapsed_seconds": elapsed,
+            "items_per_second": throughput,
+            "result": self.result,
+            "error": self.error,
+        }
+
+    def to_document(self) -> dict:
+        """What is saved to docEmbeddings.ingest_jobs."""
+        now = datetime.datetime.utcnow()
+        return {
+            **self.to_dict(),
+            "status_code": self.status_code,
+            "updated_at": now,
+            "expires_at": now + datetime.timedelta(seconds=JOB_RETENTION_SECONDS),
+        }
+
+
+class JobManager:
+    """
+    Queue of the ingestion jobs accepted by this process, served by a small
+    pool of asyncio workers, with at most one running job per site_id
+    across every worker process.
+
+    Enqueuing a job while an older job of the same site and kind is still
+    waiting supersedes the older one, so a client retry does not trigger two
+    full re-ingests. Jobs still queued or running when their process stops
+    are lost; their saved status then stops being updated and is reported
+    as failed once it is older than JOB_LEASE_SECONDS.
+    """
+
+    def __init__(self, workers: int = INGEST_WORKERS):
+        self.workers = workers
+        self.jobs: Dict[str, Job] = {}
+        self._pending = deque()
+        self._active_sites = set()
+        # site_id -> time.monotonic() after which to try again a site leased by another process
+        self._leased_elsewhere: Dict[str, float] = {}
+        self._condition = None
+        self._tasks = []
+
+    def start(self):
+        self._condition = asyncio.Condition()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._report()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        while self._pending:
+            job = self._pending.popleft()
+            self._discard(job, "superseded")
+            job.error = "The server stopped before the job started"
+            await self._save(job)
+
+    async def enqueue(self, site_id: str, kind: str, run: Callable[[Job], Awaitable[dict]],
+                      cleanup: Optional[Callable[[], None]] = None) -> Job:
+        self._prune()
+        job = Job(site_id, kind, run, cleanup)
+        # Saved before a worker can pick it up, so "queued" never overwrites a later status
+        await self._save(job)
+        superseded = []
+        async with self._condition:
+            for queued in [j for j in self._pending if j.site_id == site_id and j.kind == kind]:
+                self._pending.remove(queued)
+                self._discard(queued, "superseded")
+                queued.error = f"Superseded by job {job.id}"
+                superseded.append(queued)
+            self.jobs[job.id] = job
+            self._pending.append(job)
+            self._condition.notify_all()
+        for queued in superseded:
+            await self._save(queued)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self.jobs.get(job_id)
+
+    async def lookup(self, job_id: str) -> Optional[dict]:
+        """Status of a job accepted by any worker process, as Job.to_dict()."""
+        job = self.jobs.get(job_id)
+        if job is not None:
+            return job.to_dict()
+        collection = JobModel()
+        if collection is None:
+            return None
+        doc = await collection.find_one({"_id": job_id}, {"_id": 0, "status_code": 0, "expires_at": 0})
+        if doc is None:
+            return None
+        updated_at = doc.pop("updated_at", None)
+        stale = updated_at is None or (datetime.datetime.utcnow() - updated_at).total_seconds() > JOB_LEASE_SECONDS
+        if doc["status"] in ("queued", "running") and stale:
+            doc.update(status="failed", phase="done", error="The worker process running the job stopped")
+        return doc
+
+    async def busy_job(self, site_id: str) -> Optional[str]:
+        """Id of a queued or running job of site_id, in this or another worker process, if any."""
+        for job in self.jobs.values():
+            if job.site_id == site_id and not job.finished:
+                return job.id
+        collection = JobLockModel()
+        if collection is None:
+            return None
+        try:
+            lease = await collection.find_one({"_id": site_id, "expires_at": {"$gt": datetime.datetime.utcnow()}})
+        except Exception as e:
+            logger.error("error reading the lease of site_id %s: %s", site_id, e)
+            return None
+        return lease["owner"] if lease else None
+
+    async def _save(self, job: Job):
+        collection = JobModel()
+        if collection is None:
+            return
+        try:
+            await collection.replace_one({"_id": job.id}, job.to_document(), upsert=True)
+        except Exception as e:
+            logger.error("error saving job %s: %s", job.id, e)
+
+    async def _lease(self, job: Job) -> bool:
+        """Takes or renews the lease of job's site; False when another job holds it."""
+        collection = JobLockModel()
+        if collection is None:
+            return True
+        now = datetime.datetime.utcnow()
+        try:
+            await collection.update_one(
+                {"_id": job.site_id, "$or": [{"owner": job.id}, {"expires_at": {"$lte": now}}]},
+                {"$set": {"owner": job.id, "expires_at": now + datetime.timedelta(seconds=JOB_LEASE_SECONDS)}},
+                upsert=True,
+            )
+            return True
+        except DuplicateKeyError:
+            return False
+        except Exception as e:
+            # Mongo is unreachable: the job would fail anyway, let it report why
+            logger.error("error leasing site_id %s for job %s: %s", job.site_id, job.id, e)
+            return True
+
+    async def _release(self, job: Job):
+        collection = JobLockModel()
+        if collection is None:
+            return
+        try:
+            await collection.delete_one({"_id": job.site_id, "owner": job.id})
+        except Exception as e:
+            logger.error("error releasing the lease of site_id %s: %s", job.site_id, e)
+
+    def _discard(self, job: Job, status: str):
+        job.status = status
+        job.phase = "done"
+        job.finished_at = time.time()
+        job._done.set()
+        if job.cleanup is not None:
+            job.cleanup()
+
+    def _next_job(self) -> Optional[Job]:
+        now = time.monotonic()
+        for site_id in [site_id for site_id, retry_at in self._leased_elsewhere.items() if retry_at <= now]:
+            del self._leased_elsewhere[site_id]
+        for job in self._pending:
+            if job.site_id not in self._active_sites and job.site_id not in self._leased_elsewhere:
+                self._pending.remove(job)
+                return job
+        return None
+
+    async def _claim(self) -> Job:
+        """Waits for a pending job whose site no other job, in any process, is ingesting."""
+        while True:
+            async with self._condition:
+                job = self._next_job()
+                while job is None:
+                    timeout = None
+                    if self._leased_elsewhere:
+                        timeout = max(min(self._leased_elsewhere.values()) - time.monotonic(), 0)
+                    try:
+                        await asyncio.wait_for(self._condition.wait(), timeout)
+                    except asyncio.TimeoutError:
+                        pass
+                    job = self._next_job()
+                self._active_sites.add(job.site_id)
+
+            if await self._lease(job):
+                return job
+            async with self._condition:
+                self._active_sites.discard(job.site_id)
+                self._leased_elsewhere[job.site_id] = time.monotonic() + JOB_PROGRESS_INTERVAL
+                if any(j.site_id == job.site_id and j.kind == job.kind for j in self._pending):
+                    # Superseded while its lease was being requested
+                    self._discard(job, "superseded")
+                    await self._save(job)
+                else:
+                    self._pending.appendleft(job)
+
+    async def _worker(self):
+        while True:
+            job = await self._claim()
+            job.status = "running"
+            job.started_at = time.time()
+            await self._save(job)
+            # Stage timings recorded by the job are labelled with its kind
+            current_route.set(f"job:{job.kind}")
+            try:
+                job.result = await job.run(job)
+                job.status = "succeeded"
+            except Exception as e:
+                logger.error("Job %s (%s) for site_id %s failed: %s", job.id, job.kind, job.site_id, e)
+                job.error = getattr(e, "detail", None) or str(e)
+                job.status_code = getattr(e, "status_code", 500)
+                job.status = "failed"
+            finally:
+                job.phase = "done"
+                job.finished_at = time.time()
+                job._done.set()
+                if job.cleanup is not None:
+                    job.cleanup()
+                await self._save(job)
+                await self._release(job)
+                async with self._condition:
+                    self._active_sites.discard(job.site_id)
+                    self._condition.notify_all()
+
+    async def _report(self):
+        """Saves the progress of the unfinished jobs and renews the leases of the running ones."""
+        while True:
+            await asyncio.sleep(JOB_PROGRESS_INTERVAL)
+            for job in [job for job in self.jobs.values() if not job.finished]:
+                await self._save(job)
+                if job.status == "running" and not await self._lease(job):
+                    logger.warning("Lost the lease of site_id %s while running job %s", job.site_id, job.id)
+
+    def _prune(self):
+        cutoff = time.time() - JOB_RETENTION_SECONDS
+        for job_id in [job_id for job_id, job in self.jobs.items()
+                       if job.finished and job.finished_at < cutoff]:
+            del self.jobs[job_id]
+
+
+job_manager = JobManager()
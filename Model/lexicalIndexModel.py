@@ -0,0 +1,287 @@
+"""
+Per-site BM25 inverted index over chunks and products.
+
+Partitions are kept per (site_id, kind) like the local vector index and
+persisted under LEXICAL_INDEX_DIR. Product names and SKUs are also kept
+as exact-match keys, which the hybrid retrieval uses to answer
+name/SKU queries without the embedding model.
+
+Existing sites can be indexed from Mongo with:
+
+    python -m Model.lexicalIndexModel [--site-id ID]
+"""
+import argparse
+import asyncio
+import heapq
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter
+from typing import Dict, List, NamedTuple, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+LEXICAL_INDEX_DIR = os.getenv("LEXICAL_INDEX_DIR", "lexical_index")
+BM25_K1 = float(os.getenv("BM25_K1", "1.2"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+
+KINDS = ("blogSites", "WooCommerce")
+# Words, keeping compounds such as SKUs ("ab-123") and decimals together
+TOKEN = re.compile(r"\w+(?:[-./]\w+)*")
+COMPOUND_SEPARATOR = re.compile(r"[-./]")
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased tokens; compound tokens are indexed whole and by their parts."""
+    tokens = []
+    for token in TOKEN.findall(text.lower()):
+        tokens.append(token)
+        if COMPOUND_SEPARATOR.search(token):
+            tokens.extend(part for part in COMPOUND_SEPARATOR.split(token) if part)
+    return tokens
+
+
+def exact_key(text: str) -> str:
+    """Case and punctuation insensitive form of a product name or SKU."""
+    return " ".join(TOKEN.findall((text or "").lower()))
+
+
+def document_entry(doc: dict) -> dict:
+    """What the index keeps of a chunk or product document."""
+    if doc.get("for") == "WooCommerce":
+        name, sku = doc.get("name") or "", doc.get("sku") or ""
+        # The name is counted twice so name matches outrank description matches
+        text = " ".join([name, name, sku, doc.get("short_description") or "", doc.get("description") or ""])
+        keys = [key for key in {exact_key(name), exact_key(sku)} if key]
+    else:
+        text = doc.get("text") or ""
+        keys = []
+    terms = Counter(tokenize(text))
+    return {"terms": dict(terms), "length": sum(terms.values()), "keys": keys}
+
+
+class LexicalPartition:
+    """
+    BM25 postings of one (site_id, kind). Reads and writes are serialized by
+    a lock; changes stay in memory until save().
+
+    The file is replaced as a whole on save, so other worker processes see
+    a new file and reload the partition when they next use it.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.docs: Dict[str, dict] = {}
+        self.postings: Dict[str, Dict[str, int]] = {}
+        self.keys: Dict[str, set] = {}
+        self.total_length = 0
+        self.dirty = False
+        # Which saved file was loaded, see saved_version()
+        self.version = None
+        self.lock = threading.RLock()
+
+    @property
+    def file_path(self):
+        return os.path.join(self.path, "lexical.json")
+
+    def saved_version(self):
+        """Identifies the saved file, None if there is none."""
+        try:
+            stat = os.stat(self.file_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns
+
+    def stale(self) -> bool:
+        """Whether another process saved a newer file (and this one has nothing unsaved)."""
+        return not self.dirty and self.saved_version() != self.version
+
+    def load(self):
+        self.version = self.saved_version()
+        if self.version is not None:
+            with open(self.file_path) as f:
+                for doc_id, entry in json.load(f).items():
+                    self._add(doc_id, entry)
+        return self
+
+    def save(self):
+        os.makedirs(self.path, exist_ok=True)
+        tmp_path = self.file_path + ".tmp"
+        with self.lock:
+            with open(tmp_path, "w") as f:
+                json.dump(self.docs, f)
+            os.replace(tmp_path, self.file_path)
+            self.version = self.saved_version()
+            self.dirty = False
+
+    def _add(self, doc_id: str, entry: dict):
+        self._remove(doc_id)
+        self.docs[doc_id] = entry
+        self.total_length += entry["length"]
+        for term, count in entry["terms"].items():
+            self.postings.setdefault(term, {})[doc_id] = count
+        for key in entry["keys"]:
+            self.keys.setdefault(key, set()).add(doc_id)
+
+    def _remove(self, doc_id: str):
+        entry = self.docs.pop(doc_id, None)
+        if entry is None:
+            return
+        self.total_length -= entry["length"]
+        for term in entry["terms"]:
+            postings = self.postings[term]
+            postings.pop(doc_id, None)
+            if not postings:
+                del self.postings[term]
+        for key in entry["keys"]:
+            self.keys[key].discard(doc_id)
+            if not self.keys[key]:
+                del self.keys[key]
+
+    def upsert(self, ids: List[str], docs: List[dict]):
+        entries = [document_entry(doc) for doc in docs]
+        with self.lock:
+            for doc_id, entry in zip(ids, entries):
+                self._add(doc_id, entry)
+            self.dirty = True
+
+    def delete(self, ids: List[str]):
+        with self.lock:
+            for doc_id in ids:
+                self._remove(doc_id)
+            self.dirty = True
+
+    def exact(self, keys: List[str]) -> List[str]:
+        with self.lock:
+            matches = []
+            for key in keys:
+                matches.extend(doc_id for doc_id in self.keys.get(key, ()) if doc_id not in matches)
+            return matches
+
+    def search(self, terms: List[str], limit: int) -> List[Tuple[str, float]]:
+        with self.lock:
+            count = len(self.docs)
+            if not count:
+                return []
+            average_length = self.total_length / count
+            scores: Dict[str, float] = {}
+            for term in set(terms):
+                postings = self.postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for doc_id, frequency in postings.items():
+                    norm = 1 - BM25_B + BM25_B * self.docs[doc_id]["length"] / average_length
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * frequency * (BM25_K1 + 1) / (frequency + BM25_K1 * norm)
+            return heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+
+
+class LexicalResult(NamedTuple):
+    # Ids whose product name or SKU the query matches exactly
+    exact: List[str]
+    # (id, BM25 score) pairs, best first
+    hits: List[Tuple[str, float]]
+
+
+class LexicalIndex:
+    """Lexical partitions of every site, loaded on first use."""
+
+    def __init__(self, index_dir: str = LEXICAL_INDEX_DIR):
+        self.index_dir = index_dir
+        self._partitions: Dict[Tuple[str, str], LexicalPartition] = {}
+        self._lock = threading.Lock()
+
+    def _path(self, site_id: str, kind: str) -> str:
+        safe_site_id = re.sub(r"[^A-Za-z0-9_.-]", "_", site_id)
+        return os.path.join(self.index_dir, safe_site_id, kind)
+
+    def partition(self, site_id: str, kind: str) -> LexicalPartition:
+        key = (site_id, kind)
+        with self._lock:
+            partition = self._partitions.get(key)
+            if partition is None or partition.stale():
+                # First use, or another worker process saved it since
+                partition = LexicalPartition(self._path(site_id, kind)).load()
+                self._partitions[key] = partition
+            return partition
+
+    def has_partition(self, site_id: str, kind: str) -> bool:
+        """Whether the partition has been written at least once."""
+        return os.path.exists(LexicalPartition(self._path(site_id, kind)).file_path)
+
+    def new_partition(self, site_id: str, kind: str) -> LexicalPartition:
+        """Empty partition to fill during a full re-ingestion and swap in with commit()."""
+        return LexicalPartition(self._path(site_id, kind))
+
+    def _commit(self, site_id: str, kind: str, partition: LexicalPartition = None):
+        if partition is None:
+            partition = self.partition(site_id, kind)
+            if partition.dirty:
+                partition.save()
+            return
+        partition.save()
+        with self._lock:
+            self._partitions[(site_id, kind)] = partition
+
+    def _search(self, site_id: str, query: str, limit: int) -> LexicalResult:
+        terms = tokenize(query)
+        # The whole query, or any SKU-like token in it, may name a product exactly
+        keys = [exact_key(query)] + [term for term in terms if len(term) >= 3 and any(c.isdigit() for c in term)]
+        exact, hits = [], []
+        for kind in KINDS:
+            partition = self.partition(site_id, kind)
+            exact.extend(partition.exact(keys))
+            hits.extend(partition.search(terms, limit))
+        return LexicalResult(exact, sorted(hits, key=lambda hit: hit[1], reverse=True)[:limit])
+
+    async def commit(self, site_id: str, kind: str, partition: LexicalPartition = None):
+        """
+        Saves the changes made to a partition since the last commit, once
+        per sync, or swaps in partition, a new one filled during a full
+        re-ingestion.
+        """
+        await asyncio.to_thread(self._commit, site_id, kind, partition)
+
+    async def upsert(self, site_id: str, kind: str, ids: List[str], docs: List[dict]):
+        if len(ids):
+            await asyncio.to_thread(self.partition(site_id, kind).upsert, [str(i) for i in ids], docs)
+
+    async def delete(self, site_id: str, kind: str, ids: List[str]):
+        if len(ids):
+            await asyncio.to_thread(self.partition(site_id, kind).delete, [str(i) for i in ids])
+
+    async def search(self, site_id: str, query: str, limit: int = 10) -> LexicalResult:
+        return await asyncio.to_thread(self._search, site_id, query, limit)
+
+
+lexical_index = LexicalIndex()
+
+
+def main():
+    from Model.pluginModel import Model
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--site-id", help="only index this site")
+    args = parser.parse_args()
+
+    query = {"site_id": args.site_id} if args.site_id else {}
+    projection = {"site_id": 1, "for": 1, "text": 1, "name": 1, "sku": 1, "short_description": 1, "description": 1}
+    partitions = {}
+    for doc in Model().find(query, projection):
+        if doc.get("for") not in KINDS:
+            continue
+        key = (doc["site_id"], doc["for"])
+        if key not in partitions:
+            partitions[key] = lexical_index.new_partition(*key)
+        partitions[key].upsert([str(doc["_id"])], [doc])
+    for (site_id, kind), partition in partitions.items():
+        lexical_index._commit(site_id, kind, partition)
+        print(f"Indexed {len(partition.docs)} {kind} documents of site_id {site_id}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# Per-site labels multiply the number of series; turn off for very many sites
+METRICS_SITE_LABEL = os.getenv("METRICS_SITE_LABEL", "true").lower() == "true"
+
+# Buckets (seconds) shared by every latency histogram
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 1536, 2048, 3072, 4096, 8192)
+
+# Route label of the work running in the current request/job
+current_route: ContextVar[str] = ContextVar("current_route", default="none")
+
+
+def configure_logging(level: str = LOG_LEVEL):
+    """
+    key=value log lines on stderr. Payload dumps (prompts, vectors, LLM
+    responses) are logged at DEBUG, so they are off unless LOG_LEVEL=DEBUG.
+    """
+    logging.basicConfig(
+        level=level,
+        format="ts=%(asctime)s level=%(levelname)s logger=%(name)s msg=%(message)s",
+    )
+
+
+class Histogram:
+    """Prometheus-style cumulative histogram with labels."""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...], buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        self._series: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # bucket counts, then sum, then count
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = [(key, list(series)) for key, series in self._series.items()]
+        for key, series in sorted(items):
+            labels = ",".join(f'{name}="{escape(value)}"' for name, value in zip(self.labelnames, key))
+            prefix = labels + "," if labels else ""
+            for bound, count in zip(self.buckets, series):
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {count}')
+            lines.append(f'{self.name}_bucket{{{prefix}le="+Inf"}} {series[-1]}')
+            lines.append(f"{self.name}_sum{{{labels}}} {series[-2]}")
+            lines.append(f"{self.name}_count{{{labels}}} {series[-1]}")
+        return lines
+
+
+class Counter:
+    """Prometheus-style counter with labels."""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...]):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            labels = ",".join(f'{name}="{escape(v)}"' for name, v in zip(self.labelnames, key))
+            lines.append(f"{self.name}{{{labels}}} {value}")
+        return lines
+
+
+def escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+STAGE_SECONDS = Histogram(
+    "synapse_stage_duration_seconds",
+    "Duration of a pipeline stage (embed, vector_search, neighbor_fetch, prompt_build, llm_call, html_conversion).",
+    ("stage", "route", "site_id"),
+)
+PROMPT_TOKENS = Histogram(
+    "synapse_prompt_tokens",
+    "Tokens of the packed parts of LLM prompts (context, history, query), by bot.",
+    ("bot", "part", "route", "site_id"),
+    buckets=TOKEN_BUCKETS,
+)
+REQUEST_SECONDS = Histogram(
+    "synapse_http_request_duration_seconds",
+    "HTTP request duration by route and status code.",
+    ("method", "route", "status"),
+)
+REQUESTS_TOTAL = Counter(
+    "synapse_http_requests_total",
+    "HTTP requests by route and status code.",
+    ("method", "route", "status"),
+)
+
+registry = [STAGE_SECONDS, PROMPT_TOKENS, REQUEST_SECONDS, REQUESTS_TOTAL]
+
+
+def site_label(site_id) -> str:
+    return str(site_id) if METRICS_SITE_LABEL and site_id else ""
+
+
+def observe_stage(stage: str, seconds: float, site_id: str = None):
+    STAGE_SECONDS.observe(seconds, stage=stage, route=current_route.get(), site_id=site_label(site_id))
+
+
+@contextmanager
+def timed(stage: str, site_id: str = None):
+    """Records the duration of the enclosed block as one pipeline stage."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - start, site_id)
+
+
+async def timed_stream(stream, stage: str, site_id: str = None):
+    """
+    Yields the items of an async iterator and records the time spent
+    waiting on it as one stage. The time the consumer takes with each item
+    (e.g. sending it to a slow client) is not counted.
+    """
+    iterator = stream.__aiter__()
+    seconds = 0.0
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                item = await iterator.__anext__()
+            except StopAsyncIteration:
+                break
+            finally:
+                seconds += time.perf_counter() - start
+            yield item
+    finally:
+        observe_stage(stage, seconds, site_id)
+        if hasattr(iterator, "aclose"):
+            await iterator.aclose()
+
+
+def observe_prompt_tokens(bot: str, site_id: str = None, **parts):
+    """Records the token count of each packed prompt part, e.g. context=812, history=95."""
+    for part, tokens in parts.items():
+        PROMPT_TOKENS.observe(tokens, bot=bot, part=part, route=current_route.get(), site_id=site_label(site_id))
+
+
+def render_metrics() -> str:
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
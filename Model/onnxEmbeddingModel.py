@@ -0,0 +1,216 @@
+"""
+ONNX Runtime backend for the sentence embedding model.
+
+The transformer of a SentenceTransformer is exported to ONNX once (this
+needs torch), together with its tokenizer and pooling settings. After
+that, inference only needs onnxruntime and tokenizers. The export can
+optionally be quantized to int8 with dynamic quantization.
+
+    python -m Model.onnxEmbeddingModel --quantize
+"""
+import argparse
+import json
+import logging
+import os
+from typing import List
+
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Exported encoders live here, one subdirectory per model name
+EMBEDDING_ONNX_DIR = os.getenv("EMBEDDING_ONNX_DIR", "onnx_models")
+# Run the dynamically int8-quantized copy of the exported model
+EMBEDDING_ONNX_QUANTIZE = os.getenv("EMBEDDING_ONNX_QUANTIZE", "false").lower() == "true"
+# ONNX Runtime intra-op threads per forward pass, 0 lets ONNX Runtime pick (one per core)
+EMBEDDING_INTRA_OP_THREADS = int(os.getenv("EMBEDDING_INTRA_OP_THREADS", "0"))
+
+MODEL_FILE = "model.onnx"
+QUANTIZED_MODEL_FILE = "model_int8.onnx"
+TOKENIZER_FILE = "tokenizer.json"
+CONFIG_FILE = "encoder_config.json"
+POOLING_MODES = ("mean", "cls", "max")
+
+
+def model_dir(model_name: str, base_dir: str = EMBEDDING_ONNX_DIR) -> str:
+    return os.path.join(base_dir, model_name.replace("/", "__"))
+
+
+def export_onnx(model_name: str, output_dir: str, opset: int = 14):
+    """
+    Exports model_name (a SentenceTransformer made of a transformer, a
+    pooling layer and an optional normalization) to output_dir.
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer, models
+
+    st = SentenceTransformer(model_name, device="cpu")
+    pooling = None
+    normalize = False
+    for module in list(st)[1:]:
+        if isinstance(module, models.Pooling):
+            pooling = module.get_pooling_mode_str()
+        elif isinstance(module, models.Normalize):
+            normalize = True
+        else:
+            raise ValueError(f"{model_name}: {type(module).__name__} layers are not supported by the ONNX backend")
+    if pooling not in POOLING_MODES:
+        raise ValueError(f"{model_name}: pooling mode {pooling!r} is not supported by the ONNX backend")
+
+    transformer = st[0]
+    tokenizer = transformer.tokenizer
+    sample = tokenizer(["export sample"], return_tensors="pt")
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample]
+
+    class TokenEmbeddings(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, *inputs):
+            return self.model(**dict(zip(input_names, inputs)), return_dict=False)[0]
+
+    os.makedirs(output_dir, exist_ok=True)
+    axes = {0: "batch", 1: "sequence"}
+    tmp_path = os.path.join(output_dir, MODEL_FILE + ".tmp")
+    logger.info("Exporting %s to ONNX in %s", model_name, output_dir)
+    with torch.no_grad():
+        torch.onnx.export(
+            TokenEmbeddings(transformer.auto_model.eval()),
+            tuple(sample[name] for name in input_names),
+            tmp_path,
+            input_names=input_names,
+            output_names=["token_embeddings"],
+            dynamic_axes={name: axes for name in [*input_names, "token_embeddings"]},
+            opset_version=opset,
+            do_constant_folding=True,
+        )
+    os.replace(tmp_path, os.path.join(output_dir, MODEL_FILE))
+    tokenizer.backend_tokenizer.save(os.path.join(output_dir, TOKENIZER_FILE))
+
+    config = {
+        "model_name": model_name,
+        "max_seq_length": st.max_seq_length,
+        "dimension": st.get_sentence_embedding_dimension(),
+        "pooling": pooling,
+        "normalize": normalize,
+        "inputs": input_names,
+        "pad_token": tokenizer.pad_token,
+        "pad_token_id": tokenizer.pad_token_id,
+    }
+    # Written last: its presence marks a complete export
+    with open(os.path.join(output_dir, CONFIG_FILE), "w") as f:
+        json.dump(config, f, indent=2)
+
+
+def quantize_onnx(output_dir: str):
+    """Writes a dynamically int8-quantized copy of the exported model (weights int8, activations quantized at run time)."""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    tmp_path = os.path.join(output_dir, QUANTIZED_MODEL_FILE + ".tmp")
+    logger.info("Quantizing %s to int8", output_dir)
+    quantize_dynamic(os.path.join(output_dir, MODEL_FILE), tmp_path, weight_type=QuantType.QInt8)
+    os.replace(tmp_path, os.path.join(output_dir, QUANTIZED_MODEL_FILE))
+
+
+def ensure_onnx_model(model_name: str, quantize: bool = EMBEDDING_ONNX_QUANTIZE,
+                      base_dir: str = EMBEDDING_ONNX_DIR) -> str:
+    """Returns the export directory of model_name, exporting/quantizing it first if needed."""
+    path = model_dir(model_name, base_dir)
+    if not os.path.exists(os.path.join(path, CONFIG_FILE)):
+        export_onnx(model_name, path)
+    if quantize and not os.path.exists(os.path.join(path, QUANTIZED_MODEL_FILE)):
+        quantize_onnx(path)
+    return path
+
+
+class OnnxEncoder:
+    """
+    Drop-in replacement for SentenceTransformer.encode running an exported
+    model on ONNX Runtime. Sessions are thread-safe, so the encoder can be
+    shared by every embedding worker.
+    """
+
+    def __init__(self, path: str, quantized: bool = EMBEDDING_ONNX_QUANTIZE,
+                 intra_op_threads: int = EMBEDDING_INTRA_OP_THREADS):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        with open(os.path.join(path, CONFIG_FILE)) as f:
+            self.config = json.load(f)
+        self.max_seq_length = self.config["max_seq_length"]
+        self.dimension = self.config["dimension"]
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.inter_op_num_threads = 1
+        if intra_op_threads:
+            options.intra_op_num_threads = intra_op_threads
+        model_file = QUANTIZED_MODEL_FILE if quantized else MODEL_FILE
+        self.session = ort.InferenceSession(os.path.join(path, model_file), options,
+                                            providers=["CPUExecutionProvider"])
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(path, TOKENIZER_FILE))
+        self.tokenizer.enable_truncation(self.max_seq_length)
+        self.tokenizer.enable_padding(pad_id=self.config["pad_token_id"], pad_token=self.config["pad_token"])
+
+    def encode(self, texts: List[str], batch_size: int = 32, **kwargs):
+        """Returns a (len(texts), dim) float32 array, like SentenceTransformer.encode."""
+        vectors = np.empty((len(texts), self.dimension), dtype=np.float32)
+        # Batch texts of similar length together to keep padding low
+        order = np.argsort([-len(text) for text in texts], kind="stable")
+        for start in range(0, len(texts), batch_size):
+            index = order[start:start + batch_size]
+            vectors[index] = self._encode_batch([str(texts[i]).strip() for i in index])
+        return vectors
+
+    def _encode_batch(self, texts: List[str]):
+        encodings = self.tokenizer.encode_batch(texts)
+        mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+        inputs = {
+            "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+            "attention_mask": mask,
+            "token_type_ids": np.array([e.type_ids for e in encodings], dtype=np.int64),
+        }
+        tokens = self.session.run(None, {name: inputs[name] for name in self.config["inputs"]})[0]
+
+        pooling = self.config["pooling"]
+        if pooling == "cls":
+            vectors = tokens[:, 0]
+        elif pooling == "max":
+            vectors = np.where(mask[..., None] > 0, tokens, -1e9).max(axis=1)
+        else:
+            weights = mask[..., None].astype(np.float32)
+            vectors = (tokens * weights).sum(axis=1) / np.maximum(weights.sum(axis=1), 1e-9)
+
+        if self.config["normalize"]:
+            vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        return vectors.astype(np.float32, copy=False)
+
+
+def main():
+    from Model.embeddingModel import EMBEDDING_MODEL_NAME
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default=EMBEDDING_MODEL_NAME)
+    parser.add_argument("--output-dir", default=EMBEDDING_ONNX_DIR)
+    parser.add_argument("--quantize", action="store_true", help="also write the int8 model")
+    parser.add_argument("--force", action="store_true", help="re-export even if an export exists")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    path = model_dir(args.model, args.output_dir)
+    if args.force:
+        export_onnx(args.model, path)
+        if args.quantize:
+            quantize_onnx(path)
+    else:
+        ensure_onnx_model(args.model, args.quantize, args.output_dir)
+    print(f"ONNX encoder ready in {path}")
+
+
+if __name__ == "__main__":
+    main()
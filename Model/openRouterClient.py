@@ -0,0 +1,150 @@
+import asyncio
+import json
+import logging
+import os
+import random
+
+import httpx
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
+API_URL = os.getenv("OPENROUTER_URL", "https://openrouter.ai/api/v1/chat/completions")
+
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+LLM_READ_TIMEOUT = float(os.getenv("LLM_READ_TIMEOUT", "60"))
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "50"))
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "20"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "8"))
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+headers = {
+    "Authorization": f"Bearer {OPENROUTER_API_KEY}",
+    "Content-Type": "application/json"
+}
+
+
+class OpenRouterClient:
+    """
+    Shared async HTTP client for the OpenRouter chat completions API.
+
+    One httpx.AsyncClient is reused for the whole process so connections are
+    kept alive between calls. Requests that fail with 429/5xx or a transport
+    error are retried a bounded number of times with jittered backoff.
+    """
+
+    def __init__(self, url: str = API_URL, max_retries: int = LLM_MAX_RETRIES):
+        self.url = url
+        self.max_retries = max_retries
+        self._client = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                headers=headers,
+                timeout=httpx.Timeout(LLM_READ_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+                limits=httpx.Limits(
+                    max_connections=LLM_MAX_CONNECTIONS,
+                    max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS
+                )
+            )
+        return self._client
+
+    def backoff_delay(self, attempt: int, response: httpx.Response = None) -> float:
+        """Full-jitter exponential backoff, honouring a numeric Retry-After header."""
+        delay = random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * (2 ** attempt)))
+        if response is not None:
+            retry_after = response.headers.get("Retry-After", "")
+            if retry_after.isdigit():
+                delay = max(delay, min(float(retry_after), LLM_BACKOFF_MAX))
+        return delay
+
+    async def chat_completion(self, data: dict) -> httpx.Response:
+        """
+        Posts a chat completion request, retrying on 429/5xx and transport errors.
+
+        Args:
+            data (dict): The JSON body for the chat completions endpoint.
+
+        Returns:
+            httpx.Response: The last response received. Transport errors are
+            re-raised once the retries are used up.
+        """
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = await self.client.post(self.url, json=data)
+            except httpx.TransportError as e:
+                if attempt == self.max_retries:
+                    raise
+                logger.warning("OpenRouter request failed (%r), retrying", e)
+                await asyncio.sleep(self.backoff_delay(attempt))
+                continue
+
+            if response.status_code not in RETRY_STATUS_CODES or attempt == self.max_retries:
+                return response
+            logger.warning("OpenRouter returned %d, retrying", response.status_code)
+            await asyncio.sleep(self.backoff_delay(attempt, response))
+
+    async def stream_chat_completion(self, data: dict):
+        """
+        Posts a streaming chat completion request and yields the content
+        deltas as they arrive.
+
+        Retries (429/5xx and transport errors) only happen before the first
+        token, so a client never sees duplicated output.
+
+        Args:
+            data (dict): The JSON body for the chat completions endpoint.
+
+        Yields:
+            str: The next piece of generated text.
+        """
+        body = {**data, "stream": True}
+        started = False
+        for attempt in range(self.max_retries + 1):
+            try:
+                async with self.client.stream("POST", self.url, json=body) as response:
+                    if response.status_code in RETRY_STATUS_CODES and attempt < self.max_retries:
+                        logger.warning("OpenRouter returned %d, retrying", response.status_code)
+                        delay = self.backoff_delay(attempt, response)
+                    else:
+                        if response.status_code != 200:
+                            await response.aread()
+                            response.raise_for_status()
+                        async for line in response.aiter_lines():
+                            # Blank lines separate events and ':' lines are keep-alive comments
+                            if not line.startswith("data:"):
+                                continue
+                            payload = line[len("data:"):].strip()
+                            if payload == "[DONE]":
+                                return
+                            chunk = json.loads(payload)
+                            if "error" in chunk:
+                                raise RuntimeError(f"OpenRouter stream error: {chunk['error']}")
+                            choices = chunk.get("choices") or [{}]
+                            content = (choices[0].get("delta") or {}).get("content")
+                            if content:
+                                started = True
+                                yield content
+                        return
+            except httpx.TransportError as e:
+                if started or attempt == self.max_retries:
+                    raise
+                logger.warning("OpenRouter request failed (%r), retrying", e)
+                delay = self.backoff_delay(attempt)
+            await asyncio.sleep(delay)
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+openrouter_client = OpenRouterClient()
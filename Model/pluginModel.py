@@ -1,15 +1,169 @@
 from pymongo import MongoClient
-import os 
+from motor.motor_asyncio import AsyncIOMotorClient
+import logging
+import os
 from dotenv import load_dotenv
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+MONGO_URL = os.getenv('Users_MONGO_URL')
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "300000"))
+# Chat sessions not used for this long are deleted by Mongo
+CHAT_SESSION_TTL_SECONDS = int(os.getenv("CHAT_SESSION_TTL_SECONDS", str(7 * 24 * 3600)))
+
+# One client per URL for the whole process; MongoClient is thread-safe and pools connections
+_clients = {}
+_async_clients = {}
+
+
+def client_options():
+    return {
+        "maxPoolSize": MONGO_MAX_POOL_SIZE,
+        "minPoolSize": MONGO_MIN_POOL_SIZE,
+        "maxIdleTimeMS": MONGO_MAX_IDLE_TIME_MS,
+    }
+
+
+def get_client(url: str = MONGO_URL) -> MongoClient:
+    """Returns the shared blocking client for url, creating it on first use."""
+    if url not in _clients:
+        _clients[url] = MongoClient(url, **client_options())
+    return _clients[url]
+
+
+def get_async_client(url: str = MONGO_URL) -> AsyncIOMotorClient:
+    """Returns the shared motor client for url; must be called inside the event loop."""
+    if url not in _async_clients:
+        _async_clients[url] = AsyncIOMotorClient(url, **client_options())
+    return _async_clients[url]
+
+
 def Model():
     try:
-        client=MongoClient(os.getenv('Users_MONGO_URL'))
+        client=get_client()
+        db=client.docEmbeddings
+        collection=db.chunks
+        return collection
+    except Exception as e:
+        logger.error("error connecting to chunks db: %s", e)
+        return None
+
+
+def AsyncModel():
+    """motor version of Model(), used by the chat and ingest paths."""
+    try:
+        client=get_async_client()
         db=client.docEmbeddings
         collection=db.chunks
         return collection
     except Exception as e:
-        print(f"error connecting to chunks db:{e}")
+        logger.error("error connecting to chunks db: %s", e)
         return None
+
+
+def SessionModel():
+    """motor collection of the server-side chat sessions."""
+    try:
+        client=get_async_client()
+        db=client.docEmbeddings
+        collection=db.chat_sessions
+        return collection
+    except Exception as e:
+        logger.error("error connecting to chat sessions db: %s", e)
+        return None
+
+
+def GenerationModel():
+    """motor collection of the published index generation of every site."""
+    try:
+        client=get_async_client()
+        db=client.docEmbeddings
+        collection=db.index_generations
+        return collection
+    except Exception as e:
+        logger.error("error connecting to index generations db: %s", e)
+        return None
+
+
+def SiteVersionModel():
+    """motor collection of the per-site content versions the answer caches follow."""
+    try:
+        client=get_async_client()
+        db=client.docEmbeddings
+        collection=db.site_versions
+        return collection
+    except Exception as e:
+        logger.error("error connecting to site versions db: %s", e)
+        return None
+
+
+def JobModel():
+    """motor collection of the ingestion job statuses, shared by every worker."""
+    try:
+        client=get_async_client()
+        db=client.docEmbeddings
+        collection=db.ingest_jobs
+        return collection
+    except Exception as e:
+        logger.error("error connecting to ingest jobs db: %s", e)
+        return None
+
+
+def JobLockModel():
+    """motor collection of the per-site ingestion leases, see Model.jobModel."""
+    try:
+        client=get_async_client()
+        db=client.docEmbeddings
+        collection=db.ingest_locks
+        return collection
+    except Exception as e:
+        logger.error("error connecting to ingest locks db: %s", e)
+        return None
+
+
+def connect():
+    """Creates the application-scoped clients; called from the app lifespan."""
+    get_client()
+    get_async_client()
+
+
+def close():
+    """Closes every shared client; called when the app shuts down."""
+    for clients in (_clients, _async_clients):
+        for client in clients.values():
+            client.close()
+        clients.clear()
+
+
+async def ensure_indexes():
+    """Creates the indexes the chat and ingest paths rely on, if missing."""
+    collection = AsyncModel()
+    if collection is None:
+        return
+    try:
+        # Neighbor chunk lookups: {site_id, for, generation, source, chunk_number: {$in: [...]}}
+        await collection.create_index(
+            [("site_id", 1), ("for", 1), ("generation", 1), ("source", 1), ("chunk_number", 1)],
+            name="site_for_generation_source_chunk_number"
+        )
+    except Exception as e:
+        logger.error("error creating indexes on chunks db: %s", e)
+
+    sessions = SessionModel()
+    if sessions is None:
+        return
+    try:
+        await sessions.create_index("updated_at", name="updated_at_ttl", expireAfterSeconds=CHAT_SESSION_TTL_SECONDS)
+    except Exception as e:
+        logger.error("error creating indexes on chat sessions db: %s", e)
+
+    try:
+        # Job statuses and leases carry their own expiry date
+        await JobModel().create_index("expires_at", name="expires_at_ttl", expireAfterSeconds=0)
+        await JobLockModel().create_index("expires_at", name="expires_at_ttl", expireAfterSeconds=0)
+    except Exception as e:
+        logger.error("error creating indexes on ingest jobs db: %s", e)
@@ -0,0 +1,534 @@
+"""
+Vector retrieval backends: MongoDB Atlas $vectorSearch, or in-process
+partitions kept per (site_id, kind) under VECTOR_INDEX_DIR.
+
+Local partitions missing on a host are backfilled from the vectors stored
+in Mongo on first use. They can also be rebuilt from Mongo with:
+
+    python -m Model.retrieverModel [--site-id ID] [--kind KIND] [--backend numpy|hnsw]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from bson import ObjectId
+from dotenv import load_dotenv
+
+from Model.pluginModel import Model, AsyncModel
+from Model.generationModel import LEGACY_GENERATION, index_generations
+from Model.vectorCodec import decode_vector, query_vector
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# "atlas" uses MongoDB Atlas $vectorSearch, "numpy" an exact in-process search,
+# "hnsw" an in-process HNSW index (falls back to numpy for small partitions)
+RETRIEVER_BACKEND = os.getenv("RETRIEVER_BACKEND", "atlas").lower()
+VECTOR_INDEX_DIR = os.getenv("VECTOR_INDEX_DIR", "vector_index")
+# Partitions smaller than this are searched exactly even with the hnsw backend
+HNSW_MIN_SIZE = int(os.getenv("HNSW_MIN_SIZE", "1000"))
+HNSW_M = int(os.getenv("HNSW_M", "16"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", "200"))
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", "64"))
+# How long a re-ingestion waits for Atlas to index a new generation before publishing it
+ATLAS_INDEX_WAIT_SECONDS = float(os.getenv("ATLAS_INDEX_WAIT_SECONDS", "60"))
+
+KINDS = ("blogSites", "WooCommerce")
+
+
+class Retriever:
+    """
+    Interface of a vector retrieval backend.
+
+    search() returns the matching documents of a site, best match first,
+    each with an "id" (str of the Mongo _id) and a "score". The write hooks
+    are called by the ingestion paths after Mongo has been updated, so
+    backends that keep their own index can stay in sync.
+    """
+
+    # Whether the backend keeps its own copy of the vectors, i.e. needs the write hooks
+    stores_vectors = False
+
+    async def search(self, site_id: str, vector, limit: int = 5) -> List[dict]:
+        raise NotImplementedError
+
+    async def replace(self, site_id: str, kind: str, ids: List[str], vectors):
+        """Replaces every vector of a site's kind ("blogSites"/"WooCommerce")."""
+
+    async def upsert(self, site_id: str, kind: str, ids: List[str], vectors):
+        """Adds or overwrites the given vectors."""
+
+    async def delete(self, site_id: str, kind: str, ids: List[str]):
+        """Removes the given ids."""
+
+    async def commit(self, site_id: str, kind: str):
+        """Persists the upserts and deletes made since the last commit; called once per sync."""
+
+    async def wait_until_searchable(self, site_id: str, kind: str, generation: int, vector, count: int):
+        """Returns once the count documents of an unpublished generation can be found by search()."""
+
+
+class AtlasRetriever(Retriever):
+    """
+    MongoDB Atlas $vectorSearch on the "vector_index" search index.
+
+    blogSites chunks are filtered on the site's published generation
+    (LEGACY_GENERATION until it publishes one), so the index definition
+    must have "site_id", "for" and "generation" as filter fields.
+    """
+
+    def __init__(self, index_name: str = "vector_index", num_candidates: int = 100):
+        self.index_name = index_name
+        self.num_candidates = num_candidates
+
+    def _pipeline(self, vector, limit: int, match: dict) -> list:
+        return [
+            {
+                "$vectorSearch": {
+                    "index": self.index_name,
+                    "path": "embeddings",
+                    "queryVector": query_vector(vector),
+                    "numCandidates": self.num_candidates,
+                    "limit": limit,
+                    "filter": match
+                }
+            },
+            {"$addFields": {"score": {"$meta": "vectorSearchScore"}}},
+            # Callers never read the stored vectors, so they are not sent back
+            {"$project": {"embeddings": 0}}
+        ]
+
+    async def search(self, site_id: str, vector, limit: int = 5) -> List[dict]:
+        generation = await index_generations.current(site_id, "blogSites")
+        if generation is None:
+            generation = LEGACY_GENERATION
+        match = {
+            "site_id": {"$eq": site_id},
+            "$or": [{"for": {"$eq": "WooCommerce"}}, {"generation": {"$eq": generation}}],
+        }
+        client = AsyncModel()
+        return await client.aggregate(self._pipeline(vector, limit, match)).to_list(None)
+
+    async def wait_until_searchable(self, site_id: str, kind: str, generation: int, vector, count: int):
+        # Atlas indexes new documents asynchronously; publishing before all
+        # of them are indexed would serve the site a partial result set.
+        # An exact search visits every indexed document matching the filter
+        pipeline = [
+            {
+                "$vectorSearch": {
+                    "index": self.index_name,
+                    "path": "embeddings",
+                    "queryVector": query_vector(vector),
+                    "exact": True,
+                    "limit": count,
+                    "filter": {"site_id": {"$eq": site_id}, "for": {"$eq": kind}, "generation": {"$eq": generation}}
+                }
+            },
+            {"$count": "indexed"}
+        ]
+        deadline = time.monotonic() + ATLAS_INDEX_WAIT_SECONDS
+        indexed = 0
+        while time.monotonic() < deadline:
+            result = await AsyncModel().aggregate(pipeline).to_list(None)
+            indexed = result[0]["indexed"] if result else 0
+            if indexed >= count:
+                return
+            await asyncio.sleep(1)
+        logger.warning("Only %d of %d documents of generation %d of %s for site_id %s searchable after %ss, publishing anyway",
+                       indexed, count, generation, kind, site_id, ATLAS_INDEX_WAIT_SECONDS)
+
+
+class VectorPartition:
+    """
+    Vectors of one (site_id, kind), stored as a normalized float32 .npy
+    matrix plus the list of document ids of its rows.
+
+    Rows are only ever appended: an upsert of a known id retires its old
+    row and appends a new one, a delete retires the row (its id becomes
+    None). Retired rows are dropped when they outnumber the live ones. With
+    use_hnsw an HNSW graph labelled by row number is kept over the live
+    rows and updated in place with add_items/mark_deleted.
+
+    Changes stay in memory until save(), which the ingestion paths reach
+    once per sync through Retriever.commit(). Each save is a new version
+    directory, and processes that did not write it reload the partition
+    when they next use it. The saved matrix is opened with mmap so loading
+    a partition is cheap and pages are shared between worker processes;
+    it is copied into a growable buffer on first write. Searches and
+    writes are serialized by the partition's lock.
+    """
+
+    def __init__(self, path: str, use_hnsw: bool = False):
+        self.path = path
+        self.use_hnsw = use_hnsw
+        self.ids: List[Optional[str]] = []
+        self.rows: Dict[str, int] = {}
+        self.vectors = np.zeros((0, 0), dtype=np.float32)
+        self.hnsw = None
+        self.dirty = False
+        # Which saved version was loaded, see saved_version()
+        self.version = None
+        self.lock = threading.RLock()
+
+    @property
+    def pointer_path(self):
+        """File naming the directory of the current version."""
+        return os.path.join(self.path, "current")
+
+    @property
+    def size(self) -> int:
+        """Number of live rows."""
+        return len(self.rows)
+
+    def saved_version(self):
+        """
+        Identifies the version on disk, None if there is none. Every save
+        replaces the pointer file, so this changes whichever process saved.
+        Partitions saved before versions existed have their files directly
+        in path.
+        """
+        for file_path in (self.pointer_path, os.path.join(self.path, "ids.json")):
+            try:
+                stat = os.stat(file_path)
+            except FileNotFoundError:
+                continue
+            return file_path, stat.st_ino, stat.st_mtime_ns
+        return None
+
+    def stale(self) -> bool:
+        """Whether another process saved a newer version (and this one has nothing unsaved)."""
+        return not self.dirty and self.saved_version() != self.version
+
+    def load(self):
+        # Another process may save (and collect the version before last) meanwhile
+        for attempt in range(3):
+            try:
+                return self._load()
+            except FileNotFoundError:
+                if attempt == 2:
+                    raise
+
+    def _load(self):
+        self.version = self.saved_version()
+        if self.version is None:
+            return self
+        directory = self.path
+        if self.version[0] == self.pointer_path:
+            with open(self.pointer_path) as f:
+                directory = os.path.join(self.path, f.read().strip())
+        with open(os.path.join(directory, "ids.json")) as f:
+            self.ids = json.load(f)
+        self.rows = {doc_id: row for row, doc_id in enumerate(self.ids) if doc_id is not None}
+        self.vectors = np.load(os.path.join(directory, "vectors.npy"), mmap_mode="r")
+        hnsw_path = os.path.join(directory, "hnsw.bin")
+        if self.use_hnsw and os.path.exists(hnsw_path):
+            import hnswlib
+            self.hnsw = hnswlib.Index(space="ip", dim=self.vectors.shape[1])
+            self.hnsw.load_index(hnsw_path, max_elements=max(len(self.ids), 1))
+            self.hnsw.set_ef(HNSW_EF_SEARCH)
+        return self
+
+    def save(self):
+        """
+        Writes a new version directory and points the pointer file at it,
+        so readers in other processes never see a partial version. The
+        previous version is kept for readers still loading it.
+        """
+        with self.lock:
+            if len(self.ids) - self.size > self.size:
+                self._compact()
+            if self.use_hnsw and self.hnsw is None and self.size >= HNSW_MIN_SIZE:
+                self._build_hnsw()
+            name = f"v{time.time_ns()}"
+            directory = os.path.join(self.path, name)
+            os.makedirs(directory)
+            np.save(os.path.join(directory, "vectors.npy"), np.ascontiguousarray(self.vectors[:len(self.ids)], dtype=np.float32))
+            with open(os.path.join(directory, "ids.json"), "w") as f:
+                json.dump(self.ids, f)
+            if self.hnsw is not None:
+                self.hnsw.save_index(os.path.join(directory, "hnsw.bin"))
+            with open(self.pointer_path + ".tmp", "w") as f:
+                f.write(name)
+            os.replace(self.pointer_path + ".tmp", self.pointer_path)
+            self.version = self.saved_version()
+            self.dirty = False
+
+            versions = sorted(entry for entry in os.listdir(self.path) if entry.startswith("v") and entry != name)
+            for old in versions[:-1]:
+                shutil.rmtree(os.path.join(self.path, old), ignore_errors=True)
+            for legacy in ("vectors.npy", "ids.json", "hnsw.bin"):
+                if os.path.exists(os.path.join(self.path, legacy)):
+                    os.remove(os.path.join(self.path, legacy))
+
+    def _reserve(self, rows: int, dim: int):
+        """Makes the matrix writable with room for rows more rows, doubling its capacity."""
+        needed = len(self.ids) + rows
+        if isinstance(self.vectors, np.memmap) or self.vectors.shape[0] < needed or self.vectors.shape[1] != dim:
+            capacity = max(needed, 2 * self.vectors.shape[0], 1024)
+            matrix = np.zeros((capacity, dim), dtype=np.float32)
+            if self.ids:
+                matrix[:len(self.ids)] = self.vectors[:len(self.ids)]
+            self.vectors = matrix
+        if self.hnsw is not None and self.hnsw.get_max_elements() < needed:
+            self.hnsw.resize_index(max(needed, 2 * self.hnsw.get_max_elements()))
+
+    def _build_hnsw(self):
+        import hnswlib
+        rows = np.fromiter(self.rows.values(), dtype=np.int64, count=self.size)
+        index = hnswlib.Index(space="ip", dim=self.vectors.shape[1])
+        index.init_index(max_elements=max(self.vectors.shape[0], 1), ef_construction=HNSW_EF_CONSTRUCTION, M=HNSW_M)
+        index.add_items(self.vectors[rows], rows)
+        index.set_ef(HNSW_EF_SEARCH)
+        self.hnsw = index
+
+    def _compact(self):
+        """Drops the retired rows; row numbers change, so the HNSW graph is rebuilt."""
+        rows = sorted(self.rows.values())
+        self.ids = [self.ids[row] for row in rows]
+        self.rows = {doc_id: row for row, doc_id in enumerate(self.ids)}
+        self.vectors = np.array(self.vectors[rows], dtype=np.float32) if rows else np.zeros((0, 0), dtype=np.float32)
+        self.hnsw = None
+
+    def _retire(self, doc_id: str):
+        row = self.rows.pop(doc_id, None)
+        if row is None:
+            return
+        self.ids[row] = None
+        if self.hnsw is not None:
+            self.hnsw.mark_deleted(row)
+
+    def replace(self, ids: List[str], vectors):
+        with self.lock:
+            self.ids, self.rows, self.hnsw = [], {}, None
+            self.vectors = np.zeros((0, 0), dtype=np.float32)
+            self.dirty = True
+            if len(ids):
+                self.upsert(ids, vectors)
+
+    def upsert(self, ids: List[str], vectors):
+        vectors = normalize(vectors)
+        if len(set(ids)) < len(ids):
+            # A repeated id keeps its last vector
+            last = sorted({doc_id: i for i, doc_id in enumerate(ids)}.values())
+            ids, vectors = [ids[i] for i in last], vectors[last]
+        with self.lock:
+            for doc_id in ids:
+                self._retire(doc_id)
+            first = len(self.ids)
+            self._reserve(len(ids), vectors.shape[1])
+            self.vectors[first:first + len(ids)] = vectors
+            for row, doc_id in enumerate(ids, first):
+                self.ids.append(doc_id)
+                self.rows[doc_id] = row
+            if self.hnsw is not None:
+                self.hnsw.add_items(vectors, np.arange(first, first + len(ids)))
+            self.dirty = True
+
+    def delete(self, ids: List[str]):
+        with self.lock:
+            for doc_id in ids:
+                self._retire(doc_id)
+            self.dirty = True
+
+    def search(self, query, limit: int) -> List[Tuple[str, float]]:
+        with self.lock:
+            limit = min(limit, self.size)
+            if not limit:
+                return []
+            if self.hnsw is not None:
+                labels, distances = self.hnsw.knn_query(query, k=limit)
+                return [(self.ids[label], 1.0 - float(distance)) for label, distance in zip(labels[0], distances[0])]
+
+            scores = self.vectors[:len(self.ids)] @ query
+            if self.size < len(self.ids):
+                scores[[row for row, doc_id in enumerate(self.ids) if doc_id is None]] = -np.inf
+            top = np.argpartition(-scores, limit - 1)[:limit]
+            top = top[np.argsort(-scores[top])]
+            return [(self.ids[i], float(scores[i])) for i in top]
+
+
+def normalize(vectors):
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+async def load_stored_vectors(site_id: str, kind: str) -> Tuple[List[str], np.ndarray]:
+    """
+    Ids and vectors of a site's kind as stored in Mongo; blogSites chunks
+    are limited to the published generation, like AtlasRetriever.search.
+    """
+    query = {"site_id": site_id, "for": kind, "embeddings": {"$exists": True}}
+    if kind == "blogSites":
+        generation = await index_generations.current(site_id, kind)
+        query["generation"] = generation if generation is not None else {"$in": [LEGACY_GENERATION, None]}
+    ids, vectors = [], []
+    async for doc in AsyncModel().find(query, {"embeddings": 1}):
+        ids.append(str(doc["_id"]))
+        vectors.append(decode_vector(doc["embeddings"]))
+    return ids, np.vstack(vectors) if vectors else np.zeros((0, 0), dtype=np.float32)
+
+
+class LocalRetriever(Retriever):
+    """
+    In-process vector search, partitioned per site_id and kind and persisted
+    under VECTOR_INDEX_DIR. Matches are hydrated from Mongo with a single
+    $in query.
+
+    VECTOR_INDEX_DIR is local to each host, so a partition found neither in
+    memory nor on disk is backfilled from Mongo before it is searched or
+    written to.
+    """
+
+    stores_vectors = True
+
+    def __init__(self, index_dir: str = VECTOR_INDEX_DIR, use_hnsw: bool = False):
+        self.index_dir = index_dir
+        self.use_hnsw = use_hnsw
+        self._partitions: Dict[Tuple[str, str], VectorPartition] = {}
+        self._lock = threading.Lock()
+        # Serializes the backfills and full replacements of each partition
+        self._rebuild_locks: Dict[Tuple[str, str], asyncio.Lock] = {}
+
+    def _path(self, site_id: str, kind: str) -> str:
+        safe_site_id = re.sub(r"[^A-Za-z0-9_.-]", "_", site_id)
+        return os.path.join(self.index_dir, safe_site_id, kind)
+
+    def partition(self, site_id: str, kind: str) -> VectorPartition:
+        key = (site_id, kind)
+        with self._lock:
+            partition = self._partitions.get(key)
+            if partition is None or partition.stale():
+                # First use, or another worker process saved it since
+                partition = VectorPartition(self._path(site_id, kind), self.use_hnsw).load()
+                self._partitions[key] = partition
+            return partition
+
+    def has_partition(self, site_id: str, kind: str) -> bool:
+        """Whether the partition is loaded or has been saved on this host."""
+        return ((site_id, kind) in self._partitions
+                or VectorPartition(self._path(site_id, kind)).saved_version() is not None)
+
+    def _rebuild_lock(self, site_id: str, kind: str) -> asyncio.Lock:
+        return self._rebuild_locks.setdefault((site_id, kind), asyncio.Lock())
+
+    async def _load_from_mongo(self, site_id: str, kind: str) -> int:
+        ids, vectors = await load_stored_vectors(site_id, kind)
+        await asyncio.to_thread(self._replace, site_id, kind, ids, vectors)
+        return len(ids)
+
+    async def rebuild(self, site_id: str, kind: str) -> int:
+        """Replaces a partition with the vectors stored in Mongo; returns their count."""
+        async with self._rebuild_lock(site_id, kind):
+            return await self._load_from_mongo(site_id, kind)
+
+    async def ensure_partition(self, site_id: str, kind: str):
+        """Backfills the partition from Mongo if this host has none."""
+        if self.has_partition(site_id, kind):
+            return
+        async with self._rebuild_lock(site_id, kind):
+            if self.has_partition(site_id, kind):
+                return
+            count = await self._load_from_mongo(site_id, kind)
+        logger.info("Backfilled %d %s vectors of site_id %s from Mongo", count, kind, site_id)
+
+    def _search(self, site_id: str, vector, limit: int) -> List[dict]:
+        query = normalize(vector)[0]
+        hits = []
+        for kind in KINDS:
+            hits.extend(self.partition(site_id, kind).search(query, limit))
+        hits = sorted(hits, key=lambda hit: hit[1], reverse=True)[:limit]
+        if not hits:
+            return []
+
+        object_ids = [ObjectId(doc_id) if ObjectId.is_valid(doc_id) else doc_id for doc_id, _ in hits]
+        docs = {str(doc["_id"]): doc for doc in Model().find({"_id": {"$in": object_ids}}, {"embeddings": 0})}
+        results = []
+        for doc_id, score in hits:
+            if doc_id in docs:
+                docs[doc_id]["score"] = score
+                results.append(docs[doc_id])
+        return results
+
+    def _replace(self, site_id: str, kind: str, ids: List[str], vectors):
+        # Built aside and swapped in, so searches keep the old partition meanwhile
+        partition = VectorPartition(self._path(site_id, kind), self.use_hnsw)
+        partition.replace(ids, vectors)
+        partition.save()
+        with self._lock:
+            self._partitions[(site_id, kind)] = partition
+
+    def _commit(self, site_id: str, kind: str):
+        partition = self.partition(site_id, kind)
+        if partition.dirty:
+            partition.save()
+
+    async def search(self, site_id: str, vector, limit: int = 5) -> List[dict]:
+        for kind in KINDS:
+            await self.ensure_partition(site_id, kind)
+        return await asyncio.to_thread(self._search, site_id, vector, limit)
+
+    async def replace(self, site_id: str, kind: str, ids: List[str], vectors):
+        async with self._rebuild_lock(site_id, kind):
+            await asyncio.to_thread(self._replace, site_id, kind, [str(i) for i in ids], vectors)
+
+    async def upsert(self, site_id: str, kind: str, ids: List[str], vectors):
+        if len(ids):
+            await self.ensure_partition(site_id, kind)
+            await asyncio.to_thread(self.partition(site_id, kind).upsert, [str(i) for i in ids], vectors)
+
+    async def delete(self, site_id: str, kind: str, ids: List[str]):
+        if len(ids):
+            await self.ensure_partition(site_id, kind)
+            await asyncio.to_thread(self.partition(site_id, kind).delete, [str(i) for i in ids])
+
+    async def commit(self, site_id: str, kind: str):
+        await asyncio.to_thread(self._commit, site_id, kind)
+
+
+def get_retriever(backend: str = RETRIEVER_BACKEND) -> Retriever:
+    if backend == "atlas":
+        return AtlasRetriever()
+    if backend == "numpy":
+        return LocalRetriever()
+    if backend == "hnsw":
+        return LocalRetriever(use_hnsw=True)
+    raise ValueError(f"Unknown RETRIEVER_BACKEND: {backend}")
+
+
+retriever = get_retriever()
+
+
+async def rebuild_partitions(local: LocalRetriever, site_id: str = None, kinds=KINDS):
+    for kind in kinds:
+        site_ids = [site_id] if site_id else await AsyncModel().distinct("site_id", {"for": kind})
+        for site in site_ids:
+            count = await local.rebuild(site, kind)
+            print(f"Indexed {count} {kind} vectors of site_id {site}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--site-id", help="only rebuild this site")
+    parser.add_argument("--kind", choices=KINDS, help="only rebuild this kind")
+    parser.add_argument("--backend", choices=("numpy", "hnsw"),
+                        default=RETRIEVER_BACKEND if RETRIEVER_BACKEND != "atlas" else "numpy")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    local = get_retriever(args.backend)
+    asyncio.run(rebuild_partitions(local, args.site_id, [args.kind] if args.kind else KINDS))
+
+
+if __name__ == "__main__":
+    main()
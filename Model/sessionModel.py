@@ -0,0 +1,201 @@
+"""
+Server-side chat sessions, so clients send a session id instead of the
+whole chat history with every message.
+
+A session keeps its most recent turns verbatim. Once CHAT_SESSION_RECENT_TURNS
+more turns have accumulated, the oldest ones are folded into a running
+summary by the LLM, in the background. The history put into a prompt is
+therefore the summary plus the last N to 2N turns, whatever the length of
+the conversation.
+
+Sessions live in the docEmbeddings.chat_sessions collection, where a TTL
+index removes the ones left unused for CHAT_SESSION_TTL_SECONDS, so any
+worker process can continue any conversation: every message reads its
+session back, turns are appended with $push and a compaction only
+replaces the turns it folded. An in-memory LRU keeps conversations going
+while Mongo is unreachable.
+"""
+import asyncio
+import datetime
+import logging
+import os
+import uuid
+from collections import OrderedDict
+from typing import List, Optional
+
+from dotenv import load_dotenv
+from pymongo import ReturnDocument
+
+from Model.SummaryBotModel import get_summary_model_response
+from Model.contextPacker import fit_tokens, format_message
+from Model.pluginModel import SessionModel
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+CHAT_SESSION_CACHE_SIZE = int(os.getenv("CHAT_SESSION_CACHE_SIZE", "10000"))
+# Turns (a user message and its answer) kept verbatim before being summarized
+CHAT_SESSION_RECENT_TURNS = int(os.getenv("CHAT_SESSION_RECENT_TURNS", "4"))
+CHAT_SUMMARY_TOKENS = int(os.getenv("CHAT_SUMMARY_TOKENS", "300"))
+
+
+class ChatSession:
+    def __init__(self, session_id: str, site_id: str, summary: str = "", messages: List[dict] = None,
+                 summarized_turns: int = 0):
+        self.id = session_id
+        self.site_id = site_id
+        self.summary = summary
+        self.messages = messages or []
+        self.summarized_turns = summarized_turns
+
+    @classmethod
+    def from_document(cls, doc: dict) -> "ChatSession":
+        return cls(doc["_id"], doc["site_id"], doc.get("summary") or "", doc.get("messages") or [],
+                   doc.get("summarized_turns") or 0)
+
+    def update(self, doc: dict):
+        """Takes the stored state of the session, which other workers may have changed."""
+        self.summary = doc.get("summary") or ""
+        self.messages = doc.get("messages") or []
+        self.summarized_turns = doc.get("summarized_turns") or 0
+
+    def history(self) -> List[dict]:
+        """Chat history for the next prompt: the summary, then the turns not summarized yet."""
+        history = list(self.messages)
+        if self.summary:
+            history.insert(0, {"role": "summary of the earlier conversation", "content": self.summary})
+        return history
+
+
+class ChatSessionStore:
+    def __init__(self, maxsize: int = CHAT_SESSION_CACHE_SIZE, recent_turns: int = CHAT_SESSION_RECENT_TURNS,
+                 summary_tokens: int = CHAT_SUMMARY_TOKENS):
+        self.maxsize = maxsize
+        self.recent_turns = max(recent_turns, 1)
+        self.summary_tokens = summary_tokens
+        self._sessions: "OrderedDict[str, ChatSession]" = OrderedDict()
+        # Ids of the sessions this process is compacting
+        self._compacting = set()
+        self._tasks = set()
+
+    def _remember(self, session: ChatSession):
+        self._sessions[session.id] = session
+        self._sessions.move_to_end(session.id)
+        while len(self._sessions) > self.maxsize:
+            self._sessions.popitem(last=False)
+
+    async def get(self, site_id: str, session_id: Optional[str] = None) -> ChatSession:
+        """
+        Returns the session_id session of site_id. A missing, unknown or
+        expired id, or the id of another site's session, starts a new
+        session with a new id.
+        """
+        session = None
+        if session_id:
+            collection = SessionModel()
+            try:
+                if collection is None:
+                    raise RuntimeError("no chat sessions collection")
+                doc = await collection.find_one({"_id": session_id})
+                session = ChatSession.from_document(doc) if doc else None
+            except Exception as e:
+                logger.error("error loading chat session %s: %s", session_id, e)
+                session = self._sessions.get(session_id)
+
+        if session is None or session.site_id != site_id:
+            session = ChatSession(uuid.uuid4().hex, site_id)
+        self._remember(session)
+        return session
+
+    async def record(self, session: ChatSession, user_message: str, answer: Optional[str]):
+        """Adds a turn to the session, saves it and starts a compaction once enough turns piled up."""
+        turn = [{"role": "user", "content": user_message}]
+        if answer:
+            turn.append({"role": "assistant", "content": answer})
+        # Bound the session even if summaries keep failing
+        kept = self.recent_turns * 2 * 4
+        collection = SessionModel()
+        try:
+            if collection is None:
+                raise RuntimeError("no chat sessions collection")
+            doc = await collection.find_one_and_update(
+                {"_id": session.id},
+                {
+                    "$push": {"messages": {"$each": turn, "$slice": -kept}},
+                    "$set": {"site_id": session.site_id, "updated_at": datetime.datetime.utcnow()},
+                },
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+            session.update(doc)
+        except Exception as e:
+            logger.error("error saving chat session %s: %s", session.id, e)
+            session.messages.extend(turn)
+            del session.messages[:-kept]
+
+        if len(session.messages) > self.recent_turns * 2 * 2 and session.id not in self._compacting:
+            self._compacting.add(session.id)
+            task = asyncio.create_task(self._compact(session))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _compact(self, session: ChatSession):
+        """Folds every turn but the last recent_turns into the session summary."""
+        try:
+            folded = session.messages[:-self.recent_turns * 2]
+            previous_summary = session.summary
+            conversation = "\n".join(format_message(message) for message in folded)
+            summary = await get_summary_model_response(session.summary, conversation, self.summary_tokens)
+            if not summary:
+                return
+            summary, _ = await asyncio.to_thread(fit_tokens, summary, self.summary_tokens)
+            summarized_turns = session.summarized_turns + sum(1 for message in folded if message["role"] == "user")
+            if not await self._replace_folded(session, folded, previous_summary, summary, summarized_turns):
+                return
+            logger.debug("Compacted chat session %s to %d messages", session.id, len(session.messages))
+        except Exception:
+            logger.exception("Error summarizing chat session %s", session.id)
+        finally:
+            self._compacting.discard(session.id)
+
+    async def _replace_folded(self, session: ChatSession, folded: List[dict], previous_summary: str,
+                              summary: str, summarized_turns: int) -> bool:
+        """
+        Replaces the folded turns with the summary. Turns recorded meanwhile,
+        by any worker, stay verbatim: the update only applies if the stored
+        messages are still the ones read, and is retried otherwise.
+        """
+        collection = SessionModel()
+        if collection is None:
+            session.messages = session.messages[len(folded):]
+            session.summary, session.summarized_turns = summary, summarized_turns
+            return True
+        for _ in range(3):
+            doc = await collection.find_one({"_id": session.id})
+            if doc is None or (doc.get("summary") or "") != previous_summary:
+                # Deleted, or compacted by another worker
+                logger.debug("Chat session %s changed during its compaction, skipping it", session.id)
+                return False
+            messages = doc.get("messages") or []
+            # The oldest folded turns may have been dropped by the $slice of record()
+            overlap = next(count for count in range(min(len(folded), len(messages)), -1, -1)
+                           if messages[:count] == folded[len(folded) - count:])
+            result = await collection.update_one(
+                {"_id": session.id, "messages": messages},
+                {"$set": {"summary": summary, "messages": messages[overlap:],
+                          "summarized_turns": summarized_turns, "updated_at": datetime.datetime.utcnow()}},
+            )
+            if result.modified_count:
+                session.update({"summary": summary, "messages": messages[overlap:],
+                                "summarized_turns": summarized_turns})
+                return True
+        return False
+
+    async def close(self):
+        """Waits for the running compactions; called when the app shuts down."""
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+chat_sessions = ChatSessionStore()
@@ -0,0 +1,154 @@
+"""
+Storage format of the embeddings kept on Mongo documents.
+
+"list" stores a BSON array of doubles (the original format). "float32"
+and "int8" store a packed BSON binary vector (binData subtype 9, the
+format Atlas Vector Search indexes natively): about 1.5 KB and 0.4 KB
+per 384-dimension embedding instead of about 5 KB.
+
+int8 vectors are scaled per vector so their largest component is 127. The
+scale is not stored: decoding gives the direction of the vector, which is
+all cosine / dot-product search on normalized embeddings needs.
+
+Existing documents are rewritten in place, batch by batch, with:
+
+    python -m Model.vectorCodec --format float32 [--site-id ID] [--dry-run]
+"""
+import argparse
+import logging
+import os
+import time
+
+import bson
+import numpy as np
+from bson.binary import Binary
+from dotenv import load_dotenv
+from pymongo import UpdateOne
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Format new embeddings are written in: "list", "float32" or "int8"
+EMBEDDING_STORAGE_FORMAT = os.getenv("EMBEDDING_STORAGE_FORMAT", "list").lower()
+STORAGE_FORMATS = ("list", "float32", "int8")
+
+VECTOR_SUBTYPE = 9
+# First header byte of a binary vector (the second one is padding, always 0 here)
+FLOAT32 = 0x27
+INT8 = 0x03
+
+
+def quantize_int8(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    scale = float(np.abs(vector).max()) if vector.size else 0.0
+    if scale == 0:
+        return np.zeros(vector.shape, dtype=np.int8)
+    return np.clip(np.rint(vector * (127 / scale)), -127, 127).astype(np.int8)
+
+
+def encode_vector(vector, storage_format: str = EMBEDDING_STORAGE_FORMAT):
+    """Converts an embedding to the value stored in the "embeddings" field."""
+    vector = np.asarray(vector, dtype=np.float32).ravel()
+    if storage_format == "list":
+        return vector.tolist()
+    if storage_format == "float32":
+        return Binary(bytes((FLOAT32, 0)) + vector.astype("<f4").tobytes(), VECTOR_SUBTYPE)
+    if storage_format == "int8":
+        return Binary(bytes((INT8, 0)) + quantize_int8(vector).tobytes(), VECTOR_SUBTYPE)
+    raise ValueError(f"Unknown EMBEDDING_STORAGE_FORMAT: {storage_format}")
+
+
+def decode_vector(value):
+    """
+    Converts a stored "embeddings" value back to a float32 array. float32
+    binary vectors are returned as a read-only view of the BSON bytes,
+    without copying.
+    """
+    if isinstance(value, bytes):
+        dtype = value[0]
+        if dtype == FLOAT32:
+            return np.frombuffer(value, dtype="<f4", offset=2)
+        if dtype == INT8:
+            return np.frombuffer(value, dtype=np.int8, offset=2).astype(np.float32) / 127
+        raise ValueError(f"Unsupported binary vector dtype: {dtype:#x}")
+    return np.asarray(value, dtype=np.float32)
+
+
+def storage_format_of(value) -> str:
+    if isinstance(value, bytes):
+        return "int8" if value[0] == INT8 else "float32"
+    return "list"
+
+
+def query_vector(vector, storage_format: str = EMBEDDING_STORAGE_FORMAT):
+    """
+    $vectorSearch queryVector for the configured format. Binary storage is
+    queried with a float32 binary vector (also for int8, so the query keeps
+    its full precision).
+    """
+    return encode_vector(vector, "list" if storage_format == "list" else "float32")
+
+
+def migrate_embeddings(collection, storage_format: str, batch_size: int = 1000, site_id: str = None,
+                       dry_run: bool = False) -> dict:
+    """
+    Rewrites the embeddings of every document (of site_id, if given) that
+    is not stored in storage_format yet. Documents are read and updated in
+    batches of batch_size, so the migration can run on a live collection
+    and be resumed after an interruption.
+    """
+    if storage_format not in STORAGE_FORMATS:
+        raise ValueError(f"Unknown storage format: {storage_format}")
+
+    query = {"embeddings": {"$exists": True}}
+    if site_id:
+        query["site_id"] = site_id
+    stats = {"scanned": 0, "converted": 0, "bytes_before": 0, "bytes_after": 0}
+
+    def flush(operations):
+        if operations and not dry_run:
+            collection.bulk_write(operations, ordered=False)
+
+    operations = []
+    cursor = collection.find(query, {"embeddings": 1}, batch_size=batch_size)
+    for doc in cursor:
+        stats["scanned"] += 1
+        value = doc["embeddings"]
+        if storage_format_of(value) == storage_format:
+            continue
+        encoded = encode_vector(decode_vector(value), storage_format)
+        stats["converted"] += 1
+        stats["bytes_before"] += len(bson.encode({"embeddings": value}))
+        stats["bytes_after"] += len(bson.encode({"embeddings": encoded}))
+        operations.append(UpdateOne({"_id": doc["_id"]}, {"$set": {"embeddings": encoded}}))
+        if len(operations) >= batch_size:
+            flush(operations)
+            operations = []
+            logger.info("Converted %d of %d scanned documents", stats["converted"], stats["scanned"])
+    flush(operations)
+    return stats
+
+
+def main():
+    from Model.pluginModel import Model
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--format", choices=STORAGE_FORMATS, default=EMBEDDING_STORAGE_FORMAT)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--site-id", help="only migrate this site")
+    parser.add_argument("--dry-run", action="store_true", help="count and size the changes without writing")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    start = time.perf_counter()
+    stats = migrate_embeddings(Model(), args.format, args.batch_size, args.site_id, args.dry_run)
+    print(f"{'Would convert' if args.dry_run else 'Converted'} {stats['converted']} of {stats['scanned']} documents "
+          f"to {args.format} in {time.perf_counter() - start:.1f}s; embeddings "
+          f"{stats['bytes_before']} -> {stats['bytes_after']} bytes")
+    if not args.dry_run and stats["converted"]:
+        print("Run the compact command on docEmbeddings.chunks to return the freed space to the OS.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,21 @@
+from fastapi import APIRouter, Request
+from fastapi.responses import JSONResponse
+
+from Model.embeddingModel import embedding_service
+
+
+router=APIRouter()
+
+
+@router.get('/health', include_in_schema=False)
+async def health():
+    """Liveness: the worker is up and serving requests."""
+    return {"status": "ok"}
+
+
+@router.get('/ready', include_in_schema=False)
+async def ready(request: Request):
+    """Readiness: startup is complete and the embedding model is warmed up in this worker."""
+    if getattr(request.app.state, "started", False) and embedding_service.ready:
+        return {"status": "ready"}
+    return JSONResponse({"status": "starting"}, status_code=503)
@@ -0,0 +1,58 @@
+import time
+
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from starlette.routing import Match
+
+from Model.metricsModel import REQUEST_SECONDS, REQUESTS_TOTAL, current_route, render_metrics
+
+
+router=APIRouter()
+
+
+@router.get('/metrics', include_in_schema=False)
+async def metrics():
+    """Prometheus text exposition of the request and pipeline stage metrics."""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
+def route_template(app, scope) -> str:
+    """Path template of the route serving scope (e.g. /plugin/jobs/{job_id}), so labels stay bounded."""
+    for route in app.router.routes:
+        match, child_scope = route.matches(scope)
+        if match == Match.FULL:
+            return getattr(child_scope.get("route", route), "path", "unmatched")
+    return "unmatched"
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording latency and count per route and status. The
+    route is also put in current_route so the stage timings of the request
+    carry it. Streaming responses are timed until their last byte.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        route = route_template(scope["app"], scope)
+        current_route.set(route)
+        status_code = 500
+        start = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            labels = {"method": scope["method"], "route": route, "status": status_code}
+            REQUEST_SECONDS.observe(time.perf_counter() - start, **labels)
+            REQUESTS_TOTAL.inc(**labels)
@@ -1,34 +1,97 @@
 from fastapi import APIRouter,Request,File,UploadFile,HTTPException,Form
-from Controllers.pluginController import extract_text_from_docx,extract_text_from_pdf,getchunks,response_generator
-from Controllers.apiController import process_woocommerce_products
+from typing import List
+from fastapi.responses import JSONResponse,StreamingResponse
+from Controllers.pluginController import TEXT_EXTRACTORS,RETRIEVAL_MODES,BATCH_MODES,BATCH_MAX_ITEMS,batch_chat,spool_upload,getdocument,getchunks,ingest_files,answer_chat,admit_chat,session_chat,stream_response_generator,stream_session_chat
+from Model.admissionModel import chat_admission
+from Model.extractionModel import BULK_UPLOAD_MAX_BYTES, BULK_UPLOAD_MAX_FILES
+from Controllers.apiController import parse_woocommerce_products,parse_woocommerce_stream,stream_woocommerce_products,sync_woocommerce_products
+from Model.cacheModel import cache_stats
+from Model.jobModel import JOB_PROGRESS_INTERVAL, job_manager
 
+import json
+import math
 import os
 
 
 router=APIRouter()
 
-@router.post('/doc')
+
+class AdmittedStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse holding a chat slot of site_id, given back when the
+    response ends. Released here rather than in the body generator, whose
+    finally never runs if the client disconnects before it has started.
+    """
+
+    def __init__(self, content, site_id: str, **kwargs):
+        super().__init__(content, **kwargs)
+        self.site_id = site_id
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            chat_admission.release(self.site_id)
+
+
+def job_accepted(job):
+    """Response returned by the ingestion endpoints once their job is queued."""
+    return {"job_id": job.id, "status": job.status, "status_url": f"/plugin/jobs/{job.id}"}
+
+
+@router.post('/doc', status_code=202)
 async def getdoc(file: UploadFile = File(...) , site_id:str=Form(...)):
     ext = os.path.splitext(file.filename)[1].lower()
-    contents = await file.read()
-    print(f"Received site_id: {site_id}")
+    if ext not in TEXT_EXTRACTORS:
+        raise HTTPException(status_code=400, detail="Unsupported file type")
+
+    # Spool to disk so extraction can stream pages/paragraphs instead of holding the file in memory
+    path = await spool_upload(file)
+    job = await job_manager.enqueue(
+        site_id, "blogSites",
+        lambda job: getdocument(path, ext, site_id, job),
+        cleanup=lambda: os.remove(path)
+    )
+    return job_accepted(job)
+
+
+@router.post('/docs', status_code=202)
+async def getdocs(files: List[UploadFile] = File(...), site_id: str = Form(...)):
+    """
+    Bulk variant of /doc: many PDF/DOCX/TXT files and/or zip archives of
+    them in one request, ingested together as the site's documents. The
+    job result reports the status, chunk count and extraction time of
+    every file.
+    """
+    if len(files) > BULK_UPLOAD_MAX_FILES:
+        raise HTTPException(status_code=413, detail=f"At most {BULK_UPLOAD_MAX_FILES} files per upload")
+    exts = [os.path.splitext(file.filename or "")[1].lower() for file in files]
+    unsupported = [file.filename for file, ext in zip(files, exts) if ext not in TEXT_EXTRACTORS and ext != ".zip"]
+    if unsupported:
+        raise HTTPException(status_code=400, detail=f"Unsupported file type: {', '.join(unsupported)}")
 
+    # BULK_UPLOAD_MAX_BYTES bounds the whole upload, not each file
+    paths = []
     try:
-        if ext == '.txt':
-            text = contents.decode('utf-8')
-        elif ext == '.pdf':
-            text = extract_text_from_pdf(contents)
-        elif ext == '.docx':
-            text = extract_text_from_docx(contents)
-        else:
-            raise HTTPException(status_code=400, detail="Unsupported file type")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error processing file: {str(e)}")
+        for file in files:
+            spooled = sum(os.path.getsize(path) for path in paths)
+            paths.append(await spool_upload(file, BULK_UPLOAD_MAX_BYTES - spooled))
+    except Exception:
+        for path in paths:
+            os.remove(path)
+        raise
 
-    return await getchunks(text,site_id)
+    def cleanup():
+        for path in paths:
+            os.remove(path)
 
+    uploads = [(file.filename, path, ext) for file, path, ext in zip(files, paths, exts)]
+    job = await job_manager.enqueue(site_id, "blogSites", lambda job: ingest_files(uploads, site_id, job),
+                                    cleanup=cleanup)
+    return job_accepted(job)
 
-@router.post('/manual')
+
+@router.post('/manual', status_code=202)
 async def upload_manual(
     site_id: str = Form(...),
     manual_faq: str = Form(...)
@@ -36,31 +99,171 @@ async def upload_manual(
     if not manual_faq.strip():
         raise HTTPException(status_code=400, detail="Manual FAQ content cannot be empty.")
 
-    print(f"Received manual FAQ content: {manual_faq[:500]}...")
-
-    result = await getchunks(manual_faq, site_id)
-    return result
+    job = await job_manager.enqueue(site_id, "blogSites", lambda job: getchunks(manual_faq, site_id, job))
+    return job_accepted(job)
 
-@router.post("/api")
+@router.post("/api", status_code=202)
 async def receive_and_process_products(request: Request):
     """
-    Receives WooCommerce product data from the WordPress plugin,
-    processes it (generates embeddings and stores in the database).
+    Receives WooCommerce product data from the WordPress plugin and queues
+    a job that processes it (generates embeddings and stores in the database).
+
+    With Content-Type application/x-ndjson the catalog is streamed instead:
+    a {"site_url", "site_id"} line followed by product or {"products": [...]}
+    page lines. The job then consumes the body as it arrives, and the
+    response (the job status) is sent once it has finished. A stream for a
+    site that already has a queued or running job is refused with a 409
+    right away rather than left waiting with its body unread.
     """
-    return await process_woocommerce_products(request)
+    if request.headers.get("content-type", "").split(";")[0].strip() == "application/x-ndjson":
+        site, products = await parse_woocommerce_stream(request)
+        busy = await job_manager.busy_job(site.site_id)
+        if busy is not None:
+            return JSONResponse(
+                {"detail": f"An ingestion of site_id {site.site_id} is already queued or running",
+                 "job_id": busy, "status_url": f"/plugin/jobs/{busy}"},
+                status_code=409,
+                headers={"Retry-After": str(math.ceil(JOB_PROGRESS_INTERVAL))},
+            )
+        job = await job_manager.enqueue(site.site_id, "WooCommerce",
+                                        lambda job: stream_woocommerce_products(site, products, job))
+        await job.wait()
+        status_code = {"succeeded": 200, "superseded": 409}.get(job.status, job.status_code or 500)
+        return JSONResponse(job.to_dict(), status_code=status_code)
+
+    payload = await parse_woocommerce_products(request)
+    job = await job_manager.enqueue(payload.site_id, "WooCommerce", lambda job: sync_woocommerce_products(payload, job))
+    return job_accepted(job)
+
+@router.get('/jobs/{job_id}')
+async def get_job_status(job_id: str):
+    """Phase, progress and throughput of an ingestion job."""
+    job = await job_manager.lookup(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
 
 @router.post('/chat')
 async def post_chat(request: Request):
+    """
+    Answers a chat message. The history comes either from "chat_history"
+    or, when the body has a "session_id" key, from a server-side session:
+    send null to start one and the returned "session_id" afterwards.
+    """
     data = await request.json()
     site_id = data.get("site_id")
     message = data.get("message")
     chat_history = data.get("chat_history") 
+    retrieval_mode = data.get("retrieval_mode")
 
     if not site_id or not message:
         return {"error": "Both 'site_id' and 'message' are required."}
+    if retrieval_mode and retrieval_mode not in RETRIEVAL_MODES:
+        return {"error": f"'retrieval_mode' must be one of {', '.join(RETRIEVAL_MODES)}."}
 
     try:
-        response_data = await response_generator(message, site_id, chat_history)
+        if "session_id" in data:
+            response_data, session_id = await session_chat(message, site_id, data["session_id"], retrieval_mode)
+            return {"response": response_data, "session_id": session_id}
+        response_data = await answer_chat(message, site_id, chat_history, retrieval_mode)
         return {"response": response_data} 
+    except HTTPException:
+        raise
     except Exception as e:
-        return {"error": f"An error occurred: {str(e)}"}
\ No newline at end of file
+        return {"error": f"An error occurred: {str(e)}"}
+
+@router.post('/chat/stream')
+async def post_chat_stream(request: Request):
+    """
+    Streaming variant of /chat. Answers as server-sent events: a "metadata"
+    event with the retrieval results, "token" events as the model generates,
+    and a final "done" event carrying the same payload /chat returns.
+    With a "session_id" the metadata and done events carry the session id.
+    """
+    data = await request.json()
+    site_id = data.get("site_id")
+    message = data.get("message")
+    chat_history = data.get("chat_history") 
+    retrieval_mode = data.get("retrieval_mode")
+
+    if not site_id or not message:
+        return {"error": "Both 'site_id' and 'message' are required."}
+    if retrieval_mode and retrieval_mode not in RETRIEVAL_MODES:
+        return {"error": f"'retrieval_mode' must be one of {', '.join(RETRIEVAL_MODES)}."}
+
+    if "session_id" in data:
+        events = stream_session_chat(message, site_id, data["session_id"], retrieval_mode)
+    else:
+        events = stream_response_generator(message, site_id, chat_history, retrieval_mode)
+
+    async def event_stream():
+        try:
+            async for event, payload in events:
+                yield f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+        except Exception as e:
+            yield f"event: error\ndata: {json.dumps({'error': f'An error occurred: {str(e)}'})}\n\n"
+
+    # Admitted before the response starts, so a rejection is still a plain 429;
+    # the response gives the slot back however it ends
+    admit_chat(site_id)
+    return AdmittedStreamingResponse(
+        event_stream(),
+        site_id,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@router.post('/chat/batch')
+async def post_chat_batch(request: Request):
+    """
+    Answers many messages in one request, for QA replays and FAQ
+    precomputation: {"items": [{"site_id", "message", "chat_history"?}],
+    "mode": "answer" | "retrieval", "stream": bool, "retrieval_mode"}.
+
+    Returns {"results": [...]} in the order of items, or with "stream"
+    true, one JSON line per item as it finishes (application/x-ndjson).
+    Every result carries the "index" of its item. Mode "retrieval" returns
+    the retrieved documents without calling the LLM.
+    """
+    data = await request.json()
+    items = data.get("items")
+    mode = data.get("mode", "answer")
+    retrieval_mode = data.get("retrieval_mode")
+
+    if not isinstance(items, list) or not items:
+        return {"error": "'items' must be a non-empty list."}
+    if len(items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_ITEMS} items per batch")
+    if any(not isinstance(item, dict) or not item.get("site_id") or not item.get("message") for item in items):
+        return {"error": "Every item needs both 'site_id' and 'message'."}
+    if mode not in BATCH_MODES:
+        return {"error": f"'mode' must be one of {', '.join(BATCH_MODES)}."}
+    if retrieval_mode and retrieval_mode not in RETRIEVAL_MODES:
+        return {"error": f"'retrieval_mode' must be one of {', '.join(RETRIEVAL_MODES)}."}
+
+    results = batch_chat(items, mode, retrieval_mode)
+    if not data.get("stream"):
+        try:
+            ordered = [None] * len(items)
+            async for result in results:
+                ordered[result["index"]] = result
+            return {"results": ordered}
+        except Exception as e:
+            return {"error": f"An error occurred: {str(e)}"}
+
+    async def lines():
+        try:
+            async for result in results:
+                yield json.dumps(result) + "\n"
+        except Exception as e:
+            yield json.dumps({"error": f"An error occurred: {str(e)}"}) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@router.get('/cache/stats')
+async def get_cache_stats():
+    """Hit/miss counters of the query embedding and answer caches."""
+    return cache_stats()
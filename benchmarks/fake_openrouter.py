@@ -0,0 +1,72 @@
+"""
+Fake OpenRouter chat completions server for offline benchmarks.
+
+Answers POST /api/v1/chat/completions after a configurable latency, either
+as one JSON completion or, when the body has "stream": true, as SSE deltas
+with a configurable delay per token.
+
+    python -m benchmarks.fake_openrouter --port 8100 --latency-ms 300 --token-delay-ms 10
+"""
+import argparse
+import asyncio
+import json
+import random
+
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+ANSWER = ("Thanks for your question! Here at Store we have a few options that fit what you are "
+          "looking for. Let me know if you would like more details about any of them.")
+
+
+def create_app(latency_ms: float = 300, jitter_ms: float = 50, token_delay_ms: float = 10,
+               error_rate: float = 0.0) -> FastAPI:
+    app = FastAPI()
+    app.state.requests = 0
+
+    @app.post("/api/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        app.state.requests += 1
+        await asyncio.sleep(max(0.0, latency_ms + random.uniform(-jitter_ms, jitter_ms)) / 1000)
+
+        if error_rate and random.random() < error_rate:
+            return StreamingResponse(iter([b'{"error": "overloaded"}']), status_code=503,
+                                     media_type="application/json")
+
+        if not body.get("stream"):
+            return {"choices": [{"message": {"role": "assistant", "content": ANSWER}}]}
+
+        async def events():
+            for word in ANSWER.split(" "):
+                await asyncio.sleep(token_delay_ms / 1000)
+                chunk = {"choices": [{"delta": {"content": word + " "}}]}
+                yield f"data: {json.dumps(chunk)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.get("/stats")
+    async def stats():
+        return {"requests": app.state.requests}
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--latency-ms", type=float, default=300)
+    parser.add_argument("--jitter-ms", type=float, default=50)
+    parser.add_argument("--token-delay-ms", type=float, default=10)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    import uvicorn
+    app = create_app(args.latency_ms, args.jitter_ms, args.token_delay_ms, args.error_rate)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+Parity and throughput check of the ONNX embedding backend against PyTorch.
+
+Embeds the same texts with SentenceTransformer and with the ONNX Runtime
+export (fp32, and int8 with --quantize), then reports the cosine
+similarity of each ONNX embedding to its PyTorch counterpart and the
+throughput of every backend, for batched ingestion-style encoding and for
+one-query-at-a-time encoding. Exits with status 1 when the lowest cosine
+is under --min-cosine.
+
+    python -m benchmarks.onnx_parity --quantize --output parity.json
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks import synthetic
+from Model.embeddingModel import EMBEDDING_MODEL_NAME
+from Model.onnxEmbeddingModel import EMBEDDING_INTRA_OP_THREADS, OnnxEncoder, ensure_onnx_model
+
+
+def load_texts(path: str = None, count: int = 512):
+    if path:
+        with open(path, encoding="utf-8") as f:
+            return [line.strip() for line in f if line.strip()]
+    return list(synthetic.QUESTIONS) + list(synthetic.paragraphs(count))
+
+
+def throughput(encoder, texts, batch_size: int, queries: int):
+    """Texts per second when encoding in batches and when encoding one query at a time."""
+    encoder.encode(texts[:batch_size], batch_size=batch_size)  # warm up
+    start = time.perf_counter()
+    encoder.encode(texts, batch_size=batch_size)
+    batch_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for text in texts[:queries]:
+        encoder.encode([text], batch_size=1)
+    query_seconds = time.perf_counter() - start
+    return {
+        "batch_texts_per_second": len(texts) / batch_seconds,
+        "query_texts_per_second": min(queries, len(texts)) / query_seconds,
+        "query_ms": query_seconds / min(queries, len(texts)) * 1000,
+    }
+
+
+def cosine_report(reference, vectors):
+    reference = reference / np.linalg.norm(reference, axis=1, keepdims=True)
+    vectors = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    cosine = (reference * vectors).sum(axis=1)
+    return {
+        "min": float(cosine.min()),
+        "p01": float(np.percentile(cosine, 1)),
+        "mean": float(cosine.mean()),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default=EMBEDDING_MODEL_NAME)
+    parser.add_argument("--onnx-dir", default=None, help="export directory, defaults to a temp dir")
+    parser.add_argument("--input", help="text file with one text per line, defaults to synthetic paragraphs")
+    parser.add_argument("--quantize", action="store_true", help="also check the int8 model")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--queries", type=int, default=200, help="texts encoded one at a time")
+    parser.add_argument("--intra-op-threads", type=int, default=EMBEDDING_INTRA_OP_THREADS)
+    parser.add_argument("--min-cosine", type=float, default=0.98)
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    from sentence_transformers import SentenceTransformer
+
+    texts = load_texts(args.input)
+    path = ensure_onnx_model(args.model, args.quantize, args.onnx_dir or tempfile.mkdtemp(prefix="synapse-onnx-"))
+
+    torch_encoder = SentenceTransformer(args.model, device="cpu")
+    reference = torch_encoder.encode(texts, batch_size=args.batch_size)
+    report = {
+        "model": args.model,
+        "texts": len(texts),
+        "cpu_count": os.cpu_count(),
+        "backends": {"torch": throughput(torch_encoder, texts, args.batch_size, args.queries)},
+    }
+
+    failed = False
+    for name, quantized in [("onnx", False)] + ([("onnx_int8", True)] if args.quantize else []):
+        encoder = OnnxEncoder(path, quantized, args.intra_op_threads)
+        cosine = cosine_report(reference, encoder.encode(texts, batch_size=args.batch_size))
+        report["backends"][name] = {
+            **throughput(encoder, texts, args.batch_size, args.queries),
+            "cosine_to_torch": cosine,
+        }
+        failed = failed or cosine["min"] < args.min_cosine
+        print(f"{name}: min cosine {cosine['min']:.5f}, mean {cosine['mean']:.5f}", file=sys.stderr)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    else:
+        print(text)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
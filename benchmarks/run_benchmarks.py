@@ -0,0 +1,276 @@
+"""
+Offline benchmark harness for ingestion throughput and chat latency.
+
+Starts the fake OpenRouter server and the FastAPI app (uvicorn, one
+process each) against a local MongoDB, using the in-process vector index
+(RETRIEVER_BACKEND=numpy) since $vectorSearch only exists on Atlas. Then:
+
+- uploads synthetic PDFs/DOCX to /plugin/doc and reports chunks/s,
+- syncs synthetic catalogs to /plugin/api (full, unchanged and partly
+  changed re-syncs) and reports products/s,
+- replays chat questions against /plugin/chat with the given concurrency
+  and reports p50/p95/p99 latency.
+
+Results are written as JSON so runs can be compared between releases.
+
+    docker run -d -p 27017:27017 mongo:7
+    python -m benchmarks.run_benchmarks --output bench.json
+    python -m benchmarks.run_benchmarks --quick --llm-latency-ms 800 --concurrency 32
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timezone
+
+import httpx
+
+from benchmarks import synthetic
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(values, pct: float):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=ROOT, text=True).strip()
+    except Exception:
+        return None
+
+
+def start_process(args, env=None):
+    return subprocess.Popen(args, cwd=ROOT, env={**os.environ, **(env or {})})
+
+
+async def wait_until_up(url: str, timeout: float = 300):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get(url)).status_code < 500:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.5)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+async def wait_for_job(client: httpx.AsyncClient, accepted: dict, poll_interval: float = 0.2) -> dict:
+    while True:
+        job = (await client.get(accepted["status_url"])).json()
+        if job["status"] in ("succeeded", "failed", "superseded"):
+            return job
+        await asyncio.sleep(poll_interval)
+
+
+async def bench_documents(client: httpx.AsyncClient, workdir: str, sizes, run_id: str):
+    results = []
+    for kind, size in sizes:
+        path = os.path.join(workdir, f"bench_{size}.{kind}")
+        if kind == "pdf":
+            synthetic.make_pdf(path, pages=size)
+        else:
+            synthetic.make_docx(path, paragraph_count=size)
+        site_id = f"bench-doc-{run_id}-{kind}-{size}"
+
+        start = time.perf_counter()
+        with open(path, "rb") as f:
+            response = await client.post("/plugin/doc", data={"site_id": site_id},
+                                         files={"file": (os.path.basename(path), f)})
+        response.raise_for_status()
+        job = await wait_for_job(client, response.json())
+        elapsed = time.perf_counter() - start
+
+        results.append({
+            "kind": kind,
+            "size": size,
+            "size_unit": "pages" if kind == "pdf" else "paragraphs",
+            "bytes": os.path.getsize(path),
+            "status": job["status"],
+            "chunks": job["items_done"],
+            "seconds": elapsed,
+            "chunks_per_second": job["items_done"] / elapsed if elapsed else None,
+            "error": job["error"],
+        })
+        print(f"doc {kind} {size}: {job['items_done']} chunks in {elapsed:.2f}s")
+    return results
+
+
+async def bench_catalogs(client: httpx.AsyncClient, sizes, run_id: str):
+    results = []
+    for size in sizes:
+        site_id = f"bench-api-{run_id}-{size}"
+        scenarios = [
+            ("full", synthetic.make_catalog(site_id, size)),
+            ("unchanged", synthetic.make_catalog(site_id, size)),
+            ("changed_1pct", synthetic.make_catalog(site_id, size, changed=max(1, size // 100))),
+        ]
+        for scenario, payload in scenarios:
+            start = time.perf_counter()
+            response = await client.post("/plugin/api", json=payload)
+            response.raise_for_status()
+            job = await wait_for_job(client, response.json())
+            elapsed = time.perf_counter() - start
+            results.append({
+                "products": size,
+                "scenario": scenario,
+                "status": job["status"],
+                "seconds": elapsed,
+                "products_per_second": size / elapsed if elapsed else None,
+                "result": job["result"],
+                "error": job["error"],
+            })
+            print(f"api {size} {scenario}: {elapsed:.2f}s")
+    return results
+
+
+async def bench_chat(client: httpx.AsyncClient, site_ids, requests: int, concurrency: int,
+                     unique_queries: bool):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+
+    async def one(i: int):
+        nonlocal errors
+        message = synthetic.QUESTIONS[i % len(synthetic.QUESTIONS)]
+        if unique_queries:
+            message = f"{message} (#{i})"
+        body = {"site_id": site_ids[i % len(site_ids)], "message": message, "chat_history": []}
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                response = await client.post("/plugin/chat", json=body)
+                failed = response.status_code != 200 or "error" in response.json()
+            except httpx.HTTPError:
+                failed = True
+            latencies.append(time.perf_counter() - start)
+            errors += failed
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    elapsed = time.perf_counter() - start
+
+    result = {
+        "requests": requests,
+        "concurrency": concurrency,
+        "unique_queries": unique_queries,
+        "errors": errors,
+        "seconds": elapsed,
+        "requests_per_second": requests / elapsed if elapsed else None,
+        "latency_seconds": {
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+            "max": max(latencies) if latencies else None,
+        },
+    }
+    print(f"chat x{requests} @ {concurrency}: p50={result['latency_seconds']['p50']:.3f}s "
+          f"p99={result['latency_seconds']['p99']:.3f}s errors={errors}")
+    return result
+
+
+async def run(args):
+    run_id = uuid.uuid4().hex[:8]
+    workdir = tempfile.mkdtemp(prefix="synapse-bench-")
+    llm_url = f"http://127.0.0.1:{args.llm_port}/api/v1/chat/completions"
+    app_url = f"http://127.0.0.1:{args.app_port}"
+
+    processes = [
+        start_process([sys.executable, "-m", "benchmarks.fake_openrouter", "--port", str(args.llm_port),
+                       "--latency-ms", str(args.llm_latency_ms), "--token-delay-ms", str(args.llm_token_delay_ms)]),
+        start_process(
+            [sys.executable, "-m", "uvicorn", "main:app", "--port", str(args.app_port), "--log-level", "warning"],
+            env={
+                "Users_MONGO_URL": args.mongo_url,
+                "OPENROUTER_URL": llm_url,
+                "RETRIEVER_BACKEND": "numpy",
+                "VECTOR_INDEX_DIR": os.path.join(workdir, "vector_index"),
+            },
+        ),
+    ]
+    try:
+        await wait_until_up(f"http://127.0.0.1:{args.llm_port}/stats")
+        app_start = time.perf_counter()
+        await wait_until_up(f"{app_url}/docs")
+        startup_seconds = time.perf_counter() - app_start
+
+        if args.quick:
+            doc_sizes, catalog_sizes, chat_requests = [("pdf", 10), ("docx", 50)], [100], 50
+        else:
+            doc_sizes = [("pdf", 10), ("pdf", 100), ("pdf", 300), ("docx", 100), ("docx", 1000)]
+            catalog_sizes, chat_requests = [100, 1000, 5000], args.chat_requests
+
+        timeout = httpx.Timeout(600, connect=10)
+        async with httpx.AsyncClient(base_url=app_url, timeout=timeout) as client:
+            documents = await bench_documents(client, workdir, doc_sizes, run_id)
+            catalogs = await bench_catalogs(client, catalog_sizes, run_id)
+            site_ids = [f"bench-doc-{run_id}-pdf-{doc_sizes[0][1]}", f"bench-api-{run_id}-{catalog_sizes[0]}"]
+            chat = [
+                await bench_chat(client, site_ids, chat_requests, concurrency, args.unique_queries)
+                for concurrency in args.concurrency
+            ]
+            cache = (await client.get("/plugin/cache/stats")).json()
+
+        return {
+            "meta": {
+                "timestamp": datetime.now(timezone.utc).isoformat(),
+                "git_commit": git_commit(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpu_count": os.cpu_count(),
+                "llm_latency_ms": args.llm_latency_ms,
+                "llm_token_delay_ms": args.llm_token_delay_ms,
+                "app_startup_seconds": startup_seconds,
+            },
+            "documents": documents,
+            "catalogs": catalogs,
+            "chat": chat,
+            "cache": cache,
+        }
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait(timeout=30)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongo-url", default=os.getenv("BENCH_MONGO_URL", "mongodb://127.0.0.1:27017"))
+    parser.add_argument("--app-port", type=int, default=8099)
+    parser.add_argument("--llm-port", type=int, default=8100)
+    parser.add_argument("--llm-latency-ms", type=float, default=300)
+    parser.add_argument("--llm-token-delay-ms", type=float, default=10)
+    parser.add_argument("--chat-requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--unique-queries", action="store_true",
+                        help="make every chat message distinct so the answer cache never hits")
+    parser.add_argument("--quick", action="store_true", help="small sizes, for a smoke run")
+    parser.add_argument("--output", help="write the JSON results here instead of stdout")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+        print(f"Results written to {args.output}")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+Startup time and per-worker memory of the production server (serve.py).
+
+Starts serve.py once with the model preloaded in the gunicorn master and
+once with every worker loading its own copy (SERVE_PRELOAD=false), and
+for each reports:
+
+- seconds until /health answers and until every worker reports /ready,
+- RSS, PSS and USS (private memory) of the master and of each worker,
+  read from /proc/<pid>/smaps_rollup (Linux only). PSS splits shared
+  pages between the processes sharing them, so its total is the real
+  footprint of the server; copy-on-write sharing shows up as workers
+  whose USS is much smaller than their RSS.
+
+Also reports how long importing the app takes in a fresh interpreter.
+Workers report ready without a reachable MongoDB (startup logs the
+failed index setup and carries on), so the numbers can be taken on a
+machine without one; the model is EMBEDDING_MODEL_NAME as in the app.
+
+    python -m benchmarks.startup --workers 4 --output startup.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+import httpx
+
+from benchmarks.run_benchmarks import ROOT, git_commit, start_process
+
+MODES = {"preload": "true", "per_worker": "false"}
+
+
+def import_seconds() -> float:
+    code = "import time; t = time.perf_counter(); import main; print(time.perf_counter() - t)"
+    return float(subprocess.check_output([sys.executable, "-c", code], cwd=ROOT, text=True).strip().splitlines()[-1])
+
+
+def memory_kb(pid: int) -> dict:
+    """RSS, PSS and USS of a process, in kB."""
+    fields = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                fields[parts[0].rstrip(":")] = int(parts[1])
+    return {
+        "rss_kb": fields.get("Rss", 0),
+        "pss_kb": fields.get("Pss", 0),
+        "uss_kb": fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0),
+    }
+
+
+def children(pid: int):
+    with open(f"/proc/{pid}/task/{pid}/children") as f:
+        return [int(child) for child in f.read().split()]
+
+
+def wait_ready(url: str, workers: int, timeout: float):
+    """Seconds until /health answers and until /ready succeeds often enough in a row to cover every worker."""
+    start = time.perf_counter()
+    health = None
+    in_a_row = 0
+    deadline = time.monotonic() + timeout
+    with httpx.Client(timeout=5) as client:
+        while time.monotonic() < deadline:
+            try:
+                if health is None and client.get(f"{url}/health").status_code == 200:
+                    health = time.perf_counter() - start
+                # New connections are spread over the workers, so a run of
+                # successes means all of them are ready
+                with httpx.Client(timeout=5) as fresh:
+                    ok = fresh.get(f"{url}/ready").status_code == 200
+                in_a_row = in_a_row + 1 if ok else 0
+                if in_a_row >= workers * 5:
+                    return health, time.perf_counter() - start
+            except httpx.TransportError:
+                pass
+            time.sleep(0.05)
+    raise RuntimeError(f"{url} was not ready within {timeout}s")
+
+
+def measure(mode: str, workers: int, port: int, timeout: float) -> dict:
+    process = start_process([sys.executable, "serve.py"], {
+        "WEB_CONCURRENCY": str(workers),
+        "PORT": str(port),
+        "HOST": "127.0.0.1",
+        "SERVE_PRELOAD": MODES[mode],
+    })
+    try:
+        health_seconds, ready_seconds = wait_ready(f"http://127.0.0.1:{port}", workers, timeout)
+        worker_memory = [memory_kb(pid) for pid in children(process.pid)]
+        master_memory = memory_kb(process.pid)
+    finally:
+        process.terminate()
+        process.wait(timeout=60)
+
+    total_pss = master_memory["pss_kb"] + sum(worker["pss_kb"] for worker in worker_memory)
+    print(f"{mode}: health {health_seconds:.1f}s, ready {ready_seconds:.1f}s, total PSS {total_pss / 1024:.0f} MB, "
+          f"worker USS {[round(worker['uss_kb'] / 1024) for worker in worker_memory]} MB")
+    return {
+        "health_seconds": health_seconds,
+        "ready_seconds": ready_seconds,
+        "master": master_memory,
+        "workers": worker_memory,
+        "total_pss_kb": total_pss,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--modes", default=",".join(MODES), help="comma-separated: " + ", ".join(MODES))
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    report = {
+        "commit": git_commit(),
+        "workers": args.workers,
+        "cpu_count": os.cpu_count(),
+        "import_seconds": import_seconds(),
+        "modes": {mode: measure(mode, args.workers, args.port, args.timeout) for mode in args.modes.split(",")},
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Synthetic PDFs, DOCX files and WooCommerce catalogs for the benchmarks."""
+import random
+
+WORDS = (
+    "order shipping delivery return refund policy product size color warranty battery "
+    "charger cable cotton leather kitchen garden outdoor travel account payment card "
+    "invoice discount coupon stock available days business support contact email phone "
+    "store customer package tracking international express standard free exchange"
+).split()
+
+QUESTIONS = [
+    "What is your shipping policy?",
+    "How do I return an item?",
+    "Do you ship internationally?",
+    "How long does delivery take?",
+    "Can I get a refund?",
+    "Do you have leather bags in stock?",
+    "What payment methods do you accept?",
+    "Is there a warranty on chargers?",
+    "How can I track my package?",
+    "Do you offer free exchange?",
+]
+
+
+def sentence(rng: random.Random) -> str:
+    words = [rng.choice(WORDS) for _ in range(rng.randint(6, 24))]
+    return " ".join(words).capitalize() + "."
+
+
+def paragraphs(count: int, seed: int = 0):
+    rng = random.Random(seed)
+    for _ in range(count):
+        yield " ".join(sentence(rng) for _ in range(rng.randint(3, 8)))
+
+
+def make_pdf(path: str, pages: int, seed: int = 0):
+    """Writes a PDF with roughly a page of text per page plus a repeated footer."""
+    import fitz
+
+    doc = fitz.open()
+    texts = paragraphs(pages * 4, seed)
+    for number in range(pages):
+        page = doc.new_page()
+        body = "\n\n".join(next(texts) for _ in range(4))
+        page.insert_textbox(fitz.Rect(50, 50, 545, 760), body, fontsize=10)
+        page.insert_text((50, 800), f"Store Help Center - page {number + 1}", fontsize=8)
+    doc.save(path)
+    doc.close()
+
+
+def make_docx(path: str, paragraph_count: int, seed: int = 0):
+    from docx import Document
+
+    doc = Document()
+    for text in paragraphs(paragraph_count, seed):
+        doc.add_paragraph(text)
+    doc.save(path)
+
+
+def make_catalog(site_id: str, products: int, seed: int = 0, changed: int = 0) -> dict:
+    """
+    A /plugin/api payload with the given number of products. The first
+    `changed` products get a different price, to benchmark incremental syncs.
+    """
+    rng = random.Random(seed)
+    items = []
+    for i in range(products):
+        name = f"{rng.choice(WORDS).capitalize()} {rng.choice(WORDS)} {i}"
+        price = round(rng.uniform(5, 500), 2) + (1 if i < changed else 0)
+        items.append({
+            "id": i,
+            "title": name,
+            "link": f"https://store.example/product/{i}/",
+            "description": "<p>" + " ".join(sentence(rng) for _ in range(rng.randint(2, 6))) + "</p>",
+            "short_description": sentence(rng),
+            "price": str(price),
+            "stock_status": rng.choice(["instock", "outofstock", "onbackorder"]),
+        })
+    return {"site_url": "https://store.example", "site_id": site_id, "products": items}
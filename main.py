@@ -1,11 +1,60 @@
+from contextlib import asynccontextmanager
+import asyncio
+import logging
 from fastapi import FastAPI
 from pymongo import MongoClient
 from fastapi.middleware.cors import CORSMiddleware
 from bson import ObjectId
 from Routes.pluginRouter import router as pluginRouter
+from Routes.metricsRouter import router as metricsRouter, MetricsMiddleware
+from Routes.healthRouter import router as healthRouter
+from Model.embeddingModel import embedding_service
+from Model.openRouterClient import openrouter_client
+from Model import pluginModel
+from Model.jobModel import job_manager
+from Model.sessionModel import chat_sessions
+from Model.generationModel import index_generations
+from Model.extractionModel import shutdown_extraction_pool
+from Model.metricsModel import configure_logging
 
-app = FastAPI()
+configure_logging()
+
+logger = logging.getLogger(__name__)
+
+
+async def warm_up():
+    """Warms the embedding model up off the event loop; /ready reports ready once it is done."""
+    try:
+        await asyncio.to_thread(embedding_service.warmup)
+    except Exception:
+        logger.exception("Embedding model warmup failed")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Warm the embedding model up in the background so the worker answers
+    # /health at once; with serve.py it was already loaded before the fork
+    warmup = asyncio.create_task(warm_up())
+    pluginModel.connect()
+    await pluginModel.ensure_indexes()
+    await index_generations.adopt_legacy()
+    job_manager.start()
+    app.state.started = True
+    yield
+    warmup.cancel()
+    await job_manager.stop()
+    await chat_sessions.close()
+    await index_generations.close()
+    await openrouter_client.aclose()
+    embedding_service.shutdown()
+    shutdown_extraction_pool()
+    pluginModel.close()
+
+
+app = FastAPI(lifespan=lifespan)
 app.include_router(pluginRouter, prefix='/plugin')
+app.include_router(metricsRouter)
+app.include_router(healthRouter)
 
 app.add_middleware(
     CORSMiddleware,
@@ -14,8 +63,10 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(MetricsMiddleware)
 
-# Add this block so we can run via "python main.py"
+# Add this block so we can run via "python main.py" (development server;
+# use "python serve.py" in production)
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
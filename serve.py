@@ -0,0 +1,73 @@
+"""
+Production entry point: gunicorn with uvicorn workers.
+
+The embedding model is loaded and warmed up once in the gunicorn master,
+before the workers are forked, so its weights are shared copy-on-write
+instead of being loaded again by every worker. Workers report ready on
+/ready once their own startup (Mongo, job workers, warmup) is done.
+
+    python serve.py
+
+Configured with WEB_CONCURRENCY (number of workers), HOST, PORT,
+SERVE_PRELOAD ("false" loads the model in each worker instead) and
+SERVE_TIMEOUT.
+
+WEB_CONCURRENCY defaults to 2. State that has to agree between workers
+goes through Mongo or the disk: ingestion job statuses and the one
+running job per site (ingest_jobs, ingest_locks), chat sessions, the
+site content version that invalidates cached answers, and the local
+vector and lexical indexes, which a worker reloads when another one has
+saved a newer version. What stays per worker is only a cache or a limit:
+
+- SITE_MAX_CONCURRENCY, SITE_RATE_LIMIT and SITE_RATE_BURST apply in
+  each worker, so a site can get up to WEB_CONCURRENCY times as much;
+- identical concurrent questions are only coalesced within a worker,
+  and query embeddings are cached per worker;
+- a re-ingestion reaches the other workers' answer caches and generation
+  pointers within SITE_VERSION_CACHE_TTL / GENERATION_CACHE_TTL seconds.
+"""
+import os
+
+from dotenv import load_dotenv
+from gunicorn.app.base import BaseApplication
+
+load_dotenv()
+
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "2"))
+HOST = os.getenv("HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", "8000"))
+SERVE_PRELOAD = os.getenv("SERVE_PRELOAD", "true").lower() == "true"
+SERVE_TIMEOUT = int(os.getenv("SERVE_TIMEOUT", "120"))
+
+
+class Server(BaseApplication):
+    def __init__(self, options: dict):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        from main import app
+        if SERVE_PRELOAD:
+            from Model.embeddingModel import embedding_service
+            embedding_service.preload()
+        return app
+
+
+def main():
+    Server({
+        "bind": f"{HOST}:{PORT}",
+        "workers": WEB_CONCURRENCY,
+        "worker_class": "uvicorn.workers.UvicornWorker",
+        # Import the app (and preload the model) in the master before forking
+        "preload_app": SERVE_PRELOAD,
+        "timeout": SERVE_TIMEOUT,
+        "graceful_timeout": SERVE_TIMEOUT,
+    }).run()
+
+
+if __name__ == "__main__":
+    main()
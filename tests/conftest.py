@@ -0,0 +1,79 @@
+"""
+Shared fixtures. The mongo fixture patches an in-memory Mongo (mongomock
+behind a minimal motor-like async wrapper) into the models, so the ingest
+and index code can be tested without a server.
+"""
+import pytest
+
+
+class AsyncCursor:
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def sort(self, *args, **kwargs):
+        self.cursor = self.cursor.sort(*args, **kwargs)
+        return self
+
+    def limit(self, count):
+        self.cursor = self.cursor.limit(count)
+        return self
+
+    async def to_list(self, length=None):
+        return list(self.cursor)
+
+    def __aiter__(self):
+        self._iterator = iter(self.cursor)
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._iterator)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class AsyncCollection:
+    """The motor collection methods the app uses, run on a mongomock collection."""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def find(self, *args, **kwargs):
+        return AsyncCursor(self.collection.find(*args, **kwargs))
+
+    def aggregate(self, *args, **kwargs):
+        return AsyncCursor(self.collection.aggregate(*args, **kwargs))
+
+    def __getattr__(self, name):
+        method = getattr(self.collection, name)
+
+        async def call(*args, **kwargs):
+            return method(*args, **kwargs)
+        return call
+
+
+@pytest.fixture
+def mongo(monkeypatch):
+    """The docEmbeddings database, in memory, used by every model for the test."""
+    mongomock = pytest.importorskip("mongomock")
+    db = mongomock.MongoClient().docEmbeddings
+    chunks = AsyncCollection(db.chunks)
+    generations = AsyncCollection(db.index_generations)
+    sessions = AsyncCollection(db.chat_sessions)
+    jobs = AsyncCollection(db.ingest_jobs)
+    locks = AsyncCollection(db.ingest_locks)
+    site_versions = AsyncCollection(db.site_versions)
+
+    from Controllers import apiController, pluginController
+    from Model import cacheModel, pluginModel, generationModel, jobModel, retrieverModel
+    for module in (pluginModel, generationModel, retrieverModel, apiController, pluginController):
+        monkeypatch.setattr(module, "AsyncModel", lambda: chunks)
+    monkeypatch.setattr(retrieverModel, "Model", lambda: db.chunks)
+    monkeypatch.setattr(pluginModel, "GenerationModel", lambda: generations)
+    monkeypatch.setattr(generationModel, "GenerationModel", lambda: generations)
+    monkeypatch.setattr(pluginModel, "SessionModel", lambda: sessions)
+    monkeypatch.setattr(jobModel, "JobModel", lambda: jobs)
+    monkeypatch.setattr(jobModel, "JobLockModel", lambda: locks)
+    monkeypatch.setattr(cacheModel, "SiteVersionModel", lambda: site_versions)
+    generationModel.index_generations._current.clear()
+    return db
@@ -0,0 +1,132 @@
+"""
+Admission control of the chat path (Model/admissionModel.py): token
+buckets, per-site limits, and single-flight coalescing of identical
+requests.
+"""
+import asyncio
+
+import pytest
+
+from Model import admissionModel
+from Model.admissionModel import AdmissionController, AdmissionRejected, SingleFlight, TokenBucket
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(admissionModel.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_token_bucket_bursts_then_refills(clock):
+    bucket = TokenBucket(rate=2, capacity=3)
+    assert [bucket.take() for _ in range(3)] == [0, 0, 0]
+    assert bucket.take() == pytest.approx(0.5)
+    clock[0] += 0.5
+    assert bucket.take() == 0
+    # Never refills above its capacity
+    clock[0] += 100
+    assert [bucket.take() for _ in range(3)] == [0, 0, 0]
+    assert bucket.take() > 0
+
+
+def test_rate_limit_is_per_site(clock):
+    admission = AdmissionController(max_concurrency=0, rate=1, burst=2)
+    admission.acquire("a")
+    admission.acquire("a")
+    with pytest.raises(AdmissionRejected) as rejected:
+        admission.acquire("a")
+    assert rejected.value.reason == "rate" and rejected.value.retry_after == 1
+    admission.acquire("b")
+
+
+def test_concurrency_limit_until_release():
+    admission = AdmissionController(max_concurrency=2, rate=0)
+    admission.acquire("a")
+    admission.acquire("a")
+    with pytest.raises(AdmissionRejected) as rejected:
+        admission.acquire("a")
+    assert rejected.value.reason == "concurrency"
+    admission.release("a")
+    admission.acquire("a")
+    admission.release("a")
+    admission.release("a")
+    assert admission._in_flight == {}
+
+
+def test_single_flight_shares_one_call():
+    calls = []
+
+    async def run():
+        flight = SingleFlight()
+        release = asyncio.Event()
+
+        async def answer():
+            calls.append(1)
+            await release.wait()
+            return "answer"
+
+        waiters = [asyncio.create_task(flight.do("key", answer)) for _ in range(3)]
+        await asyncio.sleep(0)
+        assert flight.in_flight() == 1
+        release.set()
+        results = await asyncio.gather(*waiters)
+        assert flight.in_flight() == 0
+        assert await flight.do("key", answer) == "answer"
+        return results
+
+    assert asyncio.run(run()) == ["answer"] * 3
+    assert len(calls) == 2
+
+
+def test_single_flight_shares_exceptions_and_survives_cancelled_waiters():
+    async def run():
+        flight = SingleFlight()
+        release = asyncio.Event()
+
+        async def fail():
+            await release.wait()
+            raise ValueError("no answer")
+
+        first = asyncio.create_task(flight.do("key", fail))
+        second = asyncio.create_task(flight.do("key", fail))
+        await asyncio.sleep(0)
+        first.cancel()
+        release.set()
+        with pytest.raises(ValueError):
+            await second
+        assert first.cancelled()
+
+    asyncio.run(run())
+
+
+def test_join_rides_on_an_interactive_call_without_publishing():
+    async def run():
+        flight = SingleFlight()
+        release = asyncio.Event()
+        calls = []
+
+        async def answer(name):
+            calls.append(name)
+            await release.wait()
+            return name
+
+        interactive = asyncio.create_task(flight.do("q", lambda: answer("chat")))
+        await asyncio.sleep(0)
+        # A batch item joins the chat call already in flight
+        joined = asyncio.create_task(flight.do(("batch", "q"), lambda: answer("batch"), join="q"))
+        release.set()
+        assert await asyncio.gather(interactive, joined) == ["chat", "chat"]
+
+        release.clear()
+        # With no chat call in flight the batch call runs under its own key,
+        # which a later chat call does not wait for
+        batch = asyncio.create_task(flight.do(("batch", "q"), lambda: answer("batch"), join="q"))
+        await asyncio.sleep(0)
+        chat = asyncio.create_task(flight.do("q", lambda: answer("chat")))
+        await asyncio.sleep(0)
+        release.set()
+        assert await asyncio.gather(batch, chat) == ["batch", "chat"]
+        return calls
+
+    assert asyncio.run(run()) == ["chat", "batch", "chat"]
@@ -0,0 +1,82 @@
+"""
+Token-sized chunking of documents (iter_chunks): size and overlap limits,
+long sentences, and dropping of duplicate chunks. Tokens are counted with
+a whitespace tokenizer, one token per word, instead of the model's.
+"""
+import pytest
+
+from Controllers import pluginController
+from Controllers.pluginController import iter_chunks
+
+
+@pytest.fixture
+def tokenizer():
+    tokenizers = pytest.importorskip("tokenizers")
+    from tokenizers.models import WordLevel
+    from tokenizers.pre_tokenizers import WhitespaceSplit
+
+    tokenizer = tokenizers.Tokenizer(WordLevel({"[UNK]": 0}, unk_token="[UNK]"))
+    tokenizer.pre_tokenizer = WhitespaceSplit()
+    return tokenizer
+
+
+@pytest.fixture(autouse=True)
+def max_seq_length(monkeypatch):
+    # Without loading the embedding model
+    monkeypatch.setattr(type(pluginController.embedding_service), "max_seq_length", 512)
+
+
+def sentences(count: int, words: int = 5) -> str:
+    return " ".join(" ".join(f"s{i}w{j}" for j in range(words - 1)) + f" s{i}end." for i in range(count))
+
+
+def chunks_of(pieces, tokenizer, max_tokens=20, overlap_tokens=5):
+    return list(iter_chunks(pieces, max_tokens, overlap_tokens, tokenizer=tokenizer))
+
+
+def test_chunks_are_capped_and_overlap(tokenizer):
+    chunks = chunks_of([sentences(30)], tokenizer)
+    assert len(chunks) > 1
+    for chunk in chunks:
+        assert len(chunk.split()) <= 20
+    for previous, chunk in zip(chunks, chunks[1:]):
+        # Whole sentences of 5 tokens: the overlap is the previous chunk's last sentence
+        assert chunk.split()[:5] == previous.split()[-5:]
+    words = " ".join(chunks).split()
+    assert all(f"s{i}end." in words for i in range(30))
+
+
+def test_sentences_longer_than_a_chunk_are_cut(tokenizer):
+    text = " ".join(f"w{i}" for i in range(95))
+    chunks = chunks_of([text], tokenizer)
+    # Windows of 20 tokens; the last, shorter one also gets the overlap
+    assert [len(chunk.split()) for chunk in chunks] == [20, 20, 20, 20, 20]
+    assert chunks[-1].split() == text.split()[-20:]
+    assert sorted(set(" ".join(chunks).split())) == sorted(text.split())
+
+
+def test_sentences_carry_over_pieces(tokenizer):
+    text = sentences(10)
+    middle = len(text) // 2
+    assert chunks_of([text[:middle], text[middle:]], tokenizer) == chunks_of([text], tokenizer)
+
+
+def test_duplicate_chunks_are_dropped(tokenizer):
+    header = "ACME   Corp. Confidential."
+    pages = [f"{header} ", f"{' '.join(header.split())} "] * 3
+    chunks = chunks_of(pages, tokenizer, max_tokens=3, overlap_tokens=0)
+    # Compared with whitespace normalized, the first one is kept as it is
+    assert chunks == [header]
+
+
+def test_limits_are_clamped(tokenizer, monkeypatch):
+    monkeypatch.setattr(type(pluginController.embedding_service), "max_seq_length", 10)
+    chunks = chunks_of([sentences(10, words=2)], tokenizer, max_tokens=100, overlap_tokens=100)
+    # Capped to max_seq_length minus the two special tokens, overlap to half of that
+    assert max(len(chunk.split()) for chunk in chunks) == 8
+    for previous, chunk in zip(chunks, chunks[1:]):
+        assert chunk.split()[:4] == previous.split()[-4:]
+
+
+def test_empty_text(tokenizer):
+    assert chunks_of(["", "   "], tokenizer) == []
@@ -0,0 +1,75 @@
+"""
+Versioned index generations (Model/generationModel.py): numbering,
+publishing, collection of the replaced generations, and discarding of a
+generation that loses the publish.
+"""
+import asyncio
+
+from Model.generationModel import LEGACY_GENERATION, IndexGenerations
+
+
+def chunks(mongo, site_id: str, generation=None, count: int = 2):
+    for i in range(count):
+        doc = {"site_id": site_id, "for": "blogSites", "text": f"chunk {i}"}
+        if generation is not None:
+            doc["generation"] = generation
+        mongo.chunks.insert_one(doc)
+
+
+def generations_of(mongo, site_id: str):
+    return sorted(doc.get("generation", -1) for doc in mongo.chunks.find({"site_id": site_id}))
+
+
+def test_publish_collects_older_generations(mongo):
+    generations = IndexGenerations(cache_ttl=0, gc_delay=0)
+
+    async def run():
+        assert await generations.current("s", "blogSites") is None
+        first = await generations.begin("s", "blogSites")
+        second = await generations.begin("s", "blogSites")
+        assert (first, second) == (1, 2)
+        chunks(mongo, "s")
+        chunks(mongo, "s", first)
+        chunks(mongo, "s", second)
+        chunks(mongo, "other", first)
+
+        assert await generations.publish("s", "blogSites", second)
+        assert await generations.current("s", "blogSites") == second
+        await asyncio.gather(*generations._tasks)
+
+    asyncio.run(run())
+    assert generations_of(mongo, "s") == [2, 2]
+    assert generations_of(mongo, "other") == [1, 1]
+
+
+def test_older_generation_loses_the_publish(mongo):
+    generations = IndexGenerations(cache_ttl=0, gc_delay=3600)
+
+    async def run():
+        slow = await generations.begin("s", "blogSites")
+        fast = await generations.begin("s", "blogSites")
+        chunks(mongo, "s", slow)
+        chunks(mongo, "s", fast)
+        assert await generations.publish("s", "blogSites", fast)
+        assert not await generations.publish("s", "blogSites", slow)
+        assert await generations.current("s", "blogSites") == fast
+        await generations.close()
+
+    asyncio.run(run())
+    assert generations_of(mongo, "s") == [2, 2]
+
+
+def test_discard(mongo):
+    generations = IndexGenerations(cache_ttl=0)
+    chunks(mongo, "s", 1)
+    chunks(mongo, "s", 2)
+    asyncio.run(generations.discard("s", "blogSites", 2))
+    assert generations_of(mongo, "s") == [1, 1]
+
+
+def test_adopt_legacy_only_tags_unversioned_chunks(mongo):
+    chunks(mongo, "s")
+    chunks(mongo, "s", 3)
+    mongo.chunks.insert_one({"site_id": "s", "for": "WooCommerce", "product_key": "p"})
+    asyncio.run(IndexGenerations().adopt_legacy())
+    assert generations_of(mongo, "s") == [-1, LEGACY_GENERATION, LEGACY_GENERATION, 3, 3]
@@ -0,0 +1,68 @@
+"""
+Hybrid retrieval: reciprocal rank fusion of the vector and lexical
+rankings, and the BM25 index behind the lexical one
+(Model/lexicalIndexModel.py).
+"""
+import asyncio
+
+import pytest
+
+from Controllers.pluginController import reciprocal_rank_fusion
+from Model.lexicalIndexModel import LexicalIndex, exact_key, tokenize
+
+
+def test_rrf_sums_reciprocal_ranks():
+    ids, scores = reciprocal_rank_fusion([["a", "b", "c"], ["c", "a"]], limit=10, k=60)
+    assert ids == ["a", "c", "b"]
+    assert scores["a"] == pytest.approx(1 / 61 + 1 / 62)
+    assert scores["c"] == pytest.approx(1 / 63 + 1 / 61)
+    assert scores["b"] == pytest.approx(1 / 62)
+
+
+def test_rrf_prefers_agreement_over_one_top_rank():
+    ids, _ = reciprocal_rank_fusion([["solo", "both"], ["other", "both"]], limit=1, k=1)
+    assert ids == ["both"]
+
+
+def test_rrf_limit_and_empty_rankings():
+    ids, scores = reciprocal_rank_fusion([["a", "b", "c"], []], limit=2)
+    assert ids == ["a", "b"] and len(scores) == 3
+    assert reciprocal_rank_fusion([], limit=5) == ([], {})
+
+
+def test_compound_tokens_are_indexed_whole_and_by_part():
+    assert tokenize("USB-C cable, SKU AB-12/3") == ["usb-c", "usb", "c", "cable", "sku", "ab-12/3", "ab", "12", "3"]
+    assert exact_key("  Blue T-Shirt! ") == "blue t-shirt"
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = LexicalIndex(str(tmp_path))
+    products = [
+        {"for": "WooCommerce", "name": "Trail running shoe", "sku": "TR-100", "description": "Light shoe"},
+        {"for": "WooCommerce", "name": "Rain jacket", "sku": "RJ-200", "description": "For running in the rain"},
+    ]
+    chunks = [{"for": "blogSites", "text": "Our returns policy: shoes can be returned within 30 days."}]
+    asyncio.run(index.upsert("s", "WooCommerce", ["p1", "p2"], products))
+    asyncio.run(index.upsert("s", "blogSites", ["c1"], chunks))
+    return index
+
+
+def test_bm25_ranks_name_matches_first(index):
+    result = asyncio.run(index.search("s", "running shoe"))
+    assert [doc_id for doc_id, _ in result.hits][:2] == ["p1", "p2"]
+    assert result.exact == []
+
+
+def test_exact_name_or_sku(index):
+    assert asyncio.run(index.search("s", "trail running SHOE")).exact == ["p1"]
+    assert asyncio.run(index.search("s", "do you have rj-200 in blue")).exact == ["p2"]
+
+
+def test_delete_and_commit(index, tmp_path):
+    asyncio.run(index.delete("s", "WooCommerce", ["p1"]))
+    asyncio.run(index.commit("s", "WooCommerce"))
+    asyncio.run(index.commit("s", "blogSites"))
+    reloaded = LexicalIndex(str(tmp_path))
+    hits = asyncio.run(reloaded.search("s", "light shoe returns")).hits
+    assert [doc_id for doc_id, _ in hits] == ["c1"]
@@ -0,0 +1,102 @@
+"""
+Incremental WooCommerce sync (sync_woocommerce_products): only new or
+changed products are embedded, removed and stale ones are deleted, and
+the local vector and lexical indexes follow the collection.
+"""
+import asyncio
+import hashlib
+
+import numpy as np
+import pytest
+
+from Controllers import apiController
+from Controllers.apiController import WooCommerceProducts, sync_woocommerce_products
+from Model.lexicalIndexModel import LexicalIndex
+from Model.retrieverModel import LocalRetriever
+
+
+@pytest.fixture
+def embedded(monkeypatch):
+    """Texts passed to the embedding model, one list per call."""
+    calls = []
+
+    async def embed(texts):
+        calls.append(list(texts))
+        return np.array([
+            np.frombuffer(hashlib.sha256(text.encode()).digest()[:16], dtype=np.uint8).astype(np.float32)
+            for text in texts
+        ])
+
+    monkeypatch.setattr(apiController, "embed", embed)
+    return calls
+
+
+@pytest.fixture
+def indexes(mongo, tmp_path, monkeypatch):
+    retriever = LocalRetriever(str(tmp_path / "vectors"))
+    lexical = LexicalIndex(str(tmp_path / "lexical"))
+    monkeypatch.setattr(apiController, "retriever", retriever)
+    monkeypatch.setattr(apiController, "lexical_index", lexical)
+    return retriever, lexical
+
+
+def product(product_id, title, description="A product"):
+    return {"id": product_id, "title": title, "description": description, "price": "10",
+            "link": f"https://s.example/p/{product_id}", "sku": f"SKU-{product_id}"}
+
+
+def sync(*products):
+    payload = WooCommerceProducts(site_url="https://s.example", site_id="s", products=list(products))
+    return asyncio.run(sync_woocommerce_products(payload))
+
+
+def stored(mongo):
+    return {doc["product_key"]: doc for doc in mongo.chunks.find({"site_id": "s", "for": "WooCommerce"})}
+
+
+def test_only_new_and_changed_products_are_embedded(mongo, embedded, indexes):
+    retriever, lexical = indexes
+    result = sync(product(1, "Red mug"), product(2, "Blue plate"), product(3, "Green bowl"))
+    assert (result["inserted"], result["updated"], result["deleted"], result["unchanged"]) == (3, 0, 0, 0)
+    first = stored(mongo)
+
+    result = sync(product(1, "Red mug"), product(2, "Blue plate", "Now dishwasher safe"), product(4, "Teapot"))
+    assert (result["inserted"], result["updated"], result["deleted"], result["unchanged"]) == (1, 1, 1, 1)
+    assert [len(texts) for texts in embedded] == [3, 2]
+
+    second = stored(mongo)
+    assert set(second) == {"1", "2", "4"}
+    # Updated in place, unchanged ones untouched
+    assert second["2"]["_id"] == first["2"]["_id"]
+    assert second["2"]["content_hash"] != first["2"]["content_hash"]
+    assert second["1"] == first["1"]
+
+    partition = retriever.partition("s", "WooCommerce")
+    assert set(partition.rows) == {str(doc["_id"]) for doc in second.values()}
+    assert asyncio.run(lexical.search("s", "bowl")).hits == []
+    assert asyncio.run(lexical.search("s", "SKU-4")).exact == [str(second["4"]["_id"])]
+
+
+def test_resync_of_the_same_catalog_writes_nothing(mongo, embedded, indexes):
+    sync(product(1, "Red mug"))
+    result = sync(product(1, "Red mug"))
+    assert (result["inserted"], result["updated"], result["deleted"], result["unchanged"]) == (0, 0, 0, 1)
+    assert len(embedded) == 1
+
+
+def test_repeated_key_keeps_the_last_copy(mongo, embedded, indexes):
+    result = sync(product(1, "Old title"), product(1, "New title"))
+    assert result["inserted"] == 1
+    assert stored(mongo)["1"]["name"] == "New title"
+
+
+def test_stale_documents_are_deleted(mongo, embedded, indexes):
+    sync(product(1, "Red mug"))
+    duplicate = dict(stored(mongo)["1"])
+    del duplicate["_id"]
+    mongo.chunks.insert_one(duplicate)
+    mongo.chunks.insert_one({"site_id": "s", "for": "WooCommerce", "name": "Before product keys"})
+
+    result = sync(product(1, "Red mug"))
+    assert result["deleted"] == 2 and result["unchanged"] == 1
+    assert mongo.chunks.count_documents({"site_id": "s", "for": "WooCommerce"}) == 1
@@ -0,0 +1,22 @@
+"""
+Import smoke test: the app imports on this Python with the pinned
+dependencies and registers its routes. Needs no MongoDB or embedding
+model, since both are only used once the app starts.
+
+    python -m pytest -q tests
+"""
+
+
+def test_app_imports_and_registers_routes():
+    import main
+    paths = {route.path for route in main.app.routes}
+    for path in ("/plugin/chat", "/plugin/chat/stream", "/plugin/chat/batch", "/plugin/doc", "/plugin/docs",
+                 "/plugin/api", "/plugin/jobs/{job_id}", "/health", "/ready"):
+        assert path in paths
+
+
+def test_server_defaults_to_several_workers(monkeypatch):
+    import importlib
+    import serve
+    monkeypatch.delenv("WEB_CONCURRENCY", raising=False)
+    assert importlib.reload(serve).WEB_CONCURRENCY > 1
@@ -0,0 +1,92 @@
+"""
+Round trips of the stored embedding formats (Model/vectorCodec.py), and
+the decoding of documents read back from Mongo by the local vector index
+backfill.
+"""
+import asyncio
+
+import bson
+import numpy as np
+import pytest
+from bson.binary import Binary
+
+from Model.vectorCodec import (
+    INT8, VECTOR_SUBTYPE, decode_vector, encode_vector, query_vector, storage_format_of,
+)
+
+
+@pytest.fixture
+def vector():
+    return np.random.default_rng(0).normal(size=384).astype(np.float32)
+
+
+@pytest.mark.parametrize("storage_format", ["list", "float32"])
+def test_lossless_formats_round_trip(vector, storage_format):
+    stored = encode_vector(vector, storage_format)
+    assert storage_format_of(stored) == storage_format
+    np.testing.assert_array_equal(decode_vector(stored), vector)
+
+
+def test_float32_is_a_bson_binary_vector(vector):
+    stored = encode_vector(vector, "float32")
+    assert isinstance(stored, Binary) and stored.subtype == VECTOR_SUBTYPE
+    assert len(stored) == 2 + 4 * len(vector)
+
+
+def test_int8_keeps_the_direction(vector):
+    stored = encode_vector(vector, "int8")
+    assert storage_format_of(stored) == "int8" and stored[0] == INT8
+    assert len(stored) == 2 + len(vector)
+    decoded = decode_vector(stored)
+    cosine = decoded @ vector / (np.linalg.norm(decoded) * np.linalg.norm(vector))
+    assert cosine > 0.999
+
+
+def test_int8_of_a_zero_vector():
+    decoded = decode_vector(encode_vector(np.zeros(8), "int8"))
+    np.testing.assert_array_equal(decoded, np.zeros(8, dtype=np.float32))
+
+
+@pytest.mark.parametrize("storage_format", ["list", "float32", "int8"])
+def test_decodes_values_read_back_from_bson(vector, storage_format):
+    # What motor/pymongo hand back: float lists, or bytes for binary vectors
+    stored = bson.decode(bson.encode({"embeddings": encode_vector(vector, storage_format)}))["embeddings"]
+    decoded = decode_vector(stored)
+    assert decoded.dtype == np.float32 and decoded.shape == vector.shape
+    if storage_format != "int8":
+        np.testing.assert_array_equal(decoded, vector)
+
+
+def test_float32_decodes_without_copying(vector):
+    stored = encode_vector(vector, "float32")
+    decoded = decode_vector(stored)
+    assert not decoded.flags.writeable and not decoded.flags.owndata
+
+
+def test_query_vector_keeps_full_precision(vector):
+    assert storage_format_of(query_vector(vector, "int8")) == "float32"
+    assert isinstance(query_vector(vector, "list"), list)
+
+
+def test_unknown_format():
+    with pytest.raises(ValueError):
+        encode_vector([1.0], "float16")
+    with pytest.raises(ValueError):
+        decode_vector(bytes((0x10, 0)) + b"\0\0")
+
+
+def test_local_index_backfill_decodes_stored_vectors(mongo, tmp_path):
+    from Model.retrieverModel import LocalRetriever
+
+    rng = np.random.default_rng(1)
+    stored = {storage_format: rng.normal(size=384) for storage_format in ("list", "float32", "int8")}
+    for storage_format, value in stored.items():
+        mongo.chunks.insert_one({"_id": storage_format, "site_id": "s", "for": "WooCommerce",
+                                 "embeddings": encode_vector(value, storage_format)})
+
+    retriever = LocalRetriever(str(tmp_path))
+    for storage_format, value in stored.items():
+        results = asyncio.run(retriever.search("s", value, limit=1))
+        assert results[0]["_id"] == storage_format
+        assert results[0]["score"] == pytest.approx(1.0, abs=1e-3)
+    assert retriever.partition("s", "WooCommerce").size == 3
@@ -0,0 +1,123 @@
+"""
+The NDJSON catalog stream of POST /plugin/api: parsing of the body as it
+arrives (parse_woocommerce_stream), and refusal of a stream for a site
+that is already being ingested.
+"""
+import asyncio
+import datetime
+import json
+
+import pytest
+from fastapi import HTTPException
+
+from Controllers import apiController
+from Controllers.apiController import parse_woocommerce_stream
+
+
+def ndjson(*lines) -> bytes:
+    return b"".join(json.dumps(line).encode() + b"\n" for line in lines)
+
+
+class StreamedRequest:
+    """The request.stream() of a body received in the given chunks."""
+
+    def __init__(self, *chunks: bytes):
+        self.chunks = chunks
+
+    async def stream(self):
+        for chunk in self.chunks:
+            yield chunk
+
+
+def parse(*chunks: bytes):
+    async def run():
+        site, products = await parse_woocommerce_stream(StreamedRequest(*chunks))
+        return site, [product async for product in products]
+    return asyncio.run(run())
+
+
+def test_header_pages_and_single_products():
+    body = ndjson(
+        {"site_url": "https://s.example", "site_id": "s", "products": [{"id": 1}]},
+        {"products": [{"id": 2}, {"id": 3}]},
+        {"id": 4},
+    )
+    site, products = parse(body)
+    assert (site.site_id, site.site_url) == ("s", "https://s.example")
+    assert [product["id"] for product in products] == [1, 2, 3, 4]
+
+
+def test_lines_split_across_chunks_and_blank_lines():
+    body = ndjson({"site_url": "u", "site_id": "s"}) + b"\n  \n" + ndjson({"id": 1}) + b'{"id": 2}'
+    chunks = [body[i:i + 3] for i in range(0, len(body), 3)]
+    _, products = parse(*chunks)
+    assert products == [{"id": 1}, {"id": 2}]
+
+
+@pytest.mark.parametrize("body, message", [
+    (b"", "the body is empty"),
+    (b"[1]\n", "line 1 is not a JSON object"),
+    (b'{"site_id": "s"}\n', "line 1"),
+])
+def test_invalid_header(body, message):
+    with pytest.raises(HTTPException) as raised:
+        parse(body)
+    assert raised.value.status_code == 400 and message in raised.value.detail
+
+
+@pytest.mark.parametrize("line, message", [
+    (b"{not json\n", "line 3 is not JSON"),
+    (b"7\n", "line 3 is not a JSON object"),
+    (b'{"products": [1]}\n', "line 3"),
+])
+def test_invalid_line_is_reported_with_its_number(line, message):
+    body = ndjson({"site_url": "u", "site_id": "s"}, {"id": 1}) + line
+    with pytest.raises(HTTPException) as raised:
+        parse(body)
+    assert raised.value.status_code == 400 and message in raised.value.detail
+
+
+def test_line_longer_than_the_limit(monkeypatch):
+    monkeypatch.setattr(apiController, "NDJSON_MAX_LINE_BYTES", 16)
+    with pytest.raises(HTTPException) as raised:
+        parse(b'{"site_url": "u", ', b'"site_id": "s"}\n')
+    assert raised.value.status_code == 413
+
+
+@pytest.fixture
+def client(mongo):
+    from fastapi.testclient import TestClient
+    import main
+    # Without the lifespan: no job workers, so nothing is ingested
+    return TestClient(main.app)
+
+
+def test_stream_for_a_site_leased_elsewhere_is_refused(mongo, client):
+    expires_at = datetime.datetime.utcnow() + datetime.timedelta(seconds=60)
+    mongo.ingest_locks.insert_one({"_id": "s", "owner": "other-job", "expires_at": expires_at})
+
+    response = client.post("/plugin/api", content=ndjson({"site_url": "https://s.example", "site_id": "s"}),
+                           headers={"Content-Type": "application/x-ndjson"})
+    assert response.status_code == 409
+    assert response.json()["job_id"] == "other-job"
+    assert response.json()["status_url"] == "/plugin/jobs/other-job"
+    assert int(response.headers["Retry-After"]) >= 1
+
+
+def test_expired_lease_does_not_block(mongo):
+    from Model.jobModel import JobManager
+
+    mongo.ingest_locks.insert_one({"_id": "s", "owner": "old-job",
+                                   "expires_at": datetime.datetime.utcnow() - datetime.timedelta(seconds=1)})
+    assert asyncio.run(JobManager().busy_job("s")) is None
+
+
+def test_unfinished_local_job_is_busy(mongo):
+    from Model.jobModel import Job, JobManager
+
+    manager = JobManager()
+    job = Job("s", "WooCommerce", run=None)
+    manager.jobs[job.id] = job
+    assert asyncio.run(manager.busy_job("s")) == job.id
+    job.status = "succeeded"
+    assert asyncio.run(manager.busy_job("s")) is None